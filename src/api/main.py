@@ -1,6 +1,15 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from src.api.proxy import forward, served_locally
 from src.api.routes import libraries, documents, chunks, indexing
+from src.core.services.library_service import DimensionMismatch, IdConflict
+from src.core.services.shared_catalog import ROLE
+from src.utils.admission import DeadlineExceeded, Overloaded
+from src.utils.concurrent import LockTimeout
+from src.utils.instrumentation import REGISTRY, REQUEST_SECONDS, configure_logging
 
+configure_logging()
 app = FastAPI()
 
 # include the routes
@@ -10,6 +19,71 @@ app.include_router(chunks.router, prefix="/chunks", tags=["chunks"])
 app.include_router(indexing.router, prefix="/indexing", tags=["indexing"])
 
 
+@app.exception_handler(LockTimeout)
+def lock_timeout_handler(request: Request, exc: LockTimeout):
+    # the library is busy (e.g. a long write); the client may retry
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.exception_handler(DimensionMismatch)
+def dimension_mismatch_handler(request: Request, exc: DimensionMismatch):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(IdConflict)
+def id_conflict_handler(request: Request, exc: IdConflict):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(Overloaded)
+def overloaded_handler(request: Request, exc: Overloaded):
+    # shed load instead of queueing without bound
+    return JSONResponse(
+        status_code=429, content={"detail": str(exc)}, headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+def deadline_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+if ROLE == "reader":
+
+    @app.middleware("http")
+    async def forward_to_writer(request: Request, call_next):
+        # a reader only searches; every other request goes to the single writer
+        if served_locally(request.url.path):
+            return await call_next(request)
+        request.scope["endpoint"] = forward
+        return await forward(request)
+
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # label by endpoint, not path, to keep the number of series bounded
+    endpoint = request.scope.get("endpoint")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        request.method,
+        endpoint.__name__ if endpoint else "unmatched",
+        str(response.status_code),
+    )
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Latency and index build histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Vector Database API!"}
@@ -0,0 +1,101 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[List[float]] = Field(
+        ..., description="The query embeddings, one list of floats per query"
+    )
+    k: int = Field(5, description="The number of nearest neighbors per query")
+    ef_search: Optional[int] = Field(
+        None, description="HNSW beam width; higher trades latency for recall"
+    )
+    nprobe: Optional[int] = Field(
+        None, description="IVF cells scanned; higher trades latency for recall"
+    )
+    filter: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Only return chunks whose metadata matches, e.g. "
+        '{"author": "Jane", "tags": {"in": ["ai"]}, "year": {"gte": 2000}}',
+    )
+    timeout: Optional[float] = Field(
+        None, gt=0, description="Seconds after which the search is abandoned (504)"
+    )
+
+
+class QueryResult(BaseModel):
+    ids: List[str] = Field(..., description="Ids of the nearest chunks")
+    distances: List[float] = Field(..., description="Distances to the nearest chunks")
+
+
+class BatchSearchResponse(BaseModel):
+    results: List[QueryResult] = Field(
+        ..., description="Nearest neighbors for each query, in request order"
+    )
+
+
+class HybridSearchRequest(BaseModel):
+    query_text: Optional[str] = Field(
+        None, description="Keywords matched against chunk text with BM25"
+    )
+    query_embedding: Optional[List[float]] = Field(
+        None, description="The query embedding searched in the library's index"
+    )
+    k: int = Field(5, gt=0, description="The number of results to return")
+    fusion: Literal["rrf", "weighted"] = Field(
+        "rrf",
+        description="How text and vector results are combined: reciprocal rank "
+        "fusion, or a weighted sum of min-max normalized scores",
+    )
+    alpha: float = Field(
+        0.5, ge=0, le=1, description="Weight of the vector results, 0 to 1"
+    )
+    rrf_k: int = Field(60, gt=0, description="Rank offset of reciprocal rank fusion")
+    candidates: Optional[int] = Field(
+        None,
+        gt=0,
+        description="Results taken from each of text and vector search before "
+        "fusing them (default: max(k, 50))",
+    )
+    ef_search: Optional[int] = Field(
+        None, description="HNSW beam width; higher trades latency for recall"
+    )
+    nprobe: Optional[int] = Field(
+        None, description="IVF cells scanned; higher trades latency for recall"
+    )
+    filter: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Only return chunks whose metadata matches, e.g. "
+        '{"author": "Jane", "tags": {"in": ["ai"]}, "year": {"gte": 2000}}',
+    )
+    timeout: Optional[float] = Field(
+        None, gt=0, description="Seconds after which the search is abandoned (504)"
+    )
+
+
+class HybridResult(BaseModel):
+    id: str = Field(..., description="Id of the chunk")
+    score: float = Field(..., description="Fused score; higher is better")
+    vector_rank: Optional[int] = Field(
+        None, description="Rank among the nearest neighbors, from 1; null if absent"
+    )
+    text_rank: Optional[int] = Field(
+        None, description="Rank among the BM25 text matches, from 1; null if absent"
+    )
+
+
+class HybridSearchResponse(BaseModel):
+    results: List[HybridResult] = Field(..., description="Results, best first")
+
+
+class RecallRequest(BaseModel):
+    queries: List[List[float]] = Field(
+        ..., description="The query embeddings used to measure recall"
+    )
+    k: int = Field(10, description="The number of nearest neighbors compared")
+    ef_search: Optional[int] = Field(
+        None, description="HNSW beam width; higher trades latency for recall"
+    )
+    nprobe: Optional[int] = Field(
+        None, description="IVF cells scanned; higher trades latency for recall"
+    )
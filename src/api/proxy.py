@@ -0,0 +1,85 @@
+import os
+import threading
+import requests
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+# Writer process that reader processes forward everything but searches to
+WRITER_URL = os.environ.get("VECTOR_DB_WRITER_URL", "http://127.0.0.1:8001")
+# Seconds to wait for the writer's response, e.g. to a large bulk ingest
+FORWARD_TIMEOUT = float(os.environ.get("VECTOR_DB_FORWARD_TIMEOUT", "300"))
+
+# Paths a reader answers from its own process
+READER_PATHS = (
+    "/indexing/search/",
+    "/indexing/search_batch/",
+    "/indexing/search_binary/",
+    "/indexing/hybrid_search/",
+    "/indexing/cache",
+    "/indexing/admission",
+    "/metrics",
+    "/docs",
+    "/openapi.json",
+)
+# Headers that describe a single connection or the body as sent, not relayed
+HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "content-encoding",
+    "content-length",
+    "host",
+}
+
+_local = threading.local()
+
+
+def served_locally(path: str) -> bool:
+    return path == "/" or path.startswith(READER_PATHS)
+
+
+async def forward(request: Request) -> Response:
+    """
+    Relay a request to the writer process and its response back. The body
+    is buffered, so streamed bulk ingests reach the writer in one piece.
+    """
+    body = await request.body()
+    url = f"{WRITER_URL}{request.url.path}"
+    if request.url.query:
+        url = f"{url}?{request.url.query}"
+    try:
+        response = await run_in_threadpool(
+            _session().request,
+            request.method,
+            url,
+            data=body,
+            headers=_relayed(request.headers),
+            timeout=FORWARD_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        return JSONResponse(
+            status_code=503, content={"detail": f"Writer unavailable: {e}"}
+        )
+    return Response(
+        response.content,
+        status_code=response.status_code,
+        headers=_relayed(response.headers),
+    )
+
+
+def _relayed(headers) -> dict:
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() not in HOP_HEADERS
+    }
+
+
+def _session() -> requests.Session:
+    """
+    Connection pool of the calling thread; sessions are not thread-safe.
+    """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import APIRouter, HTTPException
 from src.core.models.chunk import Chunk
 from src.core.services.chunk_service import ChunkService
@@ -7,11 +8,14 @@ chunk_service = ChunkService()
 
 
 @router.post("/", response_model=Chunk)
-def create_chunk(chunk: Chunk):
+def create_chunk(chunk: Chunk, document_id: Optional[str] = None):
     """
-    Create a new chunk
+    Create a new chunk, optionally inside a document
     """
-    return chunk_service.create_chunk(chunk)
+    created = chunk_service.create_chunk(chunk, document_id)
+    if not created:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return created
 
 
 @router.get("/{chunk_id}", response_model=Chunk)
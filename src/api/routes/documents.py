@@ -1,17 +1,25 @@
-from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from src.core.models.chunk import Chunk
 from src.core.models.document import Document
 from src.core.services.document_service import DocumentService
+from src.utils.binary import decode_chunks
 
 router = APIRouter()
 document_service = DocumentService()
 
 
 @router.post("/", response_model=Document)
-def create_document(document: Document):
+def create_document(document: Document, library_id: Optional[str] = None):
     """
-    Create a new document
+    Create a new document, optionally inside a library
     """
-    return document_service.create_document(document)
+    created = document_service.create_document(document, library_id)
+    if not created:
+        raise HTTPException(status_code=404, detail="Library not found")
+    return created
 
 
 @router.get("/{document_id}", response_model=Document)
@@ -45,3 +53,41 @@ def delete_document(document_id: str):
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     return document
+
+
+@router.get("/{document_id}/chunks", response_model=List[Chunk])
+def list_document_chunks(
+    document_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Page through the chunks of a document
+    """
+    chunks = document_service.list_chunks(document_id, offset, limit)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return chunks
+
+
+@router.post("/{document_id}/chunks/binary", response_model=dict)
+async def add_chunks_binary(document_id: str, request: Request):
+    """
+    Append chunks to a document from a binary body: a JSON header of chunk
+    records followed by their embeddings as packed little-endian float32
+    (see `decode_chunks`). Embeddings are used in place, without parsing them
+    into lists of floats.
+    """
+    body = await request.body()
+    try:
+        records, embeddings = decode_chunks(body)
+        chunks = [
+            Chunk.model_validate({**record, "embedding": embedding})
+            for record, embedding in zip(records, embeddings)
+        ]
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    added = await run_in_threadpool(document_service.add_chunks, document_id, chunks)
+    if added is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"document_id": document_id, "chunks": len(added)}
@@ -1,90 +1,524 @@
-from fastapi import APIRouter, HTTPException, Body
+import inspect
+import json
+import logging
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Body, Query, Request, Response
+from src.api.models.api_models import (
+    BatchSearchRequest,
+    BatchSearchResponse,
+    HybridResult,
+    HybridSearchRequest,
+    HybridSearchResponse,
+    QueryResult,
+    RecallRequest,
+)
 from src.core.models.library import Library
+from src.core.models.indexing.index_job import IndexJob
+from src.core.services.index_job_service import IndexJobService
 from src.core.services.library_service import LibraryService
-from src.core.indexing.algorithms.linear_search import LinearSearch
-from src.core.indexing.algorithms.kd_tree import KDTreeIndex
-from src.core.indexing.algorithms.ball_tree import BallTreeIndex
+from src.core.services.shared_catalog import ROLE, SharedCatalog
+from src.core.indexing.algorithms import INDEXING_ALGORITHMS
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.evaluation import recall_at_k
+from src.core.indexing.metadata import Condition, filtered_search_batch, parse_filter
+from src.core.indexing.sharded import ShardedIndex
+from src.core.indexing.text import fuse_results
+from src.utils.cache import (
+    QUERY_CACHE_BYTES,
+    QUERY_CACHE_DECIMALS,
+    QUERY_CACHE_TTL,
+    QueryCache,
+    query_key,
+)
+from src.utils.admission import AdmissionPool
+from src.utils.batching import MicroBatcher
+from src.utils.binary import BINARY_MEDIA_TYPE, decode_vectors, encode_neighbors
+from src.utils.instrumentation import get_logger, log_event, span
 
 router = APIRouter()
-library_service = LibraryService()
+# readers search the libraries published by the writer (see shared_catalog.py)
+library_service = SharedCatalog() if ROLE == "reader" else LibraryService()
+index_job_service = IndexJobService()
+query_cache = QueryCache(QUERY_CACHE_BYTES, QUERY_CACHE_TTL)
+# searches run here, off the event loop and apart from the CRUD thread pool
+search_pool = AdmissionPool()
+search_batcher = MicroBatcher()
+logger = get_logger("indexing")
 
-# Available indexing algorithms
-INDEXING_ALGORITHMS = {
-    "linear_search": LinearSearch,
-    "kd_tree": KDTreeIndex,
-    "ball_tree": BallTreeIndex,
-}
+# Results taken from each of text and vector search before a hybrid search
+# fuses them, unless the request sets `candidates` or asks for more
+HYBRID_CANDIDATES = 50
 
 
-@router.post("/index/{library_id}", response_model=dict)
-def index_library(library_id: str, algorithm: str = "linear_search"):
+def _supported_params(func: Callable, **params) -> dict:
     """
-    Index the chunks in a library using the specified algorithm.
+    Drop unset parameters and reject any the algorithm does not accept.
     """
-    print(f"Indexing library: {library_id} with algorithm: {algorithm}")
-    print(
-        f"Current libraries before indexing: {[lib.id for lib in library_service.libraries]}"
+    params = {name: value for name, value in params.items() if value is not None}
+    accepted = inspect.signature(func).parameters
+    unsupported = [name for name in params if name not in accepted]
+    if unsupported:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Parameters not supported by this algorithm: {unsupported}",
+        )
+    return params
+
+
+def _search_params(index: BaseIndex, **params) -> dict:
+    """
+    Validate per-request search parameters. A sharded index takes those of
+    its shards' algorithm.
+    """
+    algorithm = getattr(index, "shard_class", type(index))
+    return _supported_params(algorithm.search_batch, **params)
+
+
+def _parse_filter(filter: Dict[str, Any]) -> List[Condition]:
+    """
+    Validate a metadata filter expression.
+    """
+    try:
+        return parse_filter(filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
+
+
+def _search(
+    library: Library,
+    queries: List[list],
+    k: int,
+    filter: Optional[Dict[str, Any]],
+    params: dict,
+) -> List[List[Tuple[str, float]]]:
+    """
+    Search the library's index for every query, reusing cached results of the
+    current library version and caching the rest. Call with the library's
+    read lock held.
+    """
+    conditions = _parse_filter(filter) if filter is not None else None
+    version = library_service.library_version(library.id)
+    keys = [
+        query_key(
+            library.id, version, query, k, QUERY_CACHE_DECIMALS, filter=filter, **params
+        )
+        for query in queries
+    ]
+    with span("cache_lookup"):
+        results = [query_cache.get(key) for key in keys]
+    misses = [i for i, neighbors in enumerate(results) if neighbors is None]
+    if not misses:
+        return results
+
+    pending = [queries[i] for i in misses]
+    if conditions is None:
+        with span("index_search"):
+            found = library.index.search_batch(pending, k, **params)
+    else:
+        with span("filter"):
+            matches, total = library_service.filter_chunks(library.id, conditions)
+        with span("index_search"):
+            found = filtered_search_batch(
+                library.index, pending, k, matches, total, **params
+            )
+    for i, neighbors in zip(misses, found):
+        query_cache.put(keys[i], neighbors)
+        results[i] = neighbors
+    return results
+
+
+@router.post("/index/{library_id}", response_model=IndexJob, status_code=202)
+def index_library(
+    library_id: str,
+    algorithm: str = "linear_search",
+    metric: Optional[str] = None,
+    M: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    nlist: Optional[int] = None,
+    m: Optional[int] = None,
+    nbits: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    leaf_size: Optional[int] = None,
+    shards: Optional[int] = None,
+):
+    """
+    Start indexing the chunks in a library using the specified algorithm.
+    With `shards`, the library is split into that many indexes, searched in
+    parallel. The build runs in the background; poll the returned job for
+    its status.
+    """
+    log_event(
+        logger,
+        logging.INFO,
+        "Indexing library",
+        library_id=library_id,
+        algorithm=algorithm,
     )
 
-    # fetch the library
-    library = library_service.get_library(library_id)
-    if not library:
+    if not library_service.get_library(library_id):
         raise HTTPException(status_code=404, detail=f"Library not found {library_id}")
 
-    # extract chunks and their embeddingss
-    data = []
-    for document in library.documents:
-        for chunk in document.chunks:
-            data.append((chunk.id, chunk.embedding))
-
-    # build the index
     if algorithm not in INDEXING_ALGORITHMS:
         raise HTTPException(
             status_code=400, detail=f"Invalid Indexing Algorithm: {algorithm}"
         )
 
     index_class = INDEXING_ALGORITHMS[algorithm]
-    index = index_class()
-    index.build_index(data)
+    params = _supported_params(
+        index_class,
+        metric=metric,
+        M=M,
+        ef_construction=ef_construction,
+        ef_search=ef_search,
+        nlist=nlist,
+        m=m,
+        nbits=nbits,
+        nprobe=nprobe,
+        leaf_size=leaf_size,
+    )
+    index_factory = index_class
+    if shards is not None:
+        params["shards"] = shards
+        index_factory = partial(ShardedIndex, algorithm)
+    try:
+        index_factory(**params)  # reject bad parameters before queueing the build
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return index_job_service.submit(library_id, algorithm, index_factory, params)
 
-    # store the index in library
-    library.index = index
-    print(f"Library indexed successfully: {library_id}")  # Debug log
-    print(
-        f"Current libraries after indexing: {[lib.id for lib in library_service.libraries]}"
-    )  # Debug log
 
-    # # store the index in the library service (for simplicity, we'll store it as an attribute)
-    # library_service.libraries[library_service.libraries.index(library)].index = index
+@router.get("/jobs/{job_id}", response_model=IndexJob)
+def get_index_job(job_id: str):
+    """
+    Get the status, progress, duration and error of an index build.
+    """
+    job = index_job_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-    return {"message": f"Library {library_id} indexed using {algorithm}"}
+
+@router.delete("/jobs/{job_id}", response_model=IndexJob)
+def cancel_index_job(job_id: str):
+    """
+    Cancel a queued or running index build.
+    """
+    job = index_job_service.cancel_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @router.post("/search/{library_id}", response_model=dict)
-def search_library(
+async def search_library(
     library_id: str,
-    query_embedding: list = Body(
+    query_embedding: List[float] = Body(
         ..., description="The query embedding as a list of floats"
     ),
     k: int = Body(5, description="The number of nearest neighbors to return"),
+    ef_search: Optional[int] = Body(
+        None, description="HNSW beam width; higher trades latency for recall"
+    ),
+    nprobe: Optional[int] = Body(
+        None, description="IVF cells scanned; higher trades latency for recall"
+    ),
+    filter: Optional[Dict[str, Any]] = Body(
+        None,
+        description="Only return chunks whose metadata matches, e.g. "
+        '{"author": "Jane", "tags": {"in": ["ai"]}, "year": {"gte": 2000}}',
+    ),
+    timeout: Optional[float] = Body(
+        None, gt=0, description="Seconds after which the search is abandoned (504)"
+    ),
 ):
     """
     Search for the k-nearest neighbors in the indexed library.
     """
-    print(
-        f"Searching library: {library_id} with query_embedding: {query_embedding} and k: {k}"
-    )  # Debug log
-    # fetch the library
-    library = library_service.get_library(library_id)
-    if not library:
-        print(f"Library not found: {library_id}")  # Debug log
-        raise HTTPException(status_code=404, detail="Library not found")
-
-    if not library.index:
-        print(f"Library is not indexed: {library_id}")  # Debug log
-        raise HTTPException(status_code=400, detail="Library not indexed")
-
-    # perform the search
-    results = library.index.search(query_embedding, k)
-    print(f"Search results: {results}")  # Debug log
+    log_event(
+        logger,
+        logging.DEBUG,
+        "Searching library",
+        library_id=library_id,
+        dim=len(query_embedding),
+        k=k,
+    )
+
+    async def run(queries: List[list], timeout: Optional[float]):
+        return await search_pool.run(
+            _search_batch,
+            library_id,
+            queries,
+            k,
+            filter,
+            timeout=timeout,
+            ef_search=ef_search,
+            nprobe=nprobe,
+        )
+
+    # concurrent searches that differ only in their query share one index call
+    key = (
+        library_id,
+        len(query_embedding),
+        k,
+        json.dumps(filter, sort_keys=True, default=str),
+        ef_search,
+        nprobe,
+    )
+    found = await search_batcher.submit(key, query_embedding, run, timeout)
+    results = [id for id, _ in found]
+    log_event(logger, logging.DEBUG, "Search results", results=len(results))
     return {"results": results}
+
+
+@router.post("/search_batch/{library_id}", response_model=BatchSearchResponse)
+async def search_library_batch(library_id: str, request: BatchSearchRequest):
+    """
+    Search for the k-nearest neighbors of several query embeddings at once.
+    """
+    payload = await search_pool.run(
+        _search_batch_json, library_id, request, timeout=request.timeout
+    )
+    return Response(payload, media_type="application/json")
+
+
+def _search_batch_json(library_id: str, request: BatchSearchRequest) -> str:
+    """
+    Search for a batch request and serialize the response, which is too slow
+    for large batches to do on the event loop.
+    """
+    results = _search_batch(
+        library_id,
+        request.queries,
+        request.k,
+        request.filter,
+        ef_search=request.ef_search,
+        nprobe=request.nprobe,
+    )
+    with span("serialization"):
+        response = BatchSearchResponse(
+            results=[
+                QueryResult(
+                    ids=[id for id, _ in neighbors],
+                    distances=[distance for _, distance in neighbors],
+                )
+                for neighbors in results
+            ]
+        )
+        return response.model_dump_json()
+
+
+@router.post(
+    "/search_binary/{library_id}",
+    response_class=Response,
+    responses={200: {"content": {BINARY_MEDIA_TYPE: {}}}},
+)
+async def search_library_binary(
+    library_id: str,
+    request: Request,
+    dim: int = Query(..., ge=1, description="Dimension of the query embeddings"),
+    k: int = Query(5, ge=1),
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    filter: Optional[str] = Query(
+        None, description="Metadata filter as a JSON object, as in /search"
+    ),
+    timeout: Optional[float] = Query(
+        None, gt=0, description="Seconds after which the search is abandoned (504)"
+    ),
+):
+    """
+    Batch search with a binary body of packed little-endian float32 queries
+    (`dim` values each), decoded straight into an array. Responds with the ids
+    and distances packed as described in `encode_neighbors`.
+    """
+    body = await request.body()
+    try:
+        with span("decode"):
+            queries = decode_vectors(body, dim)
+        filter = json.loads(filter) if filter is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filter is not None and not isinstance(filter, dict):
+        raise HTTPException(status_code=400, detail="Invalid filter: not an object")
+    log_event(
+        logger,
+        logging.DEBUG,
+        "Binary search",
+        library_id=library_id,
+        queries=len(queries),
+        k=k,
+    )
+    payload = await search_pool.run(
+        _search_binary,
+        library_id,
+        queries,
+        k,
+        filter,
+        timeout=timeout,
+        ef_search=ef_search,
+        nprobe=nprobe,
+    )
+    return Response(payload, media_type=BINARY_MEDIA_TYPE)
+
+
+def _search_binary(
+    library_id: str,
+    queries: List[list],
+    k: int,
+    filter: Optional[Dict[str, Any]],
+    **params,
+) -> bytes:
+    """
+    Search for a binary request and pack the response.
+    """
+    results = _search_batch(library_id, queries, k, filter, **params)
+    with span("serialization"):
+        return encode_neighbors(results)
+
+
+@router.post("/hybrid_search/{library_id}", response_model=HybridSearchResponse)
+async def hybrid_search_library(library_id: str, request: HybridSearchRequest):
+    """
+    Search chunk text with BM25 and the library's index with an embedding,
+    and fuse both rankings into one. With only one of query_text and
+    query_embedding, this is a plain text or vector search.
+    """
+    if request.query_text is None and request.query_embedding is None:
+        raise HTTPException(
+            status_code=400, detail="Give query_text, query_embedding or both"
+        )
+    return await search_pool.run(
+        _hybrid_search, library_id, request, timeout=request.timeout
+    )
+
+
+def _hybrid_search(
+    library_id: str, request: HybridSearchRequest
+) -> HybridSearchResponse:
+    """
+    Run the text and vector searches of a hybrid request under the library's
+    read lock, so both see the same chunks, and fuse their results.
+    """
+    candidates = request.candidates or max(request.k, HYBRID_CANDIDATES)
+    with library_service.read_library(library_id) as library:
+        if not library:
+            raise HTTPException(status_code=404, detail="Library not found")
+
+        vector_results: List[Tuple[str, float]] = []
+        if request.query_embedding is not None:
+            if not library.index:
+                raise HTTPException(status_code=400, detail="Library not indexed")
+            _check_dimensions(library_id, [request.query_embedding])
+            params = _search_params(
+                library.index, ef_search=request.ef_search, nprobe=request.nprobe
+            )
+            vector_results = _search(
+                library, [request.query_embedding], candidates, request.filter, params
+            )[0]
+
+        text_results: List[Tuple[str, float]] = []
+        if request.query_text is not None:
+            conditions = None
+            if request.filter is not None:
+                conditions = _parse_filter(request.filter)
+            with span("text_search"):
+                text_results = library_service.search_text(
+                    library.id, request.query_text, candidates, conditions
+                )
+
+    fused = fuse_results(
+        vector_results,
+        text_results,
+        request.k,
+        request.fusion,
+        request.alpha,
+        request.rrf_k,
+    )
+    return HybridSearchResponse(
+        results=[
+            HybridResult(id=id, score=score, vector_rank=vector, text_rank=text)
+            for id, score, vector, text in fused
+        ]
+    )
+
+
+def _search_batch(
+    library_id: str,
+    queries: List[list],
+    k: int,
+    filter: Optional[Dict[str, Any]],
+    **params,
+) -> List[List[Tuple[str, float]]]:
+    """
+    Search a library for several queries under its read lock.
+    """
+    # fetch the library once for the whole batch
+    with library_service.read_library(library_id) as library:
+        if not library:
+            raise HTTPException(status_code=404, detail="Library not found")
+
+        if not library.index:
+            raise HTTPException(status_code=400, detail="Library not indexed")
+
+        _check_dimensions(library_id, queries)
+
+        # perform the search
+        params = _search_params(library.index, **params)
+        return _search(library, queries, k, filter, params)
+
+
+def _check_dimensions(library_id: str, queries: List[list]):
+    """
+    Raise a 400 unless every query has the dimension of the library's
+    embeddings. Call with the library's read lock held.
+    """
+    dimension = library_service.library_dimension(library_id)
+    if dimension is not None and any(len(query) != dimension for query in queries):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Query embeddings must have {dimension} dimensions",
+        )
+
+
+@router.get("/cache", response_model=dict)
+def get_cache_stats():
+    """
+    Hit, miss, eviction and expiry counters and memory use of the search cache.
+    """
+    return query_cache.stats()
+
+
+@router.get("/admission", response_model=dict)
+def get_admission_stats():
+    """
+    Limits of the search pool and its in-flight, rejected and expired searches.
+    """
+    return search_pool.stats()
+
+
+@router.post("/recall/{library_id}", response_model=dict)
+def measure_recall(library_id: str, request: RecallRequest):
+    """
+    Measure recall@k of the library's index against an exact LinearSearch.
+    """
+    with library_service.read_library(library_id) as library:
+        if not library:
+            raise HTTPException(status_code=404, detail="Library not found")
+
+        if not library.index:
+            raise HTTPException(status_code=400, detail="Library not indexed")
+
+        data = [
+            (chunk.id, chunk.embedding)
+            for document in library.documents
+            for chunk in document.chunks
+        ]
+        params = _search_params(
+            library.index,
+            ef_search=request.ef_search,
+            nprobe=request.nprobe,
+        )
+        recall = recall_at_k(library.index, data, request.queries, request.k, **params)
+    return {"recall": recall, "k": request.k}
@@ -1,5 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from typing import AsyncIterator, List, Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+from src.core.indexing.algorithms import INDEXING_ALGORITHMS
+from src.core.models.chunk import Chunk
+from src.core.models.document import Document
 from src.core.models.library import Library
+from src.core.services.ingest_service import INGEST_BATCH_SIZE, BulkIngest, IngestError
 from src.core.services.library_service import LibraryService
 
 router = APIRouter()
@@ -44,3 +50,86 @@ def delete_library(library_id: str):
     if not library_service.delete_library(library_id):
         raise HTTPException(status_code=404, detail="Library not found")
     return {"message": "Library deleted successfully"}
+
+
+@router.get("/{library_id}/documents", response_model=List[Document])
+def list_library_documents(
+    library_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Page through the documents of a library
+    """
+    documents = library_service.list_documents(library_id, offset, limit)
+    if documents is None:
+        raise HTTPException(status_code=404, detail="Library not found")
+    return documents
+
+
+@router.get("/{library_id}/chunks", response_model=List[Chunk])
+def list_library_chunks(
+    library_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Page through the chunks of a library
+    """
+    chunks = library_service.list_chunks(library_id, offset, limit)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Library not found")
+    return chunks
+
+
+@router.post("/{library_id}/ingest", response_model=dict)
+async def ingest_library(
+    library_id: str,
+    request: Request,
+    batch_size: int = Query(INGEST_BATCH_SIZE, ge=1, le=100000),
+    algorithm: Optional[str] = None,
+):
+    """
+    Stream documents and chunks into a library as NDJSON, one record per line
+    (see BulkIngest). The body is parsed as it arrives and applied in batches.
+    With `algorithm`, an index of that type is built over the library first and
+    updated with every batch. Returns counts and throughput.
+    """
+    if not await run_in_threadpool(library_service.get_library, library_id):
+        raise HTTPException(status_code=404, detail="Library not found")
+    if algorithm is not None:
+        if algorithm not in INDEXING_ALGORITHMS:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid Indexing Algorithm: {algorithm}"
+            )
+        index = INDEXING_ALGORITHMS[algorithm]()
+        await run_in_threadpool(library_service.index_library, library_id, index)
+
+    ingest = BulkIngest(library_id, batch_size)
+    lines: List[bytes] = []
+    try:
+        async for line in _ndjson_lines(request):
+            lines.append(line)
+            if len(lines) >= batch_size:
+                await run_in_threadpool(ingest.feed, lines)
+                lines = []
+        await run_in_threadpool(ingest.feed, lines)
+        await run_in_threadpool(ingest.finish)
+    except IngestError as e:
+        # everything before the failing line is ingested
+        raise HTTPException(status_code=400, detail={"error": str(e), **ingest.stats()})
+    return ingest.stats()
+
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """
+    Split a streamed request body into lines without reading it all.
+    """
+    pending = b""
+    async for piece in request.stream():
+        lines = (pending + piece).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
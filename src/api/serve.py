@@ -0,0 +1,86 @@
+"""
+Serve the API from several processes sharing one copy of the data.
+
+    python -m src.api.serve --workers 4 --port 8000
+
+One writer process owns the catalog (and, with VECTOR_DB_DATA_DIR, the
+write-ahead log) and publishes every library to a shared directory, by
+default on the /dev/shm tmpfs. --workers reader processes listen on --port,
+answer searches from the memory-mapped libraries and forward every other
+request to the writer.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+import requests
+import uvicorn
+
+APP = "src.api.main:app"
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Reader processes"
+    )
+    parser.add_argument(
+        "--writer-port", type=int, default=8001, help="Local port of the writer"
+    )
+    parser.add_argument(
+        "--shared-dir", help="Directory to publish libraries to (default: a new one)"
+    )
+    args = parser.parse_args(argv)
+
+    shared_dir = args.shared_dir or tempfile.mkdtemp(
+        prefix="vector-db-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+    writer_url = f"http://127.0.0.1:{args.writer_port}"
+    writer = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", APP]
+        + ["--host", "127.0.0.1", "--port", str(args.writer_port)],
+        env={
+            **os.environ,
+            "VECTOR_DB_ROLE": "writer",
+            "VECTOR_DB_SHARED_DIR": shared_dir,
+        },
+    )
+    try:
+        _wait_for(writer, writer_url)
+        # the readers import the app after these are set
+        os.environ.update(
+            VECTOR_DB_ROLE="reader",
+            VECTOR_DB_SHARED_DIR=shared_dir,
+            VECTOR_DB_WRITER_URL=writer_url,
+        )
+        os.environ.pop("VECTOR_DB_DATA_DIR", None)  # the log is the writer's alone
+        uvicorn.run(APP, host=args.host, port=args.port, workers=args.workers)
+    finally:
+        writer.terminate()
+        writer.wait()
+        if not args.shared_dir:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def _wait_for(writer: subprocess.Popen, url: str):
+    """
+    Wait until the writer answers, i.e. has recovered and published its data.
+    """
+    while writer.poll() is None:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    sys.exit(f"The writer exited with code {writer.returncode}")
+
+
+if __name__ == "__main__":
+    main()
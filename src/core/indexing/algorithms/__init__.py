@@ -0,0 +1,14 @@
+from src.core.indexing.algorithms.linear_search import LinearSearch
+from src.core.indexing.algorithms.kd_tree import KDTreeIndex
+from src.core.indexing.algorithms.ball_tree import BallTreeIndex
+from src.core.indexing.algorithms.hnsw import HNSWIndex
+from src.core.indexing.algorithms.ivf_pq import IVFPQIndex
+
+# Available indexing algorithms
+INDEXING_ALGORITHMS = {
+    "linear_search": LinearSearch,
+    "kd_tree": KDTreeIndex,
+    "ball_tree": BallTreeIndex,
+    "hnsw": HNSWIndex,
+    "ivf_pq": IVFPQIndex,
+}
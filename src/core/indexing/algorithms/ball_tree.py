@@ -1,101 +1,76 @@
-from typing import List, Tuple
-from src.core.indexing.base import BaseIndex
-from scipy.spatial.distance import euclidean
-
-
-class BallTreeNode:
-    def __init__(
-        self,
-        data: List[Tuple[str, list]],
-        centroid: list,
-        radius: float,
-        left=None,
-        right=None,
-    ):
-        self.data = data
-        self.centroid = centroid  # Center of the ball
-        self.radius = radius  # Radius of the ball
-        self.left = left  # Left child
-        self.right = right  # Right child
-
-
-class BallTreeIndex(BaseIndex):
-    def __init__(self):
-        self.root = None
-
-    def build_index(self, data: List[Tuple[str, list]]):
-        """
-        Build the Ball Tree index from a list of (id, embedding) tuples.
-        """
-        self.root = self._build_tree(list(data))
-
-    def _build_tree(self, data: List[list]) -> BallTreeNode:
-        """
-        Recursively build the Ball Tree.
-        """
-        if not data:
-            return None
-
-        # Extract embeddings from the data
-        embeddings = [embedding for _, embedding in data]
-
-        # Find the centroid (mean of all points)
-        centroid = [sum(dim) / len(dim) for dim in zip(*embeddings)]
-
-        # Calculate the radius (max distance from centroid to any point)
-        radius = max(euclidean(centroid, point) for point in embeddings)
-
-        # Split the data into two halves based on distance from the centroid
-        data.sort(key=lambda x: euclidean(x[1], centroid))
-        mid = len(data) // 2
-
-        # Recursively build left and right subtrees
-        left = self._build_tree(data[:mid])
-        right = self._build_tree(data[mid + 1 :])
-
-        return BallTreeNode(data, centroid, radius, left, right)
-
-    def search(self, query_embedding: list, k: int) -> List[str]:
+import heapq
+import math
+from typing import Any, Dict, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.incremental import (
+    CandidateHeap,
+    IncrementalTreeIndex,
+    TreeSegment,
+)
+from src.core.indexing.tree_table import (
+    NodeTable,
+    ProgressFunction,
+    build_node_table,
+)
+
+
+def _ball_split(
+    vectors: np.ndarray, depth: int
+) -> Tuple[np.ndarray, int, Dict[str, Any]]:
+    """
+    Bound the points with a ball around their centroid, then split them at
+    the median of the axis along which they spread the most, so both halves
+    get tight balls of their own.
+    """
+    centroid = vectors.mean(axis=0)
+    offsets = vectors - centroid
+    radius = float(np.sqrt(np.einsum("ij,ij->i", offsets, offsets).max()))
+    axis = int(np.argmax(vectors.max(axis=0) - vectors.min(axis=0)))
+    mid = len(vectors) // 2
+    permutation = np.argpartition(vectors[:, axis], mid)
+    return permutation, mid, {"centroid": centroid, "radius": radius}
+
+
+class BallTreeIndex(IncrementalTreeIndex):
+    def _build_tree(
+        self, vectors: np.ndarray, progress: Optional[ProgressFunction] = None
+    ) -> NodeTable:
         """
-        Search for the k-nearest neighbors of the query embedding.
+        Build the Ball Tree.
         """
-        results = []
-        self._search_tree(self.root, query_embedding, k, results)
-        return [id for id, _ in sorted(results, key=lambda x: x[1])[:k]]
+        return build_node_table(
+            vectors, _ball_split, self.build_processes, self.leaf_size, progress
+        )
 
     def _search_tree(
-        self, node: BallTreeNode, query: list, k: int, results: List[Tuple[int, float]]
+        self,
+        segment: TreeSegment,
+        query: np.ndarray,
+        results: CandidateHeap,
+        allowed: Optional[Set[str]] = None,
     ):
         """
-        Recursively search the Ball Tree for the nearest neighbors.
+        Best-first search of the Ball Tree. No point in a ball is closer to
+        the query than its distance to the centroid minus the radius.
         """
-        if node is None:
+        table = segment.table
+        if not len(table):
             return
-
-        # Calculate the distance from the query to the centroid
-        distance = euclidean(query, node.centroid)
-
-        # If the query is inside the ball, explore both children
-        if distance <= node.radius:
-            self._search_tree(node.left, query, k, results)
-            self._search_tree(node.right, query, k, results)
-
-        # If the query is outside the ball, explore the closest child
-        else:
-            if node.left and euclidean(query, node.left.centroid) < euclidean(
-                query, node.right.centroid
-            ):
-                self._search_tree(node.left, query, k, results)
-            else:
-                self._search_tree(node.right, query, k, results)
-
-        # Add the current node's data to the results if it's one of the k-nearest neighbors
-        for id, embedding in node.data:
-            dist = euclidean(query, embedding)
-            if len(results) < k:
-                results.append((id, dist))
-            else:
-                max_distance = max(results, key=lambda x: x[1])[1]
-                if dist < max_distance:
-                    results.remove(max(results, key=lambda x: x[1]))
-                    results.append((id, dist))
+        left, right = table.left, table.right
+        centroids, radii = table.columns["centroid"], table.columns["radius"]
+
+        root_bound = float(np.linalg.norm(query - centroids[0])) - radii[0]
+        queue = [(max(root_bound, 0.0), 0)]  # (lower bound, node)
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if bound >= results.worst():
+                break  # no node left in the queue can hold a closer point
+            if left[node] < 0:
+                self._scan_leaf(segment, node, query, results, allowed)
+                continue
+            for child in (int(left[node]), int(right[node])):
+                offset = centroids[child] - query
+                distance = math.sqrt(float(offset @ offset))
+                child_bound = max(bound, distance - float(radii[child]))
+                if child_bound < results.worst():
+                    heapq.heappush(queue, (child_bound, child))
@@ -0,0 +1,342 @@
+import heapq
+import math
+import random
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.metrics import check_metric, prepare, to_distance
+from src.core.indexing.vector_store import VectorStore
+
+
+class HNSWIndex(BaseIndex):
+    """
+    Hierarchical Navigable Small World graph for approximate k-NN search.
+
+    Every chunk is a node in a stack of proximity graphs: level 0 holds all nodes,
+    each level above holds an exponentially thinning sample. A search greedily
+    descends from the sparse top level and then runs a beam search of width
+    `ef_search` on level 0. Larger `M` / `ef_construction` give a better graph,
+    larger `ef_search` gives higher recall; both cost latency.
+
+    The graph is built and searched with the index metric: squared Euclidean
+    distance for l2 and cosine (on normalized vectors), negative inner product
+    for dot.
+    """
+
+    def __init__(
+        self,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 50,
+        seed: int = 42,
+        metric: str = "l2",
+    ):
+        self.metric = check_metric(metric)
+        self.M = M  # Max neighbors per node on the upper levels
+        self.max_neighbors_0 = 2 * M  # Max neighbors per node on level 0
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(max(M, 2))
+        self.rng = random.Random(seed)
+        self.store = VectorStore(metric=metric)  # Node i is row i of the store
+        self.neighbors: List[List[List[int]]] = []  # neighbors[node][level]
+        self.deleted: Set[int] = set()  # Tombstoned nodes, traversed but never returned
+        self.entry_point: Optional[int] = None
+        self.max_level = -1
+
+    def build_index(self, data: List[Tuple[str, list]]):
+        """
+        Build the graph by inserting the (id, embedding) tuples one at a time.
+        """
+        self.store = VectorStore(metric=self.metric)
+        self.neighbors = []
+        self.deleted = set()
+        self.entry_point = None
+        self.max_level = -1
+        self.add(data)
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Insert (id, embedding) tuples, replacing any existing ids.
+        """
+        self.remove([id for id, _ in items])
+        start = len(self.store)
+        self.store.append(items)
+        for node in range(start, len(self.store)):
+            self._insert(node)
+            if (node - start) % 256 == 255:
+                self._report_progress((node - start + 1) / len(items))
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Tombstone chunks by id. Their nodes stay in the graph to keep it connected.
+        """
+        removed = 0
+        for id in ids:
+            node = self.store.rows.pop(id, None)
+            if node is not None:
+                self.deleted.add(node)
+                removed += 1
+        return removed
+
+    def search(
+        self,
+        query_embedding: list,
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        *,
+        ef_search: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Search for the approximate k-nearest neighbors of the query embedding.
+        """
+        nodes = self._allowed_nodes(allowed)
+        return [id for id, _ in self._nearest(query_embedding, k, ef_search, nodes)]
+
+    def search_batch(
+        self,
+        queries: List[list],
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        *,
+        ef_search: Optional[int] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for the approximate k-nearest neighbors of every query in one call.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        nodes = self._allowed_nodes(allowed)
+        return [self._nearest(query, k, ef_search, nodes) for query in queries]
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the vector store plus the adjacency lists.
+        """
+        links = sum(len(level) for node in self.neighbors for level in node)
+        return self.store.memory_usage() + 8 * links
+
+    def _get_state(self) -> Dict[str, Any]:
+        # adjacency lists flattened to CSR: the links of (node, level) are
+        # links[link_offsets[e]:link_offsets[e + 1]] with e = level_offsets[node] + level
+        lists = [links for node in self.neighbors for links in node]
+        level_counts = [len(node) for node in self.neighbors]
+        return {
+            "config": {
+                "M": self.M,
+                "ef_construction": self.ef_construction,
+                "ef_search": self.ef_search,
+                "metric": self.metric,
+            },
+            "entry_point": self.entry_point,
+            "max_level": self.max_level,
+            "deleted": np.array(sorted(self.deleted), dtype=np.int64),
+            "level_offsets": np.concatenate([[0], np.cumsum(level_counts)]).astype(
+                np.int64
+            ),
+            "link_offsets": np.concatenate(
+                [[0], np.cumsum([len(links) for links in lists])]
+            ).astype(np.int64),
+            "links": np.array(
+                [node for links in lists for node in links], dtype=np.int64
+            ),
+            **self.store.get_state(),
+        }
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.store = VectorStore.from_state(state, self.metric)
+        self.entry_point = state["entry_point"]
+        self.max_level = state["max_level"]
+        self.deleted = set(state["deleted"].tolist())
+        for node in self.deleted:
+            if self.store.rows.get(self.store.ids[node]) == node:
+                del self.store.rows[self.store.ids[node]]
+
+        # the graph is rebuilt as Python lists, which search and inserts expect
+        links = state["links"].tolist()
+        link_offsets = state["link_offsets"].tolist()
+        level_offsets = state["level_offsets"].tolist()
+        self.neighbors = [
+            [
+                links[link_offsets[e] : link_offsets[e + 1]]
+                for e in range(level_offsets[node], level_offsets[node + 1])
+            ]
+            for node in range(len(level_offsets) - 1)
+        ]
+
+    def _allowed_nodes(self, allowed: Optional[Set[str]]) -> Optional[Set[int]]:
+        """
+        The live nodes of the allowed ids, or None when search is unfiltered.
+        """
+        if allowed is None:
+            return None
+        rows = self.store.rows
+        return {rows[id] for id in allowed if id in rows}
+
+    def _nearest(
+        self,
+        query: list,
+        k: int,
+        ef_search: Optional[int],
+        allowed: Optional[Set[int]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        The approximate k-nearest (id, distance) pairs of the query, sorted by
+        distance. With `allowed`, the beam keeps walking the whole graph but
+        only collects allowed nodes.
+        """
+        if self.entry_point is None or k <= 0:
+            return []
+        query = prepare(query, self.metric)
+        ef = max(ef_search or self.ef_search, k)
+
+        # Greedy descent through the upper levels, then a beam search on level 0
+        entry = [self.entry_point]
+        for level in range(self.max_level, 0, -1):
+            entry = [self._search_level(query, entry, 1, level)[0][1]]
+        candidates = self._search_level(
+            query, entry, ef, 0, skip=self.deleted, allowed=allowed
+        )
+
+        ids = self.store.ids
+        return [
+            (ids[node], float(to_distance(dist, self.metric)))
+            for dist, node in candidates[:k]
+        ]
+
+    def _insert(self, node: int):
+        """
+        Link a stored vector into the graph.
+        """
+        level = int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+        self.neighbors.append([[] for _ in range(level + 1)])
+        if self.entry_point is None:
+            self.entry_point, self.max_level = node, level
+            return
+
+        query = self.store.vectors[node]
+        entry = [self.entry_point]
+        for lc in range(self.max_level, level, -1):
+            entry = [self._search_level(query, entry, 1, lc)[0][1]]
+
+        for lc in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_level(query, entry, self.ef_construction, lc)
+            max_neighbors = self.max_neighbors_0 if lc == 0 else self.M
+            selected = self._select_neighbors(candidates, self.M)
+            self.neighbors[node][lc] = selected
+
+            # Link back, shrinking any neighbor list that overflows
+            for other in selected:
+                links = self.neighbors[other][lc]
+                links.append(node)
+                if len(links) > max_neighbors:
+                    distances = self._distances(self.store.vectors[other], links)
+                    self.neighbors[other][lc] = self._select_neighbors(
+                        sorted(zip(distances.tolist(), links)), max_neighbors
+                    )
+            entry = [other for _, other in candidates]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def _search_level(
+        self,
+        query: np.ndarray,
+        entry: List[int],
+        ef: int,
+        level: int,
+        skip: Set[int] = frozenset(),
+        allowed: Optional[Set[int]] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Beam search on one level. Returns up to ef (squared distance, node)
+        pairs sorted by distance; nodes in `skip` or, if given, not in `allowed`
+        are traversed but not returned.
+        """
+        if allowed is not None:
+            skip = _Excluded(skip, allowed)
+        visited = set(entry)
+        distances = self._distances(query, entry).tolist()
+        candidates = list(zip(distances, entry))  # Min-heap of nodes to expand
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates if n not in skip]  # Max-heap
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if len(results) >= ef and dist > -results[0][0]:
+                break
+            fresh = [n for n in self.neighbors[node][level] if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for d, n in zip(self._distances(query, fresh).tolist(), fresh):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    if n not in skip:
+                        heapq.heappush(results, (-d, n))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+
+        return sorted((-d, n) for d, n in results)
+
+    def _select_neighbors(
+        self, candidates: List[Tuple[float, int]], m: int
+    ) -> List[int]:
+        """
+        Neighbor selection heuristic: walk candidates by distance and keep one only
+        if it is closer to the base point than to every neighbor kept so far, so
+        links spread out in different directions instead of clustering.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+
+        # Pairwise distances between all candidates in one product
+        nodes = [node for _, node in candidates]
+        vectors = self.store.vectors[nodes]
+        if self.metric == "dot":
+            pairwise = -(vectors @ vectors.T)
+        else:
+            sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+            pairwise = (
+                sq_norms[:, None] + sq_norms[None, :] - 2.0 * (vectors @ vectors.T)
+            )
+
+        selected: List[int] = []
+        pruned: List[int] = []
+        closest_selected = np.full(len(nodes), np.inf)  # Distance to nearest kept node
+        for i, (dist, node) in enumerate(candidates):
+            if len(selected) >= m:
+                break
+            if dist < closest_selected[i]:
+                selected.append(node)
+                np.minimum(closest_selected, pairwise[i], out=closest_selected)
+            else:
+                pruned.append(node)
+
+        # Top up with the closest pruned candidates to keep the graph well connected
+        return selected + pruned[: m - len(selected)]
+
+    def _distances(self, query: np.ndarray, nodes: List[int]) -> np.ndarray:
+        """
+        Distances from the query to the given nodes: squared Euclidean, or the
+        negative inner product for the dot metric.
+        """
+        if self.metric == "dot":
+            return -(self.store.vectors[nodes] @ query)
+        diff = self.store.vectors[nodes] - query
+        return np.einsum("ij,ij->i", diff, diff)
+
+
+class _Excluded:
+    """
+    Membership test for nodes that are skipped or not allowed.
+    """
+
+    def __init__(self, skip: Set[int], allowed: Set[int]):
+        self.skip = skip
+        self.allowed = allowed
+
+    def __contains__(self, node: int) -> bool:
+        return node in self.skip or node not in self.allowed
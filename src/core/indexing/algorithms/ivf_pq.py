@@ -0,0 +1,410 @@
+import math
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.metrics import check_metric, prepare, to_distance
+from src.core.indexing.vector_store import top_k_smallest
+
+
+class IVFPQIndex(BaseIndex):
+    """
+    Inverted file index with product quantization (IVF-PQ).
+
+    A coarse k-means splits the space into `nlist` cells. Each vector is stored
+    in the list of its nearest cell as `m` one-byte codes: the residual to the
+    cell centroid is cut into `m` sub-vectors, and each sub-vector is replaced by
+    the id of its nearest centroid in a per-subspace codebook. A search only scans
+    the `nprobe` closest lists and scores codes with asymmetric distance tables,
+    so memory is O(m) bytes per vector instead of O(dim) floats, and distances
+    are approximate. For the dot metric, cells are probed by the inner product
+    with their centroid and codes are scored with inner-product tables.
+
+    Deletes leave tombstones, kept as a sorted array of row numbers; a list is
+    compacted on its own once the share of tombstoned rows in it passes
+    `compact_threshold`.
+    """
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        m: int = 16,
+        nbits: int = 8,
+        nprobe: int = 8,
+        train_iterations: int = 20,
+        max_train_points: int = 50000,
+        seed: int = 42,
+        metric: str = "l2",
+        compact_threshold: float = 0.25,
+    ):
+        self.metric = check_metric(metric)
+        self.nlist = nlist  # Number of coarse cells, defaults to ~sqrt(n)
+        self.m = m  # Number of sub-quantizers (bytes per vector)
+        self.nbits = nbits  # Bits per code, at most 8
+        self.nprobe = nprobe  # Number of cells scanned per query
+        self.train_iterations = train_iterations
+        self.max_train_points = max_train_points
+        self.compact_threshold = compact_threshold
+        self.rng = np.random.default_rng(seed)
+        self.dim = 0
+        self.centroids: Optional[np.ndarray] = None  # (nlist, dim)
+        self.codebooks: Optional[np.ndarray] = None  # (m, ksub, dsub)
+        self.list_rows: List[np.ndarray] = []  # Row numbers stored in each cell
+        self.list_codes: List[np.ndarray] = []  # (n_in_cell, m) uint8 codes per cell
+        self.list_deleted = np.zeros(0, dtype=np.int64)  # Tombstones per cell
+        self.ids: List[str] = []  # Row number -> chunk id
+        self.rows: Dict[str, int] = {}  # Chunk id -> live row number
+        self.row_cells = np.empty(0, dtype=np.int64)  # Row number -> cell
+        self.deleted = np.empty(0, dtype=np.int64)  # Tombstoned rows, sorted
+
+    def build_index(self, data: List[Tuple[str, list]]):
+        """
+        Train the coarse centroids and PQ codebooks on the data, then encode it.
+        """
+        self.centroids = None
+        self.codebooks = None
+        self.list_rows, self.list_codes = [], []
+        self.list_deleted = np.zeros(0, dtype=np.int64)
+        self.ids, self.rows = [], {}
+        self.row_cells = np.empty(0, dtype=np.int64)
+        self.deleted = np.empty(0, dtype=np.int64)
+        if data:
+            vectors = prepare([embedding for _, embedding in data], self.metric)
+            self._train(vectors)
+            self._encode_and_store([id for id, _ in data], vectors)
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Encode and insert (id, embedding) tuples with the trained codebooks,
+        replacing any existing ids. An untrained index trains on the first batch.
+        """
+        if not items:
+            return
+        self.remove([id for id, _ in items])
+        vectors = prepare([embedding for _, embedding in items], self.metric)
+        if self.centroids is None:
+            self._train(vectors)
+        self._encode_and_store([id for id, _ in items], vectors)
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Tombstone chunks by id, compacting any list that became too sparse.
+        """
+        rows = [self.rows.pop(id) for id in ids if id in self.rows]
+        if not rows:
+            return 0
+        rows = np.array(rows, dtype=np.int64)
+        self.deleted = np.union1d(self.deleted, rows)
+        cells, counts = np.unique(self.row_cells[rows], return_counts=True)
+        self.list_deleted[cells] += counts
+        for cell in cells.tolist():
+            if self.list_deleted[cell] > self.compact_threshold * len(
+                self.list_rows[cell]
+            ):
+                self._compact_list(cell)
+        return len(rows)
+
+    def search(
+        self,
+        query_embedding: list,
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        *,
+        nprobe: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Search for the approximate k-nearest neighbors of the query embedding.
+        """
+        results = self.search_batch([query_embedding], k, allowed, nprobe=nprobe)
+        return [id for id, _ in results[0]]
+
+    def search_batch(
+        self,
+        queries: List[list],
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        *,
+        nprobe: Optional[int] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for the approximate k-nearest neighbors of every query in one call.
+        With `allowed`, only those ids are scored and the number of probed cells
+        grows with the share of rows filtered out, so k matches are still found.
+        """
+        if self.centroids is None or k <= 0 or len(queries) == 0:
+            return [[] for _ in queries]
+        queries = prepare(queries, self.metric)
+        nprobe = nprobe or self.nprobe
+        allowed_rows = None
+        if allowed is not None:
+            allowed_rows = np.sort(
+                np.array(
+                    [self.rows[id] for id in allowed if id in self.rows],
+                    dtype=np.int64,
+                )
+            )
+            if len(allowed_rows) == 0:
+                return [[] for _ in queries]
+            nprobe = math.ceil(nprobe * len(self.rows) / len(allowed_rows))
+        nprobe = min(nprobe, len(self.centroids))
+
+        # Pick the closest cells for every query with one matrix product
+        if self.metric == "dot":
+            probes = np.argsort(-(queries @ self.centroids.T), axis=1)
+        else:
+            probes = np.argsort(
+                self._squared_distances(queries, self.centroids), axis=1
+            )
+        return [
+            self._search_lists(query, probes[i, :nprobe], k, allowed_rows)
+            for i, query in enumerate(queries)
+        ]
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by codes, row numbers, centroids, codebooks and the id table.
+        """
+        arrays = self.list_codes + self.list_rows + [self.row_cells, self.deleted]
+        if self.centroids is not None:
+            arrays += [self.centroids, self.codebooks]
+        return sum(array.nbytes for array in arrays) + sum(
+            sys.getsizeof(id) for id in self.ids
+        )
+
+    def _get_state(self) -> Dict[str, Any]:
+        state = {
+            "config": {
+                "nlist": self.nlist,
+                "m": self.m,
+                "nbits": self.nbits,
+                "nprobe": self.nprobe,
+                "train_iterations": self.train_iterations,
+                "max_train_points": self.max_train_points,
+                "metric": self.metric,
+                "compact_threshold": self.compact_threshold,
+            },
+            "dim": self.dim,
+            "ids": self.ids,
+            "deleted": self.deleted,
+        }
+        if self.centroids is not None:
+            # the inverted lists are stored back to back
+            sizes = [len(rows) for rows in self.list_rows]
+            state.update(
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                list_offsets=np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+                list_rows=np.concatenate(self.list_rows),
+                list_codes=np.concatenate(self.list_codes),
+            )
+        return state
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.dim = state["dim"]
+        self.ids = state["ids"]
+        self.deleted = state["deleted"]
+        self.rows = {}
+        if "centroids" in state:
+            self.centroids = state["centroids"]
+            self.codebooks = state["codebooks"]
+            bounds = state["list_offsets"][1:-1]
+            self.list_rows = np.split(state["list_rows"], bounds)
+            self.list_codes = np.split(state["list_codes"], bounds)
+            # rows of compacted-away entries keep cell 0, they are never looked up
+            self.row_cells = np.zeros(len(self.ids), dtype=np.int64)
+            for cell, rows in enumerate(self.list_rows):
+                self.row_cells[rows] = cell
+            self.list_deleted = np.array(
+                [
+                    np.count_nonzero(_contains(self.deleted, rows))
+                    for rows in self.list_rows
+                ],
+                dtype=np.int64,
+            )
+            # compacted rows are in no list; tombstoned ones are still listed
+            rows = np.sort(state["list_rows"])
+            for row in rows[~_contains(self.deleted, rows)].tolist():
+                self.rows[self.ids[row]] = row
+
+    def _search_lists(
+        self,
+        query: np.ndarray,
+        cells: np.ndarray,
+        k: int,
+        allowed_rows: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Score the codes of the probed cells with asymmetric distance tables.
+        """
+        all_rows, all_distances = [], []
+        if self.metric == "dot":
+            # table[j, c] = -<query sub-vector j, codeword c>, shared by all cells
+            sub_queries = self._pad(query).reshape(self.m, 1, -1)
+            table = -(self.codebooks * sub_queries).sum(axis=2)
+        for cell in cells:
+            codes = self.list_codes[cell]
+            if len(codes) == 0:
+                continue
+            if self.metric == "dot":
+                # -<q, x> = -<q, centroid> - <q, residual>
+                offset = -float(query @ self.centroids[cell])
+            else:
+                # table[j, c] = squared distance of residual sub-vector j to codeword c
+                residual = self._pad(query - self.centroids[cell])
+                sub_queries = residual.reshape(self.m, 1, -1)
+                table = ((self.codebooks - sub_queries) ** 2).sum(axis=2)
+                offset = 0.0
+            all_distances.append(table[np.arange(self.m), codes].sum(axis=1) + offset)
+            all_rows.append(self.list_rows[cell])
+        if not all_rows:
+            return []
+
+        rows = np.concatenate(all_rows)
+        distances = np.concatenate(all_distances)
+        if len(self.deleted):
+            distances[_contains(self.deleted, rows)] = np.inf
+        if allowed_rows is not None:
+            distances[~_contains(allowed_rows, rows)] = np.inf
+        best = top_k_smallest(distances, k)
+        best = best[np.isfinite(distances[best])]
+        if self.metric != "dot":
+            distances = np.maximum(distances, 0.0)
+        distances = to_distance(distances[best], self.metric)
+        return [
+            (self.ids[row], float(dist))
+            for row, dist in zip(rows[best].tolist(), distances.tolist())
+        ]
+
+    def _compact_list(self, cell: int):
+        """
+        Drop the tombstoned rows of one inverted list and their codes.
+        """
+        rows = self.list_rows[cell]
+        dead = _contains(self.deleted, rows)
+        self.list_rows[cell] = rows[~dead]
+        self.list_codes[cell] = self.list_codes[cell][~dead]
+        self.list_deleted[cell] = 0
+        self.deleted = np.setdiff1d(self.deleted, rows[dead], assume_unique=True)
+
+    def _train(self, vectors: np.ndarray):
+        """
+        Train the coarse quantizer and the residual product quantizer.
+        """
+        self.dim = vectors.shape[1]
+        if len(vectors) > self.max_train_points:
+            sample = self.rng.choice(len(vectors), self.max_train_points, replace=False)
+            vectors = vectors[sample]
+
+        nlist = self.nlist or int(np.sqrt(len(vectors)))
+        self.centroids = self._kmeans(vectors, max(1, min(nlist, len(vectors))))
+        self._report_progress(0.25)
+
+        # Residuals are cut into m equal sub-vectors (zero-padded when needed)
+        residuals = self._pad(
+            vectors - self.centroids[self._assign(vectors, self.centroids)]
+        )
+        sub_vectors = residuals.reshape(len(residuals), self.m, -1)
+        ksub = min(2 ** min(self.nbits, 8), len(vectors))
+        codebooks = []
+        for j in range(self.m):
+            codebooks.append(self._kmeans(sub_vectors[:, j], ksub))
+            self._report_progress(0.25 + 0.65 * (j + 1) / self.m)
+        self.codebooks = np.stack(codebooks)
+        self.list_rows = [np.empty(0, dtype=np.int64) for _ in self.centroids]
+        self.list_codes = [
+            np.empty((0, self.m), dtype=np.uint8) for _ in self.centroids
+        ]
+        self.list_deleted = np.zeros(len(self.centroids), dtype=np.int64)
+
+    def _encode_and_store(self, ids: List[str], vectors: np.ndarray):
+        """
+        Assign vectors to cells, PQ-encode their residuals and append them.
+        """
+        cells = self._assign(vectors, self.centroids)
+        residuals = self._pad(vectors - self.centroids[cells])
+        sub_vectors = residuals.reshape(len(residuals), self.m, -1)
+        codes = np.stack(
+            [self._assign(sub_vectors[:, j], self.codebooks[j]) for j in range(self.m)],
+            axis=1,
+        ).astype(np.uint8)
+
+        rows = np.arange(len(self.ids), len(self.ids) + len(ids))
+        for id, row in zip(ids, rows.tolist()):
+            self.rows[id] = row
+        self.ids.extend(ids)
+        self.row_cells = np.concatenate([self.row_cells, cells])
+        for cell in np.unique(cells).tolist():
+            in_cell = cells == cell
+            self.list_rows[cell] = np.concatenate([self.list_rows[cell], rows[in_cell]])
+            self.list_codes[cell] = np.concatenate(
+                [self.list_codes[cell], codes[in_cell]]
+            )
+
+    def _pad(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Zero-pad the last axis to a multiple of m so it splits into sub-vectors.
+        """
+        extra = -self.dim % self.m
+        if not extra:
+            return vectors
+        pad = [(0, 0)] * (vectors.ndim - 1) + [(0, extra)]
+        return np.pad(vectors, pad)
+
+    def _kmeans(self, vectors: np.ndarray, k: int) -> np.ndarray:
+        """
+        Lloyd's k-means from a random sample of the points.
+        """
+        centroids = vectors[self.rng.choice(len(vectors), k, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            labels = self._assign(vectors, centroids)
+            # sum the points of each cluster with one sort + reduceat;
+            # empty clusters keep their previous centroid
+            order = np.argsort(labels, kind="stable")
+            sorted_labels = labels[order]
+            starts = np.flatnonzero(
+                np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]
+            )
+            filled = sorted_labels[starts]
+            sums = np.add.reduceat(vectors[order], starts, axis=0)
+            counts = np.diff(np.r_[starts, len(labels)])
+            centroids[filled] = sums / counts[:, None]
+        return centroids
+
+    def _assign(
+        self, vectors: np.ndarray, centroids: np.ndarray, block_size: int = 8192
+    ) -> np.ndarray:
+        """
+        Index of the nearest centroid for every vector, in bounded-memory blocks.
+        """
+        # ||x||^2 is the same for every centroid, so it is left out of the argmin
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        vectors = np.ascontiguousarray(vectors)
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start : start + block_size]
+            scores = block @ centroids.T
+            scores *= -2.0
+            scores += centroid_norms
+            labels[start : start + len(block)] = np.argmin(scores, axis=1)
+        return labels
+
+    def _squared_distances(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Pairwise squared Euclidean distances between the rows of a and b.
+        """
+        return (
+            np.einsum("ij,ij->i", a, a)[:, None]
+            - 2.0 * (a @ b.T)
+            + np.einsum("ij,ij->i", b, b)[None, :]
+        )
+
+
+def _contains(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Whether each of `values` is in the sorted array, by binary search.
+    """
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values)
+    positions[positions == len(sorted_values)] = 0
+    return sorted_values[positions] == values
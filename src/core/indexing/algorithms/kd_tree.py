@@ -1,106 +1,73 @@
-import math
-from typing import List, Tuple, Optional
-from src.core.indexing.base import BaseIndex
-
-
-class KDTreeNode:
-    def __init__(self, point: Tuple[str, list], axis: int, left=None, right=None):
-        self.point = point  # (id, embedding) tuple
-        self.axis = axis  # The dimension to split on
-        self.left = left  # Left child
-        self.right = right  # Right child
-
-
-class KDTreeIndex(BaseIndex):
-    def __init__(self):
-        self.root = None
-
-    def build_index(self, data: List[Tuple[str, list]]):
-        """
-        Build the KD-Tree from a list of (id, embedding) tuples.
-        """
-        if not data:
-            return
-        self.root = self._build_tree(data, 0)
-
+import heapq
+from typing import Any, Dict, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.incremental import (
+    CandidateHeap,
+    IncrementalTreeIndex,
+    TreeSegment,
+)
+from src.core.indexing.tree_table import (
+    NodeTable,
+    ProgressFunction,
+    build_node_table,
+)
+
+
+def _kd_split(
+    vectors: np.ndarray, depth: int
+) -> Tuple[np.ndarray, int, Dict[str, Any]]:
+    """
+    Split at the median of the axis along which the points spread the most.
+    Points left of the split are <= the split value, points right of it >=.
+    """
+    axis = int(np.argmax(vectors.max(axis=0) - vectors.min(axis=0)))
+    median = len(vectors) // 2
+    permutation = np.argpartition(vectors[:, axis], median)
+    split = float(vectors[permutation[median], axis])
+    return permutation, median, {"axis": axis, "split": split}
+
+
+class KDTreeIndex(IncrementalTreeIndex):
     def _build_tree(
-        self, data: List[Tuple[str, list]], depth: int
-    ) -> Optional[KDTreeNode]:
+        self, vectors: np.ndarray, progress: Optional[ProgressFunction] = None
+    ) -> NodeTable:
         """
-        Recursively build the KD-Tree.
+        Build the KD-Tree.
         """
-        if not data:
-            return None
-
-        # Select axis based on depth so that axis cycles through all valid values
-        axis = depth % len(data[0][1])
-
-        # Sort points by the current axis and choose the median as the pivot
-        data.sort(key=lambda x: x[1][axis])
-        median = len(data) // 2
-
-        # Create the node and recursively build subtrees
-        return KDTreeNode(
-            point=data[median],
-            axis=axis,
-            left=self._build_tree(data[:median], depth + 1),
-            right=self._build_tree(data[median + 1 :], depth + 1),
+        return build_node_table(
+            vectors, _kd_split, self.build_processes, self.leaf_size, progress
         )
 
-    def search(self, query_embedding: list, k: int) -> List[str]:
-        """
-        Search for the k-nearest neighbors of the query embedding.
-        """
-        if not self.root:
-            return []
-
-        # Track the k-nearest neighbors
-        results = []
-        self._search_tree(self.root, query_embedding, k, results)
-        return [id for id, _ in sorted(results, key=lambda x: x[1])[:k]]
-
     def _search_tree(
-        self, node: KDTreeNode, query: list, k: int, results: List[Tuple[str, float]]
+        self,
+        segment: TreeSegment,
+        query: np.ndarray,
+        results: CandidateHeap,
+        allowed: Optional[Set[str]] = None,
     ):
         """
-        Recursively search the KD-Tree for the nearest neighbors.
+        Best-first search of the KD-Tree. A node's lower bound is the largest
+        distance from the query to a splitting plane that separates them.
         """
-        if not node:
+        table = segment.table
+        if not len(table):
             return
-
-        # Calculate the Euclidean distance to the current node's point
-        distance = self._euclidean_distance(query, node.point[1])
-
-        # Add the current node's point to the results if it's one of the k-nearest neighbors
-        if len(results) < k:
-            results.append((node.point[0], distance))
-        else:
-            max_distance = max(results, key=lambda x: x[1])[1]
-            if distance < max_distance:
-                results.remove(max(results, key=lambda x: x[1]))
-                results.append((node.point[0], distance))
-
-        # Determine which subtree to explore first
-        axis = node.axis
-        if query[axis] < node.point[1][axis]:
-            self._search_tree(node.left, query, k, results)
-            # Check if there could be any points in the right subtree
-            if (
-                abs(query[axis] - node.point[1][axis])
-                < max(results, key=lambda x: x[1])[1]
-            ):
-                self._search_tree(node.right, query, k, results)
-        else:
-            self._search_tree(node.right, query, k, results)
-            # Check if there could be any points in the left subtree
-            if (
-                abs(query[axis] - node.point[1][axis])
-                < max(results, key=lambda x: x[1])[1]
-            ):
-                self._search_tree(node.left, query, k, results)
-
-    def _euclidean_distance(self, a: list, b: list) -> float:
-        """
-        Calculate the Euclidean distance between two vectors.
-        """
-        return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+        left, right = table.left, table.right
+        axes, splits = table.columns["axis"], table.columns["split"]
+
+        queue = [(0.0, 0)]  # (lower bound, node)
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if bound >= results.worst():
+                break  # no node left in the queue can hold a closer point
+            if left[node] < 0:
+                self._scan_leaf(segment, node, query, results, allowed)
+                continue
+            diff = float(query[axes[node]] - splits[node])
+            near, far = (
+                (left[node], right[node]) if diff < 0 else (right[node], left[node])
+            )
+            heapq.heappush(queue, (bound, int(near)))
+            far_bound = max(bound, abs(diff))
+            if far_bound < results.worst():
+                heapq.heappush(queue, (far_bound, int(far)))
@@ -1,34 +1,88 @@
-import math
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 from src.core.indexing.base import BaseIndex
+from src.core.indexing.chunk_matrix import ChunkMatrix, MatrixItems
+from src.core.indexing.metrics import check_metric
+from src.core.indexing.vector_store import MatrixStore, VectorStore
 
 
 class LinearSearch(BaseIndex):
-    def __init__(self):
-        self.data = []  # List of (id, embedding) tuples
+    def __init__(self, metric: str = "l2"):
+        self.metric = check_metric(metric)
+        # Contiguous float32 matrix, or the rows of the library's own matrix
+        self.store: VectorStore = VectorStore(metric=metric)
 
     def build_index(self, data: List[Tuple[str, list]]):
         """
-        Build the index from a list of (id, embedding) tuples.
+        Build the index from a list of (id, embedding) tuples. Rows of a
+        library's ChunkMatrix are shared rather than copied.
         """
-        self.data = data
+        if isinstance(data, MatrixItems):
+            ids = [id for id, _ in data]
+            self.store = MatrixStore(data.matrix, ids, data.rows, self.metric)
+            self._report_progress(1.0)
+            return
+        self.store = VectorStore.from_items(data, self.metric, self._report_progress)
 
-    def search(self, query_embedding: list, k: int) -> List[str]:
+    def search(
+        self, query_embedding: list, k: int, allowed: Optional[Set[str]] = None
+    ) -> List[str]:
         """
         Search for the k-nearest neighbors of the query embedding.
         """
-        # Calculate the Euclidean distance for all embeddings
-        distances = []
-        for id, embedding in self.data:
-            distance = self._euclidean_distance(query_embedding, embedding)
-            distances.append((id, distance))
+        # Vectorized distances to every embedding, then a partial sort for the top-k
+        mask = None if allowed is None else self.store.row_mask(allowed)
+        rows, _ = self.store.top_k(query_embedding, k, mask)
+        return [self.store.ids[row] for row in rows]
 
-        # Sort by distance and return the top-k results
-        distances.sort(key=lambda x: x[1])
-        return [id for id, _ in distances[:k]]
+    def search_batch(
+        self, queries: List[list], k: int, allowed: Optional[Set[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for the k-nearest neighbors of every query in one call.
+        """
+        # One matrix-matrix product for the whole batch
+        mask = None if allowed is None else self.store.row_mask(allowed)
+        rows, distances = self.store.top_k_batch(queries, k, mask=mask)
+        ids = self.store.ids
+        return [
+            [(ids[row], float(dist)) for row, dist in zip(query_rows, query_dists)]
+            for query_rows, query_dists in zip(rows.tolist(), distances.tolist())
+        ]
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Insert (id, embedding) tuples, replacing any existing ids.
+        """
+        self.store.delete([id for id, _ in items])
+        if isinstance(self.store, MatrixStore) and isinstance(items, MatrixItems):
+            self.store = self.store.moved_to(items.matrix)
+        if isinstance(self.store, MatrixStore) and not self.store.holds_rows_of(items):
+            self.store = self.store.copy()  # not rows of the library's matrix
+        self.store.append(items)
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Remove chunks by id.
+        """
+        return self.store.delete(ids)
 
-    def _euclidean_distance(self, a: list, b: list) -> float:
+    def memory_usage(self) -> int:
         """
-        Calculate the Euclidean distance between two vectors.
+        Bytes held by the vector store.
         """
-        return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+        return self.store.memory_usage()
+
+    def rebind(self, matrix: ChunkMatrix):
+        if isinstance(self.store, MatrixStore):
+            self.store = self.store.moved_to(matrix)
+
+    def copy_state(self) -> Dict[str, Any]:
+        if isinstance(self.store, MatrixStore):
+            return self._get_state()  # gathered from the shared matrix already
+        return super().copy_state()
+
+    def _get_state(self) -> Dict[str, Any]:
+        return {"config": {"metric": self.metric}, **self.store.get_state()}
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.store = VectorStore.from_state(state, self.metric)
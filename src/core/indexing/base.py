@@ -1,8 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.chunk_matrix import ChunkMatrix
+from src.core.indexing.persistence import read_index_file, write_index_file
 
 
 class BaseIndex(ABC):
+    # Called with the completed fraction (0-1) of a long build, if set
+    progress_callback: Optional[Callable[[float], None]] = None
+    # Distance metric of the index, one of metrics.METRICS
+    metric: str = "l2"
+
     @abstractmethod
     def build_index(self, data: List[Tuple[str, list]]):
         """
@@ -11,8 +19,129 @@ class BaseIndex(ABC):
         pass
 
     @abstractmethod
-    def search(self, query_embedding: list, k: int) -> List[str]:
+    def search(
+        self, query_embedding: list, k: int, allowed: Optional[Set[str]] = None
+    ) -> List[str]:
         """
         Search for the k-nearest neighbors of the query embedding.
+        If `allowed` is given, only those ids may be returned.
+        """
+        pass
+
+    @abstractmethod
+    def search_batch(
+        self, queries: List[list], k: int, allowed: Optional[Set[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for the k-nearest neighbors of every query in one call.
+        Returns, per query, a list of (id, distance) tuples sorted by distance.
+        If `allowed` is given, only those ids may be returned.
         """
         pass
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Insert (id, embedding) tuples into the built index. Existing ids are replaced.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support incremental inserts"
+        )
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Remove chunks from the built index by id. Returns the number removed.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support incremental deletes"
+        )
+
+    def memory_usage(self) -> Optional[int]:
+        """
+        Approximate bytes held by the index, or None when it is not tracked.
+        """
+        return None
+
+    def rebind(self, matrix: ChunkMatrix):
+        """
+        The library's chunks are now rows of `matrix`, e.g. after a compaction.
+        Indexes keeping rows of the previous matrix move to the new rows;
+        those holding their own vectors ignore it. Called with the index up
+        to date with the library.
+        """
+
+    def close(self):
+        """
+        Release what the index holds outside this process's memory, such as
+        shard server processes. The index must not be used afterwards.
+        """
+
+    def _report_progress(self, fraction: float):
+        """
+        Report how much of the current build is done to the progress callback.
+        """
+        if self.progress_callback is not None:
+            self.progress_callback(fraction)
+
+    def save(self, path: str, state: Optional[Dict[str, Any]] = None):
+        """
+        Write the index to a versioned binary file (see persistence.py), or
+        the `state` taken from it earlier with `copy_state`.
+        """
+        if state is None:
+            state = self._get_state()
+        write_index_file(path, type(self).__name__, state)
+
+    def copy_state(self) -> Dict[str, Any]:
+        """
+        `_get_state` sharing no array or list the index may still change in
+        place, so it can be saved after the index's lock is released.
+        """
+        state = self._get_state()
+        for name, value in state.items():
+            if isinstance(value, (np.ndarray, list)):
+                state[name] = value.copy()
+        return state
+
+    @classmethod
+    def load(cls, path: str) -> "BaseIndex":
+        """
+        Load an index written by `save`, whatever its algorithm. Vectors and
+        structure arrays are memory-mapped read-only and copied on first write.
+        """
+        index_type, state = read_index_file(path)
+        try:
+            return cls.from_state(index_type, state)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}")
+
+    @classmethod
+    def from_state(cls, index_type: str, state: Dict[str, Any]) -> "BaseIndex":
+        """
+        Restore an index of the named class from a `_get_state` state.
+        """
+        # imported here since the algorithms import this module
+        from src.core.indexing.algorithms import INDEXING_ALGORITHMS
+        from src.core.indexing.sharded import ShardedIndex
+
+        classes = {index.__name__: index for index in INDEXING_ALGORITHMS.values()}
+        classes[ShardedIndex.__name__] = ShardedIndex
+        index_class = classes.get(index_type)
+        if index_class is None or not issubclass(index_class, cls):
+            raise ValueError(f"{index_type} is not a {cls.__name__}")
+        state = dict(state)
+        index = index_class(**state.pop("config"))
+        index._set_state(state)
+        return index
+
+    def _get_state(self) -> Dict[str, Any]:
+        """
+        Everything needed to restore the index: numpy arrays, lists of strings
+        and JSON-serializable values. "config" holds the constructor arguments.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support saving")
+
+    def _set_state(self, state: Dict[str, Any]):
+        """
+        Restore the data of a freshly constructed index from `_get_state`.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support loading")
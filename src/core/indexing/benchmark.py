@@ -0,0 +1,337 @@
+"""
+Benchmark the indexing algorithms on recall, latency, throughput and memory.
+
+    python -m src.core.indexing.benchmark --n 20000 --dim 128 --k 10 --output bench.json
+    python -m src.core.indexing.benchmark --data base.fvecs --queries query.fvecs
+
+Every algorithm in INDEXING_ALGORITHMS (or those given with --algorithms) is
+built over the same data in its own forked process, so peak memory is measured
+per algorithm. Results are written as JSON.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from src.core.indexing.algorithms import INDEXING_ALGORITHMS
+from src.core.indexing.algorithms.linear_search import LinearSearch
+from src.core.indexing.sharded import ShardedIndex
+from src.utils.instrumentation import configure_logging, get_logger, log_event
+
+logger = get_logger("benchmark")
+
+
+def make_clustered(
+    n: int, dim: int, clusters: int = 32, spread: float = 0.1, seed: int = 0
+) -> np.ndarray:
+    """
+    Synthetic float32 vectors drawn around random cluster centers, which is
+    closer to real embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=n)
+    noise = rng.normal(scale=spread, size=(n, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def load_vectors(path: str) -> np.ndarray:
+    """
+    Load an (n, dim) float32 matrix from a .npy file or a .fvecs file (each
+    vector stored as an int32 dimension followed by that many float32 values).
+    """
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+    if path.endswith(".fvecs"):
+        raw = np.fromfile(path, dtype="<i4")
+        if not len(raw):
+            return np.zeros((0, 0), dtype=np.float32)
+        dim = int(raw[0])
+        return raw.reshape(-1, dim + 1)[:, 1:].view("<f4").astype(np.float32)
+    raise ValueError(f"Unsupported file type {path}, expected .npy or .fvecs")
+
+
+def run_benchmark(
+    data: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    algorithms: Optional[List[str]] = None,
+    params: Optional[Dict[str, Dict[str, Any]]] = None,
+    clients: int = 4,
+    isolate: bool = True,
+    shards: Optional[int] = None,
+    filtered: float = 0.1,
+) -> Dict[str, Any]:
+    """
+    Benchmark each algorithm against exact brute-force results. With
+    `isolate`, each algorithm runs in a forked child process so its peak RSS
+    is not inflated by the ones before it. With `shards`, every algorithm is
+    wrapped in a ShardedIndex of that many shards. Filtered recall is measured
+    with a random `filtered` fraction of the vectors allowed.
+    """
+    algorithms = algorithms or list(INDEXING_ALGORITHMS)
+    params = params or {}
+    metric = params.get("metric", "l2")
+    items = [(str(i), vector) for i, vector in enumerate(data)]
+
+    exact = LinearSearch(metric)
+    exact.build_index(items)
+    truth = [[id for id, _ in result] for result in exact.search_batch(queries, k)]
+    rng = np.random.default_rng(0)
+    allowed = {id for id, _ in items if rng.random() < filtered}
+    filtered_truth = [
+        [id for id, _ in result]
+        for result in exact.search_batch(queries, k, allowed=allowed)
+    ]
+
+    results = []
+    for name in algorithms:
+        kwargs = {"metric": metric, **params.get(name, {})}
+        log_event(logger, logging.INFO, "Benchmarking", algorithm=name, **kwargs)
+        args = (
+            name,
+            kwargs,
+            items,
+            queries,
+            truth,
+            k,
+            clients,
+            shards,
+            allowed,
+            filtered_truth,
+        )
+        result = _run_isolated(*args) if isolate else _run_algorithm(*args)
+        log_event(logger, logging.INFO, "Benchmarked", **result)
+        results.append(result)
+
+    return {
+        "dataset": {
+            "n": len(data),
+            "dim": int(data.shape[1]),
+            "queries": len(queries),
+        },
+        "k": k,
+        "clients": clients,
+        "shards": shards,
+        "filtered": filtered,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def _run_algorithm(
+    name: str,
+    kwargs: Dict[str, Any],
+    items: list,
+    queries: np.ndarray,
+    truth: List[List[str]],
+    k: int,
+    clients: int,
+    shards: Optional[int] = None,
+    allowed: Optional[Set[str]] = None,
+    filtered_truth: Optional[List[List[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    Build one index, then measure single-query latency, recall, recall with
+    only `allowed` ids, batch and concurrent throughput.
+    """
+    result: Dict[str, Any] = {"algorithm": name, "params": kwargs}
+    rss_before = _rss_bytes()
+    try:
+        if shards:
+            index = ShardedIndex(name, shards, **kwargs)
+        else:
+            index = INDEXING_ALGORITHMS[name](**kwargs)
+    except ValueError as e:  # e.g. a metric the algorithm does not support
+        return {**result, "error": str(e)}
+
+    start = time.perf_counter()
+    index.build_index(items)
+    result["build_seconds"] = time.perf_counter() - start
+    result["memory_bytes"] = index.memory_usage()
+
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        found.append(index.search(query, k))
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    result["latency_ms"] = {
+        "mean": float(latencies.mean()),
+        "p50": float(np.percentile(latencies, 50)),
+        "p99": float(np.percentile(latencies, 99)),
+    }
+    result["recall"] = _recall(truth, found)
+
+    if allowed is not None:
+        found = index.search_batch(queries, k, allowed=allowed)
+        if any(id not in allowed for neighbors in found for id, _ in neighbors):
+            return {**result, "error": "Filtered search returned disallowed ids"}
+        result["filtered_recall"] = _recall(
+            filtered_truth, [[id for id, _ in neighbors] for neighbors in found]
+        )
+
+    start = time.perf_counter()
+    index.search_batch(queries, k)
+    result["batch_qps"] = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(lambda query: index.search(query, k), queries))
+    result["concurrent_qps"] = len(queries) / (time.perf_counter() - start)
+
+    result["peak_rss_bytes"] = _peak_rss_bytes()
+    result["rss_growth_bytes"] = max(result["peak_rss_bytes"] - rss_before, 0)
+    return result
+
+
+def _recall(truth: List[List[str]], found: List[List[str]]) -> float:
+    """
+    Fraction of the exact neighbors found, over all queries.
+    """
+    hits = sum(
+        len(set(expected).intersection(neighbors))
+        for expected, neighbors in zip(truth, found)
+    )
+    return hits / max(sum(len(expected) for expected in truth), 1)
+
+
+def _run_isolated(*args) -> Dict[str, Any]:
+    """
+    Run `_run_algorithm` in a forked child. Falls back to the current process
+    where fork is not available.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return _run_algorithm(*args)
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    def target():
+        try:
+            sender.send(_run_algorithm(*args))
+        except Exception as e:
+            sender.send({"algorithm": args[0], "error": f"{type(e).__name__}: {e}"})
+
+    child = context.Process(target=target)
+    child.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:  # killed, e.g. out of memory
+        result = {"algorithm": args[0], "error": f"exit code {child.exitcode}"}
+    child.join()
+    return result
+
+
+def _rss_bytes() -> int:
+    """
+    Current resident set size of this process (Linux), or 0 if unknown.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process.
+    """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return _rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--n", type=int, default=10000, help="Synthetic vectors")
+    parser.add_argument("--dim", type=int, default=64, help="Synthetic dimension")
+    parser.add_argument("--clusters", type=int, default=32, help="Synthetic clusters")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", help=".npy or .fvecs file instead of synthetic data")
+    parser.add_argument(
+        "--queries", help=".npy or .fvecs queries; held out of --data if omitted"
+    )
+    parser.add_argument(
+        "--algorithms",
+        nargs="+",
+        choices=list(INDEXING_ALGORITHMS),
+        help="Algorithms to run (default: all)",
+    )
+    parser.add_argument(
+        "--params",
+        type=json.loads,
+        default={},
+        help='Constructor arguments per algorithm as JSON, e.g. \'{"hnsw": {"M": 32}}\''
+        ', and an optional top-level "metric"',
+    )
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent searchers")
+    parser.add_argument("--shards", type=int, help="Split every index into shards")
+    parser.add_argument(
+        "--filtered",
+        type=float,
+        default=0.1,
+        help="Fraction of the vectors allowed in filtered searches",
+    )
+    parser.add_argument(
+        "--no-isolate", action="store_true", help="Run all algorithms in-process"
+    )
+    parser.add_argument("--output", help="Write the JSON report here (default stdout)")
+    args = parser.parse_args(argv)
+
+    configure_logging("INFO", "text")
+    if args.data:
+        data = load_vectors(args.data)
+    else:
+        data = make_clustered(
+            args.n + (0 if args.queries else args.num_queries),
+            args.dim,
+            args.clusters,
+            seed=args.seed,
+        )
+    if args.queries:
+        queries = load_vectors(args.queries)[: args.num_queries]
+    else:
+        # hold the last vectors out as queries
+        data, queries = data[: -args.num_queries], data[-args.num_queries :]
+
+    report = run_benchmark(
+        data,
+        queries,
+        args.k,
+        args.algorithms,
+        args.params,
+        args.clients,
+        isolate=not args.no_isolate,
+        shards=args.shards,
+        filtered=args.filtered,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from typing import Dict, List, Tuple
+import numpy as np
+
+# Share of dead rows past which a library's matrix is compacted
+COMPACT_THRESHOLD = 0.25
+
+
+class ChunkMatrix:
+    """
+    Columnar storage of one library's chunk embeddings: a single float32
+    matrix, the chunk id of every row, and per document the runs of rows
+    holding its chunks.
+
+    Rows are written once and never changed. Removing a chunk only marks its
+    row dead; `compacted` copies the live rows, document by document, into a
+    new matrix and leaves this one as it is. Growing the matrix moves it to a
+    larger buffer but keeps every row number. Chunks hold read-only views of
+    their rows and indexes may keep row numbers instead of copies (see
+    MatrixStore), so each vector is stored once, and a background index build
+    can read the rows it was given without holding a lock.
+    """
+
+    def __init__(self):
+        # rows beyond len(self.ids) are spare capacity for appends
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.ids: List[str] = []  # Row -> chunk id, kept for dead rows
+        self.rows: Dict[str, int] = {}  # Chunk id -> live row
+        # Document id -> [start, end) runs of rows appended for it, in order
+        self.document_runs: Dict[str, List[Tuple[int, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def size(self) -> int:
+        """
+        Rows written, dead ones included.
+        """
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def needs_compaction(self) -> bool:
+        return self.size - len(self.rows) > COMPACT_THRESHOLD * self.size
+
+    def append(
+        self, document_id: str, ids: List[str], embeddings: List[np.ndarray]
+    ) -> bool:
+        """
+        Write the embeddings of a document's chunks to new rows, growing the
+        matrix geometrically. Returns whether it moved to a new buffer, in
+        which case views of the old one should be taken again.
+        """
+        if not ids:
+            return False
+        size, new_size = self.size, self.size + len(ids)
+        moved = new_size > len(self.vectors)
+        if moved:
+            dim = len(embeddings[0]) if size == 0 else self.dim
+            self._grow(max(new_size, 2 * len(self.vectors)), dim)
+
+        block = self.vectors[size:new_size]
+        block[:] = embeddings
+        self.sq_norms[size:new_size] = np.einsum("ij,ij->i", block, block)
+        for row, id in enumerate(ids, size):
+            self.rows[id] = row
+        self.ids.extend(ids)
+        runs = self.document_runs.setdefault(document_id, [])
+        if runs and runs[-1][1] == size:
+            runs[-1] = (runs[-1][0], new_size)  # the document was appended last
+        else:
+            runs.append((size, new_size))
+        return moved
+
+    def reserve(self, rows: int, dim: int):
+        """
+        Make room for `rows` more rows without growing further, e.g. before
+        registering a whole library. Only call it before taking views.
+        """
+        if self.size + rows > len(self.vectors):
+            self._grow(self.size + rows, dim if self.size == 0 else self.dim)
+
+    def _grow(self, capacity: int, dim: int):
+        size = self.size
+        grown = np.empty((capacity, dim), dtype=np.float32)
+        grown_norms = np.empty(capacity, dtype=np.float32)
+        if size:
+            grown[:size] = self.vectors[:size]
+            grown_norms[:size] = self.sq_norms[:size]
+        self.vectors, self.sq_norms = grown, grown_norms
+
+    def release(self, id: str):
+        """
+        Mark a chunk's row dead.
+        """
+        self.rows.pop(id, None)
+
+    def view(self, row: int) -> np.ndarray:
+        """
+        Read-only view of a row, to serve as its chunk's embedding.
+        """
+        view = self.vectors[row]
+        view.flags.writeable = False
+        return view
+
+    def compacted(self) -> "ChunkMatrix":
+        """
+        A new matrix holding only the live rows, each document's rows
+        contiguous.
+        """
+        matrix = ChunkMatrix()
+        order: List[int] = []
+        for document_id, runs in self.document_runs.items():
+            rows = [
+                row
+                for start, end in runs
+                for row in range(start, end)
+                if self.rows.get(self.ids[row]) == row
+            ]
+            if rows:
+                matrix.document_runs[document_id] = [
+                    (len(order), len(order) + len(rows))
+                ]
+                order.extend(rows)
+        if order:
+            matrix.vectors = self.vectors[order]
+            matrix.sq_norms = self.sq_norms[order]
+            matrix.ids = [self.ids[row] for row in order]
+            matrix.rows = {id: row for row, id in enumerate(matrix.ids)}
+        return matrix
+
+
+class MatrixItems(list):
+    """
+    (id, embedding) tuples whose embeddings are rows of one ChunkMatrix, with
+    their row numbers, so that an index may keep the rows instead of copying
+    the vectors. Indexes that copy treat it as a plain list.
+    """
+
+    def __init__(
+        self, matrix: ChunkMatrix, items: List[Tuple[str, np.ndarray]], rows: List[int]
+    ):
+        super().__init__(items)
+        self.matrix = matrix
+        self.rows = rows
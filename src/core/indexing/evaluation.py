@@ -0,0 +1,30 @@
+from typing import List, Tuple
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.algorithms.linear_search import LinearSearch
+
+
+def recall_at_k(
+    index: BaseIndex,
+    data: List[Tuple[str, list]],
+    queries: List[list],
+    k: int = 10,
+    **search_params,
+) -> float:
+    """
+    Fraction of the exact k-nearest neighbors (from LinearSearch over the same
+    (id, embedding) data and metric) that the index returns, averaged over the
+    queries.
+    """
+    if not queries or k <= 0:
+        return 0.0
+    ground_truth = LinearSearch(index.metric)
+    ground_truth.build_index(data)
+    expected = ground_truth.search_batch(queries, k)
+    found = index.search_batch(queries, k, **search_params)
+
+    hits = total = 0
+    for truth, result in zip(expected, found):
+        truth_ids = {id for id, _ in truth}
+        hits += len(truth_ids.intersection(id for id, _ in result))
+        total += len(truth_ids)
+    return hits / total if total else 0.0
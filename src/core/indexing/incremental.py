@@ -0,0 +1,336 @@
+import heapq
+import math
+from abc import abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.metrics import check_metric, prepare, to_distance
+from src.core.indexing.persistence import strip_prefix, with_prefix
+from src.core.indexing.tree_table import NodeTable, ProgressFunction
+from src.core.indexing.vector_store import VectorStore
+
+# Version of the segment layout; segments saved with another one are rebuilt on load
+TREE_LAYOUT = 2
+
+
+class CandidateHeap:
+    """
+    The k nearest (id, distance) candidates seen so far, kept in a bounded
+    max-heap so the current k-th distance is always at the top.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.heap: List[Tuple[float, str]] = []  # (-distance, id)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def worst(self) -> float:
+        """
+        Distance a candidate has to beat, infinity while fewer than k are known.
+        """
+        return -self.heap[0][0] if len(self.heap) >= self.k else math.inf
+
+    def push(self, id: str, distance: float):
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (-distance, id))
+        elif distance < -self.heap[0][0]:
+            heapq.heapreplace(self.heap, (-distance, id))
+
+    def sorted(self) -> List[Tuple[str, float]]:
+        return [(id, -distance) for distance, id in sorted(self.heap, reverse=True)]
+
+
+class TreeSegment:
+    def __init__(self, store: VectorStore, table: NodeTable):
+        # Ids and vectors in tree order: node i's points are rows start[i]:end[i]
+        self.store = store
+        self.table = table  # The static tree over the rows of the store
+        self.deleted: Set[str] = set()  # Tombstoned ids, skipped by search
+
+    @property
+    def live_size(self) -> int:
+        return len(self.store) - len(self.deleted)
+
+    def live_rows(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Ids and vectors of the points that are not tombstoned.
+        """
+        ids = self.store.ids
+        rows = [row for row, id in enumerate(ids) if id not in self.deleted]
+        return [ids[row] for row in rows], self.store.vectors[rows]
+
+
+class IncrementalTreeIndex(BaseIndex):
+    """
+    Base class for static trees that supports inserts and deletes without a full rebuild.
+
+    The index is a set of static tree segments plus a small insert buffer that is
+    searched by brute force. When the buffer fills up it is flushed into a new
+    segment, merging in every existing segment that is not larger than it, so
+    segment sizes stay roughly powers of two and each point is rebuilt only
+    O(log n) times (the Bentley-Saxe logarithmic method). Deletes leave
+    tombstones; a segment is rebuilt on its own once the share of tombstoned
+    points passes `rebuild_threshold`. Tombstoned points still guide the tree
+    traversal but are never returned, so search stays exact.
+
+    Trees are flat NodeTables with leaf buckets of up to `leaf_size` points,
+    each stored as a contiguous slice of its segment. Searches traverse them
+    best-first: nodes are visited in order of a lower bound on their distance
+    to the query until no node can beat the current k-th neighbor, so results
+    are exact. Large trees are built in parallel worker processes
+    (`build_processes`, defaults to one per core).
+
+    Trees prune with the triangle inequality, so they support the l2 and
+    cosine metrics (cosine as Euclidean distance between normalized vectors)
+    but not dot products.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 64,
+        rebuild_threshold: float = 0.5,
+        build_processes: Optional[int] = None,
+        metric: str = "l2",
+        leaf_size: int = 32,
+    ):
+        if check_metric(metric) == "dot":
+            raise ValueError(f"{type(self).__name__} does not support the dot metric")
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be at least 1")
+        self.buffer_size = buffer_size
+        self.rebuild_threshold = rebuild_threshold
+        self.build_processes = build_processes
+        self.metric = metric
+        self.leaf_size = leaf_size  # Most points in a leaf bucket
+        self.segments: List[TreeSegment] = []  # Largest first
+        self.buffer = VectorStore(metric=metric)  # Recent inserts not in any tree
+        self._locations: Dict[str, TreeSegment] = {}  # id -> segment holding it
+
+    @abstractmethod
+    def _build_tree(
+        self, vectors: np.ndarray, progress: Optional[ProgressFunction] = None
+    ) -> NodeTable:
+        """
+        Build a static tree over the rows of a float32 matrix, reporting the
+        fraction done to `progress`.
+        """
+        pass
+
+    @abstractmethod
+    def _search_tree(
+        self,
+        segment: TreeSegment,
+        query: np.ndarray,
+        results: CandidateHeap,
+        allowed: Optional[Set[str]] = None,
+    ):
+        """
+        Offer the segment's nearest live points (restricted to `allowed` if
+        given) to the shared candidate heap.
+        """
+        pass
+
+    def build_index(self, data: List[Tuple[str, list]]):
+        """
+        Build the index from a list of (id, embedding) tuples.
+        """
+        self.segments = []
+        self.buffer = VectorStore(metric=self.metric)
+        self._locations = {}
+        if data:
+            # converting the embeddings is about a fifth of the build
+            store = VectorStore.from_items(
+                data, self.metric, lambda done: self._report_progress(0.2 * done)
+            )
+            self._add_segment(
+                store.ids,
+                store.vectors,
+                lambda done: self._report_progress(0.2 + 0.8 * done),
+            )
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Insert (id, embedding) tuples, replacing any existing ids.
+        """
+        self.remove([id for id, _ in items])
+        self.buffer.append(items)
+        if len(self.buffer) >= self.buffer_size:
+            self._flush_buffer()
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Tombstone chunks by id, rebuilding any segment that became too sparse.
+        """
+        removed = self.buffer.delete(ids)
+        touched = []
+        for id in ids:
+            segment = self._locations.pop(id, None)
+            if segment is None:
+                continue
+            segment.deleted.add(id)
+            touched.append(segment)
+            removed += 1
+
+        for segment in set(touched):
+            if len(segment.deleted) > self.rebuild_threshold * len(segment.store):
+                self._rebuild_segment(segment)
+        return removed
+
+    def search(
+        self, query_embedding: list, k: int, allowed: Optional[Set[str]] = None
+    ) -> List[str]:
+        """
+        Search for the k-nearest neighbors of the query embedding.
+        """
+        return [id for id, _ in self._nearest(query_embedding, k, allowed)]
+
+    def search_batch(
+        self, queries: List[list], k: int, allowed: Optional[Set[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for the k-nearest neighbors of every query in one call.
+        """
+        return [self._nearest(query, k, allowed) for query in queries]
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the segments' vectors and node tables plus the buffer.
+        """
+        return self.buffer.memory_usage() + sum(
+            segment.store.memory_usage() + segment.table.nbytes
+            for segment in self.segments
+        )
+
+    def _get_state(self) -> Dict[str, Any]:
+        state = {
+            "config": {
+                "buffer_size": self.buffer_size,
+                "rebuild_threshold": self.rebuild_threshold,
+                "build_processes": self.build_processes,
+                "metric": self.metric,
+                "leaf_size": self.leaf_size,
+            },
+            "layout": TREE_LAYOUT,
+            "segments": len(self.segments),
+            **with_prefix("buffer", self.buffer.get_state()),
+        }
+        for i, segment in enumerate(self.segments):
+            state.update(with_prefix(f"segments.{i}", segment.store.get_state()))
+            state.update(with_prefix(f"tables.{i}", segment.table.get_state()))
+            state[f"segments.{i}.deleted"] = sorted(segment.deleted)
+        return state
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.buffer = VectorStore.from_state(strip_prefix("buffer", state), self.metric)
+        for i in range(state["segments"]):
+            store = VectorStore.from_state(
+                strip_prefix(f"segments.{i}", state), self.metric
+            )
+            deleted = set(state[f"segments.{i}.deleted"])
+            if state.get("layout") != TREE_LAYOUT:
+                # trees of an older layout are rebuilt from their live points
+                rows = [row for row, id in enumerate(store.ids) if id not in deleted]
+                if rows:
+                    self._add_segment(
+                        [store.ids[row] for row in rows], store.vectors[rows]
+                    )
+                continue
+            segment = TreeSegment(
+                store, NodeTable.from_state(strip_prefix(f"tables.{i}", state))
+            )
+            segment.deleted = deleted
+            for id in segment.store.ids:
+                if id not in segment.deleted:
+                    self._locations[id] = segment
+            self.segments.append(segment)
+
+    def _nearest(
+        self, query: list, k: int, allowed: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        The k-nearest (id, distance) pairs of the query, sorted by distance.
+        Trees are searched by Euclidean distance between prepared vectors,
+        which is converted to the metric at the end.
+        """
+        if k <= 0:
+            return []
+        query = prepare(query, self.metric)
+
+        # Seed the results with the buffer so the trees start with a tight bound
+        mask = None if allowed is None else self.buffer.row_mask(allowed)
+        rows, _ = self.buffer.top_k(query, k, mask)
+        results = CandidateHeap(k)
+        if len(rows):
+            distances = np.linalg.norm(self.buffer.vectors[rows] - query, axis=1)
+            for row, dist in zip(rows.tolist(), distances.tolist()):
+                results.push(self.buffer.ids[row], dist)
+        for segment in self.segments:
+            self._search_tree(segment, query, results, allowed)
+        results = results.sorted()
+        if self.metric == "l2":
+            return results
+        return [(id, float(to_distance(dist**2, self.metric))) for id, dist in results]
+
+    def _flush_buffer(self):
+        """
+        Turn the buffer into a segment, merging every segment that is not larger.
+        """
+        ids, parts = list(self.buffer.ids), [self.buffer.vectors]
+        self.buffer = VectorStore(metric=self.metric)
+        while self.segments and self.segments[-1].live_size <= len(ids):
+            segment_ids, segment_vectors = self.segments.pop().live_rows()
+            ids.extend(segment_ids)
+            parts.append(segment_vectors)
+        self._add_segment(ids, np.concatenate(parts))
+
+    def _rebuild_segment(self, segment: TreeSegment):
+        """
+        Rebuild a single segment without its tombstoned points.
+        """
+        self.segments.remove(segment)
+        ids, vectors = segment.live_rows()
+        if ids:
+            self._add_segment(ids, vectors)
+
+    def _scan_leaf(
+        self,
+        segment: TreeSegment,
+        node: int,
+        query: np.ndarray,
+        results: CandidateHeap,
+        allowed: Optional[Set[str]] = None,
+    ):
+        """
+        Offer the live points of a leaf bucket to the candidate heap.
+        """
+        start, end = int(segment.table.start[node]), int(segment.table.end[node])
+        diff = segment.store.vectors[start:end] - query
+        distances = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        ids = segment.store.ids
+        # only points closer than the current k-th neighbor are looked up
+        for offset in np.flatnonzero(distances < results.worst()).tolist():
+            id = ids[start + offset]
+            if id in segment.deleted or (allowed is not None and id not in allowed):
+                continue
+            results.push(id, float(distances[offset]))
+
+    def _add_segment(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        progress: Optional[ProgressFunction] = None,
+    ):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        table = self._build_tree(vectors, progress)
+        # store the points in tree order, so every node's points are one slice
+        order = table.order
+        store = VectorStore(
+            [ids[row] for row in order.tolist()], vectors[order], metric=self.metric
+        )
+        segment = TreeSegment(store, table)
+        for id in ids:
+            self._locations[id] = segment
+        self.segments.append(segment)
+        self.segments.sort(key=lambda s: s.live_size, reverse=True)
@@ -0,0 +1,247 @@
+import bisect
+import json
+import logging
+import os
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.algorithms.linear_search import LinearSearch
+from src.core.indexing.base import BaseIndex
+from src.utils.instrumentation import get_logger, log_event
+
+# Filter operators; a bare value means "eq"
+COMPARISONS = ("gt", "gte", "lt", "lte")
+OPERATORS = ("eq", "in") + COMPARISONS
+
+# (field, operator, operand)
+Condition = Tuple[str, str, Any]
+
+# Filters matching at most this share of a library are answered by an exact
+# brute-force scan of the matches instead of a filtered index traversal
+BRUTE_FORCE_SELECTIVITY = float(
+    os.environ.get("VECTOR_DB_FILTER_BRUTE_FORCE_SELECTIVITY", "0.05")
+)
+
+logger = get_logger("metadata")
+
+
+def parse_filter(filter: Dict[str, Any]) -> List[Condition]:
+    """
+    Validate a filter expression and flatten it into conditions, all of which
+    must hold. Each key names a metadata field and maps to either a value
+    (equality) or a dict of operators, e.g.
+
+        {"author": "Jane", "tags": {"in": ["ai", "ml"]}, "year": {"gte": 2000}}
+
+    Raises ValueError for unknown operators or operands of the wrong type.
+    """
+    conditions = []
+    for field, spec in filter.items():
+        if not isinstance(spec, dict):
+            spec = {"eq": spec}
+        if not spec:
+            raise ValueError(f"Empty condition for field {field}")
+        for operator, operand in spec.items():
+            if operator not in OPERATORS:
+                raise ValueError(
+                    f"Unknown filter operator {operator}, expected one of {OPERATORS}"
+                )
+            if operator == "in" and not isinstance(operand, list):
+                raise ValueError(f"Operator 'in' on {field} needs a list")
+            if operator in COMPARISONS and not _is_number(operand):
+                raise ValueError(f"Operator '{operator}' on {field} needs a number")
+            operands = operand if operator == "in" else [operand]
+            if not all(isinstance(value, Hashable) for value in operands):
+                raise ValueError(f"Cannot compare {field} with {operand!r}")
+            conditions.append((field, operator, operand))
+    return conditions
+
+
+class MetadataIndex:
+    """
+    Inverted index over the metadata of a library's chunks.
+
+    Chunks get a row number; every (field, value) pair maps to the set of rows
+    that hold it. List values are indexed per element, so `{"tags": "ai"}`
+    matches a chunk tagged ["ai", "ml"]. Numeric values are also kept sorted
+    per field (rebuilt lazily after changes) to answer range conditions with
+    binary search. A filter is evaluated into a bitmap over the rows.
+    """
+
+    def __init__(self):
+        self.ids: List[Optional[str]] = []  # Row -> chunk id, None for free rows
+        self.rows: Dict[str, int] = {}  # Chunk id -> row
+        self.free_rows: List[int] = []
+        # field -> value -> rows, an array instead of a set once restored
+        self.postings: Dict[str, Dict[Any, Set[int]]] = {}
+        self.row_values: Dict[int, List[Tuple[str, Any]]] = {}  # For removal
+        self._sorted: Dict[str, Tuple[List[float], np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, chunk_id: str, metadata: Dict[str, Any]):
+        """
+        Index a chunk's metadata, replacing any previous entry for it.
+        """
+        self.remove(chunk_id)
+        row = self.free_rows.pop() if self.free_rows else len(self.ids)
+        if row == len(self.ids):
+            self.ids.append(chunk_id)
+        else:
+            self.ids[row] = chunk_id
+        self.rows[chunk_id] = row
+
+        pairs = []
+        for field, value in metadata.items():
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, Hashable):
+                    pairs.append((field, item))
+        for field, item in pairs:
+            self.postings.setdefault(field, {}).setdefault(item, set()).add(row)
+            self._sorted.pop(field, None)
+        self.row_values[row] = pairs
+
+    def remove(self, chunk_id: str):
+        """
+        Drop a chunk from the index.
+        """
+        row = self.rows.pop(chunk_id, None)
+        if row is None:
+            return
+        for field, item in self.row_values.pop(row):
+            values = self.postings[field]
+            values[item].discard(row)
+            if not values[item]:
+                del values[item]
+            self._sorted.pop(field, None)
+        self.ids[row] = None
+        self.free_rows.append(row)
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Chunk rows and postings as flat arrays, for a library image. Shares
+        nothing with the index, so it may change once this returns.
+        """
+        keys, rows = [], []
+        for field, values in self.postings.items():
+            for value, value_rows in values.items():
+                keys.append(json.dumps([field, value], default=str))
+                rows.append(np.fromiter(value_rows, np.int64, len(value_rows)))
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(value_rows) for value_rows in rows], out=offsets[1:])
+        return {
+            "config": {"size": len(self.ids)},
+            "ids": list(self.rows),
+            "rows": np.fromiter(self.rows.values(), np.int64, len(self.rows)),
+            "keys": keys,
+            "offsets": offsets,
+            "postings": np.concatenate(rows) if rows else offsets[:0],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "MetadataIndex":
+        """
+        Restore an index from `get_state` for matching only: the postings stay
+        (memory-mapped) arrays, and chunks cannot be added or removed.
+        Values come back as they are in JSON, others as strings.
+        """
+        index = cls()
+        index.ids = [None] * state["config"]["size"]
+        for id, row in zip(state["ids"], state["rows"].tolist()):
+            index.ids[row] = id
+            index.rows[id] = row
+        offsets = state["offsets"].tolist()
+        for key, start, end in zip(state["keys"], offsets[:-1], offsets[1:]):
+            field, value = json.loads(key)
+            index.postings.setdefault(field, {})[value] = state["postings"][start:end]
+        return index
+
+    def match(self, conditions: List[Condition]) -> Set[str]:
+        """
+        Ids of the chunks that satisfy every condition.
+        """
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[list(self.rows.values())] = True
+        for condition in conditions:
+            mask &= self._bitmap(*condition)
+        return {self.ids[row] for row in np.flatnonzero(mask).tolist()}
+
+    def _bitmap(self, field: str, operator: str, operand: Any) -> np.ndarray:
+        """
+        Bitmap of the rows satisfying one condition.
+        """
+        bitmap = np.zeros(len(self.ids), dtype=bool)
+        values = self.postings.get(field, {})
+        if operator in ("eq", "in"):
+            for value in operand if operator == "in" else [operand]:
+                rows = values.get(value)
+                if rows is not None and len(rows):
+                    bitmap[rows if isinstance(rows, np.ndarray) else list(rows)] = True
+            return bitmap
+
+        # Range condition: binary search the sorted numeric values of the field
+        keys, rows = self._sorted_values(field)
+        if operator == "gt":
+            bitmap[rows[bisect.bisect_right(keys, operand) :]] = True
+        elif operator == "gte":
+            bitmap[rows[bisect.bisect_left(keys, operand) :]] = True
+        elif operator == "lt":
+            bitmap[rows[: bisect.bisect_left(keys, operand)]] = True
+        else:
+            bitmap[rows[: bisect.bisect_right(keys, operand)]] = True
+        return bitmap
+
+    def _sorted_values(self, field: str) -> Tuple[List[float], np.ndarray]:
+        """
+        The field's numeric values in ascending order with their rows.
+        """
+        if field not in self._sorted:
+            entries = sorted(
+                (value, row)
+                for value, rows in self.postings.get(field, {}).items()
+                if _is_number(value)
+                for row in rows
+            )
+            self._sorted[field] = (
+                [value for value, _ in entries],
+                np.array([row for _, row in entries], dtype=np.int64),
+            )
+        return self._sorted[field]
+
+
+def filtered_search_batch(
+    index: BaseIndex,
+    queries: List[list],
+    k: int,
+    matches: List[Tuple[str, list]],
+    total: int,
+    **params,
+) -> List[List[Tuple[str, float]]]:
+    """
+    k-NN search restricted to the (id, embedding) pairs matching a filter,
+    out of `total` chunks. Selective filters leave too few matches for an
+    index traversal to find k of them cheaply (an HNSW beam would walk most
+    of the graph), so they are scanned exactly; broader ones search the
+    index, which skips the ids that do not match.
+    """
+    if not matches:
+        return [[] for _ in queries]
+    brute_force = len(matches) <= max(k, BRUTE_FORCE_SELECTIVITY * total)
+    log_event(
+        logger,
+        logging.DEBUG,
+        "Filtered search",
+        matches=len(matches),
+        total=total,
+        plan="brute force" if brute_force else "filtered index",
+    )
+    if brute_force:
+        scan = LinearSearch(index.metric)
+        scan.build_index(matches)
+        return scan.search_batch(queries, k)
+    allowed = {id for id, _ in matches}
+    return index.search_batch(queries, k, allowed=allowed, **params)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
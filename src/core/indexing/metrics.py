@@ -0,0 +1,59 @@
+import numpy as np
+
+# Distance metrics. Every index reports distances where smaller is closer:
+#   l2      Euclidean distance
+#   cosine  1 - cosine similarity
+#   dot     negative inner product
+METRICS = ("l2", "cosine", "dot")
+
+
+def check_metric(metric: str) -> str:
+    """
+    Validate a metric name, raising ValueError for unknown ones.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+    return metric
+
+
+def prepare(vectors: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Convert embeddings (or queries) to float32. For cosine they are scaled to
+    unit length once, when stored, so cosine search becomes Euclidean search on
+    the unit sphere: ||a - b||^2 = 2 - 2 cos(a, b). Zero vectors stay zero.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric == "cosine":
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        vectors = vectors / np.maximum(norms, np.float32(1e-12))
+    return vectors
+
+
+def scores(
+    queries: np.ndarray, vectors: np.ndarray, sq_norms: np.ndarray, metric: str
+) -> np.ndarray:
+    """
+    Ranking scores (smaller is closer) between every prepared query and every
+    stored vector, from one matrix product: squared Euclidean distances for
+    l2 and cosine, using the cached squared norms of the vectors, and negative
+    inner products for dot.
+    """
+    products = queries @ vectors.T
+    if metric == "dot":
+        return np.negative(products, out=products)
+    products *= -2.0
+    products += sq_norms[None, :]
+    products += np.einsum("ij,ij->i", queries, queries)[:, None]
+    # rounding can push near-zero distances slightly negative
+    return np.maximum(products, 0.0, out=products)
+
+
+def to_distance(scores: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Turn ranking scores into the distances reported by the metric.
+    """
+    if metric == "l2":
+        return np.sqrt(scores)
+    if metric == "cosine":
+        return scores / 2
+    return scores
@@ -0,0 +1,141 @@
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+# File layout (all integers little-endian):
+#   magic (8 bytes) | format version (uint32) | header length (uint32)
+#   | JSON header | zero padding | data blocks, each aligned to ALIGNMENT
+# The header holds the index type, scalar values, and the dtype, shape and
+# offset (from the start of the data) of every array. Lists of strings are
+# stored as a string table: one utf-8 blob plus an int64 array of offsets.
+MAGIC = b"VDBINDEX"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def write_index_file(path: str, index_type: str, state: Dict[str, Any]):
+    """
+    Write an index state to `path`. State values may be numpy arrays, lists of
+    strings or JSON-serializable values. The file is replaced atomically.
+    """
+    values: Dict[str, Any] = {}
+    blocks: List[Tuple[str, np.ndarray]] = []
+    strings: List[str] = []
+    for name, value in state.items():
+        if isinstance(value, np.ndarray):
+            blocks.append((name, value))
+        elif (
+            isinstance(value, list)
+            and value
+            and all(isinstance(item, str) for item in value)
+        ):
+            data, offsets = _encode_strings(value)
+            blocks += [(f"{name}.data", data), (f"{name}.offsets", offsets)]
+            strings.append(name)
+        else:
+            values[name] = value
+
+    arrays = {}
+    offset = 0
+    for name, array in blocks:
+        if array.dtype.hasobject:
+            raise ValueError(f"Cannot store object array {name}")
+        arrays[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(
+        {"type": index_type, "values": values, "arrays": arrays, "strings": strings}
+    ).encode()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        data_start = _align(_PREAMBLE.size + len(header))
+        for name, array in blocks:
+            f.seek(data_start + arrays[name]["offset"])
+            f.write(np.ascontiguousarray(array).data)
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_index_file(path: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Read an index file written by write_index_file. Returns the index type and
+    its state. Arrays are read-only views of a memory map of the file, so they
+    are paged in on demand and shared by every process that maps the same file.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buffer) < _PREAMBLE.size:
+        raise ValueError(f"{path} is not an index file")
+    magic, version, header_length = _PREAMBLE.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an index file")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported index file version {version} in {path}")
+    header = json.loads(buffer[_PREAMBLE.size : _PREAMBLE.size + header_length])
+
+    data_start = _align(_PREAMBLE.size + header_length)
+    state = dict(header["values"])
+    for name, spec in header["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        count = int(np.prod(shape))
+        if count == 0:
+            state[name] = np.empty(shape, dtype=dtype)
+            continue
+        state[name] = np.frombuffer(
+            buffer, dtype, count, data_start + spec["offset"]
+        ).reshape(shape)
+    for name in header["strings"]:
+        state[name] = _decode_strings(
+            state.pop(f"{name}.data"), state.pop(f"{name}.offsets")
+        )
+    return header["type"], state
+
+
+def with_prefix(prefix: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Namespace the keys of a nested state, e.g. one per segment.
+    """
+    return {f"{prefix}.{name}": value for name, value in state.items()}
+
+
+def strip_prefix(prefix: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The entries of a state namespaced with `with_prefix`.
+    """
+    start = len(prefix) + 1
+    return {
+        name[start:]: value
+        for name, value in state.items()
+        if name.startswith(f"{prefix}.")
+    }
+
+
+def _encode_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    blob = data.tobytes()
+    bounds = offsets.tolist()
+    return [blob[a:b].decode() for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,368 @@
+import heapq
+import multiprocessing
+import os
+import threading
+import weakref
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.persistence import strip_prefix, with_prefix
+
+# How shards are searched in parallel: "threads" searches them on a thread pool
+# (numpy releases the GIL in the distance kernels), "processes" gives every
+# shard a forked shard server process. Forking a process that already runs
+# threads can deadlock the child on a lock some thread held, so processes are
+# only safe where the index is loaded before any threads start
+SHARD_EXECUTOR = os.environ.get("VECTOR_DB_SHARD_EXECUTOR", "threads")
+EXECUTORS = ("processes", "threads")
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_thread_pool_guard = threading.Lock()
+# parent ends of the shard server pipes of this process
+_connections: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def shard_of(id: str, shards: int) -> int:
+    """
+    Shard of a chunk id. Stable across processes and restarts, unlike hash().
+    """
+    return zlib.crc32(id.encode()) % shards
+
+
+class ShardServer:
+    """
+    A shard index owned by a forked child process and driven over a pipe.
+    The child inherits the index (and any memory-mapped arrays) from the fork,
+    so nothing is copied to start it. Calls name a method of the index; the
+    child answers with its result or the exception it raised.
+    """
+
+    def __init__(self, index: BaseIndex, items: Optional[List[Tuple[str, list]]]):
+        """
+        Start the server, building the index over `items` first if given.
+        """
+        context = multiprocessing.get_context("fork")
+        self.connection, child = context.Pipe()
+        # not a daemon, so that it may start tree build workers of its own
+        self.process = context.Process(target=_serve_shard, args=(index, items, child))
+        self.process.start()
+        child.close()
+        _connections.add(self.connection)
+        self.lock = threading.Lock()  # one call at a time on the pipe
+        # also stops the server if the index is dropped without closing it
+        self._stop = weakref.finalize(self, _stop_server, self.connection, self.process)
+
+    def stop(self):
+        """
+        Stop the child process. The server must not be called afterwards.
+        """
+        self._stop()
+
+    def send(self, method: str, *args, **kwargs):
+        self.connection.send((method, args, kwargs))
+
+    def receive(self) -> Any:
+        try:
+            failed, value = self.connection.recv()
+        except EOFError:
+            raise RuntimeError(f"Shard server exited with code {self.process.exitcode}")
+        if failed:
+            raise value
+        return value
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        with self.lock:
+            self.send(method, *args, **kwargs)
+            return self.receive()
+
+
+def _serve_shard(
+    index: BaseIndex,
+    items: Optional[List[Tuple[str, list]]],
+    connection,
+):
+    # copies of other servers' pipes would keep them from seeing EOF
+    for other in list(_connections):
+        other.close()
+    if items is not None:
+        try:
+            index.build_index(items)
+            connection.send((False, None))
+        except Exception as e:
+            connection.send((True, e))
+            return
+    while True:
+        try:
+            method, args, kwargs = connection.recv()
+        except EOFError:  # the index was dropped
+            return
+        try:
+            connection.send((False, getattr(index, method)(*args, **kwargs)))
+        except Exception as e:
+            connection.send((True, e))
+
+
+def _stop_server(connection, process):
+    connection.close()  # the child exits on EOF
+    process.join(timeout=1)
+    if process.is_alive():
+        process.terminate()
+
+
+class ShardedIndex(BaseIndex):
+    """
+    Splits a library into `shards` indexes of one algorithm, assigning each
+    chunk by a hash of its id. A search is sent to every shard in parallel
+    and their sorted top-k lists are merged with a k-way heap merge.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = "linear_search",
+        shards: int = 2,
+        executor: str = SHARD_EXECUTOR,
+        **params,
+    ):
+        # imported here since the algorithms import the base module
+        from src.core.indexing.algorithms import INDEXING_ALGORITHMS
+
+        if algorithm not in INDEXING_ALGORITHMS:
+            raise ValueError(f"Invalid Indexing Algorithm: {algorithm}")
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        if executor not in EXECUTORS:
+            raise ValueError(
+                f"Unknown executor {executor}, expected one of {EXECUTORS}"
+            )
+        if "fork" not in multiprocessing.get_all_start_methods():
+            executor = "threads"
+        self.algorithm = algorithm
+        self.shard_class = INDEXING_ALGORITHMS[algorithm]
+        self.params = params
+        self.executor = executor
+        # rejects parameters the algorithm does not take
+        self.indexes = [self.shard_class(**params) for _ in range(shards)]
+        self.metric = self.indexes[0].metric
+        self.servers: List[ShardServer] = []
+
+    def build_index(self, data: List[Tuple[str, list]]):
+        """
+        Build the index from a list of (id, embedding) tuples, one shard per
+        process or thread.
+        """
+        parts: List[List[Tuple[str, list]]] = [[] for _ in self.indexes]
+        for item in data:
+            parts[shard_of(item[0], len(parts))].append(item)
+        self.close()  # a rebuild replaces the servers
+        self.indexes = [self.shard_class(**self.params) for _ in parts]
+
+        if self.executor == "threads":
+            builds = [("build_index", (part,), {}) for part in parts]
+            for done, _ in enumerate(_pool().map(_call, self.indexes, builds)):
+                self._report_progress((done + 1) / len(parts))
+            return
+
+        # the shards are built in their servers, which fork with their part
+        self.servers = [
+            ShardServer(index, part) for index, part in zip(self.indexes, parts)
+        ]
+        for done, server in enumerate(self.servers):
+            with server.lock:
+                server.receive()
+            self._report_progress((done + 1) / len(parts))
+
+    def search(
+        self,
+        query_embedding: list,
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        **params,
+    ) -> List[str]:
+        """
+        Search for the k-nearest neighbors of the query embedding.
+        """
+        neighbors = self.search_batch([query_embedding], k, allowed=allowed, **params)
+        return [id for id, _ in neighbors[0]]
+
+    def search_batch(
+        self,
+        queries: List[list],
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        **params,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search every shard for the whole batch, then merge the per-shard
+        results of each query. `params` go to the shards' search_batch.
+        """
+        calls = []
+        for shard_allowed in self._split(allowed):
+            if shard_allowed is not None and not shard_allowed:
+                calls.append(None)  # nothing allowed in this shard
+            else:
+                calls.append(
+                    (
+                        "search_batch",
+                        (queries, k),
+                        {"allowed": shard_allowed, **params},
+                    )
+                )
+        results = [
+            found if found is not None else [[] for _ in queries]
+            for found in self._scatter(calls)
+        ]
+        return [
+            list(
+                islice(
+                    heapq.merge(*per_shard, key=lambda neighbor: neighbor[1]),
+                    k,
+                )
+            )
+            for per_shard in zip(*results)
+        ]
+
+    def add(self, items: List[Tuple[str, list]]):
+        """
+        Insert (id, embedding) tuples into their shards. Existing ids are
+        replaced, as an id always hashes to the same shard.
+        """
+        parts: List[List[Tuple[str, list]]] = [[] for _ in self.indexes]
+        for item in items:
+            parts[shard_of(item[0], len(parts))].append(item)
+        self._scatter([("add", (part,), {}) if part else None for part in parts])
+
+    def remove(self, ids: List[str]) -> int:
+        """
+        Remove chunks by id. Returns the number removed.
+        """
+        parts: List[List[str]] = [[] for _ in self.indexes]
+        for id in ids:
+            parts[shard_of(id, len(parts))].append(id)
+        removed = self._scatter(
+            [("remove", (part,), {}) if part else None for part in parts]
+        )
+        return sum(count for count in removed if count is not None)
+
+    def close(self):
+        """
+        Stop the shard servers, if any.
+        """
+        servers, self.servers = self.servers, []
+        for server in servers:
+            server.stop()
+
+    def memory_usage(self) -> Optional[int]:
+        """
+        Bytes held by all shards, or None if their algorithm does not track it.
+        """
+        usages = self._scatter([("memory_usage", (), {}) for _ in self.indexes])
+        if any(usage is None for usage in usages):
+            return None
+        return sum(usages)
+
+    def _split(self, allowed: Optional[Set[str]]) -> List[Optional[Set[str]]]:
+        """
+        The allowed ids of each shard, so each only receives its own.
+        """
+        if allowed is None:
+            return [None] * len(self.indexes)
+        parts: List[Set[str]] = [set() for _ in self.indexes]
+        for id in allowed:
+            parts[shard_of(id, len(parts))].add(id)
+        return parts
+
+    def _scatter(
+        self, calls: List[Optional[Tuple[str, tuple, Dict[str, Any]]]]
+    ) -> List[Any]:
+        """
+        Call a method on every shard given a (method, args, kwargs) call, in
+        parallel. Returns the results in shard order, None where no call.
+        """
+        if not self.servers:
+            return list(_pool().map(_call, self.indexes, calls))
+
+        # hold every pipe for the whole scatter, locked in shard order
+        servers = [server for server, call in zip(self.servers, calls) if call]
+        for server in servers:
+            server.lock.acquire()
+        try:
+            for server, call in zip(self.servers, calls):
+                if call is not None:
+                    server.send(call[0], *call[1], **call[2])
+            results = []
+            error: Optional[Exception] = None
+            for server, call in zip(self.servers, calls):
+                if call is None:
+                    results.append(None)
+                    continue
+                try:  # read every answer, even after a failure
+                    results.append(server.receive())
+                except Exception as e:
+                    error = error or e
+                    results.append(None)
+            if error is not None:
+                raise error
+            return results
+        finally:
+            for server in servers:
+                server.lock.release()
+
+    def _get_state(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = {
+            "config": {
+                "algorithm": self.algorithm,
+                "shards": len(self.indexes),
+                "executor": self.executor,
+                **self.params,
+            }
+        }
+        shard_states = self._scatter([("_get_state", (), {}) for _ in self.indexes])
+        for number, shard_state in enumerate(shard_states):
+            state.update(with_prefix(f"shards.{number}", shard_state))
+        return state
+
+    def copy_state(self) -> Dict[str, Any]:
+        if self.servers:
+            return self._get_state()  # already copied out of the servers
+        return super().copy_state()
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.close()
+        self.indexes = [
+            self.shard_class.from_state(
+                self.shard_class.__name__, strip_prefix(f"shards.{number}", state)
+            )
+            for number in range(len(self.indexes))
+        ]
+        if self.executor == "processes":
+            # the servers inherit the loaded shards, memory maps included
+            self.servers = [ShardServer(index, None) for index in self.indexes]
+
+
+def _call(index: BaseIndex, call: Optional[Tuple[str, tuple, Dict[str, Any]]]) -> Any:
+    if call is None:
+        return None
+    method, args, kwargs = call
+    return getattr(index, method)(*args, **kwargs)
+
+
+def _reset_pool():
+    global _thread_pool
+    _thread_pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def _pool() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by the indexes searched with the "threads" executor.
+    """
+    global _thread_pool
+    with _thread_pool_guard:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(os.cpu_count() or 1)
+        return _thread_pool
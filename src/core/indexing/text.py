@@ -0,0 +1,374 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = float(os.environ.get("VECTOR_DB_BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("VECTOR_DB_BM25_B", "0.75"))
+# Removed chunks whose postings are kept before the index is compacted
+COMPACT_MIN_DEAD = 1024
+
+FUSIONS = ("rrf", "weighted")
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased runs of letters and digits, so "SKU-4471b" gives "sku", "4471b".
+    """
+    return _TOKEN.findall(text.lower())
+
+
+def _narrow(values: np.ndarray) -> np.ndarray:
+    """
+    The non-negative values in the narrowest unsigned integer type holding them.
+    """
+    top = int(values.max()) if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
+
+
+class PostingList:
+    """
+    Rows of the chunks holding a term, with the term's frequency in each.
+
+    Rows are ascending and stored as gaps to the previous row, and gaps and
+    frequencies each in the narrowest integer type that fits them: one byte
+    per posting for most terms. Appended postings are buffered and encoded
+    on the next read.
+    """
+
+    __slots__ = ("gaps", "tfs", "tail", "pending", "max_tf", "min_length")
+
+    def __init__(self):
+        self.gaps = np.zeros(0, dtype=np.uint8)
+        self.tfs = np.zeros(0, dtype=np.uint8)
+        self.tail = 0  # Last encoded row
+        self.pending: List[Tuple[int, int]] = []  # (row, tf) not yet encoded
+        # for the term's score bound; removals leave them loose, never wrong
+        self.max_tf = 0
+        self.min_length = math.inf
+
+    def __len__(self) -> int:
+        return len(self.gaps) + len(self.pending)
+
+    def append(self, row: int, tf: int, length: int):
+        """
+        Add a posting. Rows must be appended in ascending order.
+        """
+        self.pending.append((row, tf))
+        self.max_tf = max(self.max_tf, tf)
+        self.min_length = min(self.min_length, length)
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows and term frequencies as int64 and float64 arrays.
+        """
+        self.flush()
+        return np.cumsum(self.gaps, dtype=np.int64), self.tfs.astype(np.float64)
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows, tfs = zip(*self.pending)
+        gaps = np.diff(np.array(rows, dtype=np.int64), prepend=self.tail)
+        self.gaps = _narrow(np.concatenate([self.gaps.astype(np.int64), gaps]))
+        self.tfs = _narrow(np.concatenate([self.tfs.astype(np.int64), tfs]))
+        self.tail = rows[-1]
+        self.pending = []
+
+
+class TextIndex:
+    """
+    Inverted index over the text of a library's chunks, ranked with BM25.
+
+    Every chunk gets a new row when it is added, so posting lists only ever
+    grow at the end. Removed chunks are marked dead and skipped; once dead
+    rows outnumber live ones the index is compacted, renumbering the rows.
+
+    Top-k search uses MaxScore: query terms are scored in order of their
+    upper bound score, and every chunk containing one is a candidate. Once
+    the bounds of the terms left add up to less than the k-th best score so
+    far, no further chunk can enter the top k, so the remaining (common,
+    low-scoring) terms are only looked up for the surviving candidates by
+    binary search instead of being scanned.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[Optional[str]] = []  # Row -> chunk id, None for dead rows
+        self.rows: Dict[str, int] = {}  # Chunk id -> row
+        self.lengths = np.zeros(0, dtype=np.int64)  # Tokens per row, 0 if dead
+        self.total_length = 0
+        self.postings: Dict[str, PostingList] = {}
+        self.df: Dict[str, int] = {}  # Live chunks per term
+        self.row_terms: Dict[int, List[str]] = {}  # For removal
+        self._flush_lock = threading.Lock()  # searches encode pending postings
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, chunk_id: str, text: str):
+        """
+        Index a chunk's text, replacing any previous entry for it.
+        """
+        self.remove(chunk_id)
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        counts = Counter(tokens)
+
+        row = len(self.ids)
+        self.ids.append(chunk_id)
+        self.rows[chunk_id] = row
+        if row == len(self.lengths):
+            self.lengths = np.resize(self.lengths, max(16, 2 * row))
+        self.lengths[row] = len(tokens)
+        self.total_length += len(tokens)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, PostingList()).append(row, tf, len(tokens))
+            self.df[term] = self.df.get(term, 0) + 1
+        self.row_terms[row] = list(counts)
+
+    def remove(self, chunk_id: str):
+        """
+        Drop a chunk from the index.
+        """
+        row = self.rows.pop(chunk_id, None)
+        if row is None:
+            return
+        for term in self.row_terms.pop(row):
+            self.df[term] -= 1
+            if not self.df[term]:
+                del self.df[term]
+                del self.postings[term]
+        self.total_length -= int(self.lengths[row])
+        self.lengths[row] = 0
+        self.ids[row] = None
+        dead = len(self.ids) - len(self.rows)
+        if dead >= COMPACT_MIN_DEAD and dead > len(self.rows):
+            self.compact()
+
+    def compact(self):
+        """
+        Drop the postings of removed chunks and renumber the live rows.
+        """
+        alive = np.zeros(len(self.ids), dtype=bool)
+        alive[list(self.rows.values())] = True
+        renumber = np.cumsum(alive) - 1
+        postings: Dict[str, PostingList] = {}
+        for term, posting_list in self.postings.items():
+            rows, tfs = posting_list.decode()
+            keep = alive[rows]
+            rows, tfs = rows[keep], tfs[keep]
+            compacted = postings[term] = PostingList()
+            compacted.gaps = _narrow(np.diff(renumber[rows], prepend=0))
+            compacted.tfs = _narrow(tfs.astype(np.int64))
+            compacted.tail = int(renumber[rows[-1]])
+            compacted.max_tf = int(tfs.max())
+            compacted.min_length = int(self.lengths[rows].min())
+        self.postings = postings
+        self.ids = [id for id in self.ids if id is not None]
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+        self.lengths = self.lengths[: len(alive)][alive].copy()
+        self.row_terms = {
+            int(renumber[row]): terms for row, terms in self.row_terms.items()
+        }
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Rows, lengths and every term's postings concatenated into flat arrays,
+        for a library image. Shares nothing with the index, so it may change
+        once this returns.
+        """
+        with self._flush_lock:
+            for posting_list in self.postings.values():
+                posting_list.flush()
+        terms = list(self.postings)
+        lists = [self.postings[term] for term in terms]
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(posting_list) for posting_list in lists], out=offsets[1:])
+        empty = [np.zeros(0, dtype=np.int64)]
+        return {
+            "config": {
+                "k1": self.k1,
+                "b": self.b,
+                "size": len(self.ids),
+                "total_length": self.total_length,
+            },
+            "ids": list(self.rows),
+            "rows": np.fromiter(self.rows.values(), np.int64, len(self.rows)),
+            "lengths": self.lengths[: len(self.ids)].copy(),
+            "terms": terms,
+            "df": np.array([self.df[term] for term in terms], dtype=np.int64),
+            "tails": np.array([p.tail for p in lists], dtype=np.int64),
+            "max_tfs": np.array([p.max_tf for p in lists], dtype=np.int64),
+            "min_lengths": np.array([p.min_length for p in lists], dtype=np.int64),
+            "offsets": offsets,
+            "gaps": _narrow(np.concatenate([p.gaps for p in lists] + empty)),
+            "tfs": _narrow(np.concatenate([p.tfs for p in lists] + empty)),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "TextIndex":
+        """
+        Restore an index from `get_state` for searching only: the posting
+        lists are views of the (memory-mapped) arrays, and chunks cannot be
+        added or removed.
+        """
+        config = state["config"]
+        index = cls(config["k1"], config["b"])
+        index.ids = [None] * config["size"]
+        for id, row in zip(state["ids"], state["rows"].tolist()):
+            index.ids[row] = id
+            index.rows[id] = row
+        index.lengths = state["lengths"]
+        index.total_length = config["total_length"]
+        offsets = state["offsets"].tolist()
+        for term, df, tail, max_tf, min_length, start, end in zip(
+            state["terms"],
+            state["df"].tolist(),
+            state["tails"].tolist(),
+            state["max_tfs"].tolist(),
+            state["min_lengths"].tolist(),
+            offsets[:-1],
+            offsets[1:],
+        ):
+            posting_list = index.postings[term] = PostingList()
+            posting_list.gaps = state["gaps"][start:end]
+            posting_list.tfs = state["tfs"][start:end]
+            posting_list.tail = tail
+            posting_list.max_tf = max_tf
+            posting_list.min_length = min_length
+            index.df[term] = df
+        return index
+
+    def search(
+        self, query: str, k: int, allowed: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        The k chunks with the highest BM25 score for the query, as (id, score)
+        pairs, best first. With `allowed`, only chunks with those ids.
+        """
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.df]
+        if not terms or k <= 0 or not self.rows:
+            return []
+        live = len(self.rows)
+        average_length = self.total_length / live
+        mask = self.lengths[: len(self.ids)] > 0
+        if allowed is not None:
+            allowed_mask = np.zeros(len(self.ids), dtype=bool)
+            allowed_mask[[self.rows[id] for id in allowed if id in self.rows]] = True
+            mask &= allowed_mask
+        norms = self.k1 * (
+            1 - self.b + self.b * self.lengths[: len(self.ids)] / average_length
+        )
+
+        scored = []  # (bound, idf, posting list)
+        with self._flush_lock:
+            for term in terms:
+                posting_list = self.postings[term]
+                posting_list.flush()
+                df = self.df[term]
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                tf = posting_list.max_tf
+                shortest = self.k1 * (
+                    1 - self.b + self.b * posting_list.min_length / average_length
+                )
+                bound = idf * tf * (self.k1 + 1) / (tf + shortest)
+                scored.append((bound, idf, posting_list))
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+
+        scores = np.zeros(len(self.ids))
+        candidates = np.zeros(len(self.ids), dtype=bool)
+        # bound of the terms from each position on, summed exactly from the end
+        remaining = np.cumsum([bound for bound, _, _ in scored][::-1])[::-1]
+        remaining = [*remaining.tolist(), 0.0]
+        threshold = 0.0
+        for position, (_, idf, posting_list) in enumerate(scored):
+            rows, tfs = posting_list.decode()
+            if remaining[position] >= threshold:
+                # essential term: any chunk holding it may still reach the top k
+                keep = mask[rows]
+                rows, tfs = rows[keep], tfs[keep]
+                candidates[rows] = True
+            else:
+                # only chunks already scored can still reach the top k
+                rows_of = np.flatnonzero(candidates)
+                positions = np.searchsorted(rows, rows_of)
+                found = positions < len(rows)
+                found[found] = rows[positions[found]] == rows_of[found]
+                rows, tfs = rows_of[found], tfs[positions[found]]
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norms[rows])
+
+            # partial scores only grow, so the k-th best is a lower bound
+            current = scores[candidates]
+            if len(current) >= k:
+                threshold = float(np.partition(current, -k)[-k])
+                candidates &= scores + remaining[position + 1] >= threshold
+
+        rows = np.flatnonzero(candidates)
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in rows.tolist()]
+
+
+def fuse_results(
+    vector_results: List[Tuple[str, float]],
+    text_results: List[Tuple[str, float]],
+    k: int,
+    fusion: str = "rrf",
+    alpha: float = 0.5,
+    rrf_k: int = 60,
+) -> List[Tuple[str, float, Optional[int], Optional[int]]]:
+    """
+    Merge nearest neighbors (id, distance) and text matches (id, BM25 score)
+    into one ranking of (id, score, vector rank, text rank), best first.
+    Ranks start at 1 and are None where a list lacks the chunk. `alpha` is
+    the weight of the vector results.
+
+    "rrf" (reciprocal rank fusion) scores a chunk by its ranks alone, as
+    alpha / (rrf_k + vector rank) + (1 - alpha) / (rrf_k + text rank).
+    "weighted" min-max normalizes distances and BM25 scores to [0, 1]
+    (closest and best score 1) and adds them up weighted the same way.
+    """
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSIONS}")
+    vector_ranks = {id: rank for rank, (id, _) in enumerate(vector_results, 1)}
+    text_ranks = {id: rank for rank, (id, _) in enumerate(text_results, 1)}
+    if fusion == "rrf":
+        vector_scores = {id: 1 / (rrf_k + rank) for id, rank in vector_ranks.items()}
+        text_scores = {id: 1 / (rrf_k + rank) for id, rank in text_ranks.items()}
+    else:
+        vector_scores = _normalize({id: -d for id, d in vector_results})
+        text_scores = _normalize(dict(text_results))
+
+    fused = {
+        id: alpha * vector_scores.get(id, 0.0) + (1 - alpha) * text_scores.get(id, 0.0)
+        for id in {**vector_ranks, **text_ranks}
+    }
+    ranking = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [
+        (id, score, vector_ranks.get(id), text_ranks.get(id)) for id, score in ranking
+    ]
+
+
+def _normalize(scores: Dict[str, float]) -> Dict[str, float]:
+    """
+    Scale scores to [0, 1], higher staying better. Equal scores all get 1.
+    """
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {id: 1.0 for id in scores}
+    return {id: (score - low) / (high - low) for id, score in scores.items()}
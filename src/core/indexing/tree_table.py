@@ -0,0 +1,224 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+# Worker processes used for large tree builds, defaults to the number of cores
+BUILD_PROCESSES = int(os.environ.get("VECTOR_DB_BUILD_PROCESSES", os.cpu_count() or 1))
+# Smaller trees are built in-process, shipping them to workers costs more than it saves
+PARALLEL_BUILD_MIN_POINTS = 20000
+
+# split(vectors, depth) -> (permutation of the vectors, split position, node columns);
+# called for leaves too, which only keep the columns
+SplitFunction = Callable[[np.ndarray, int], Tuple[np.ndarray, int, Dict[str, Any]]]
+
+# (start, end, depth, parent node, 0 for a left / 1 for a right child)
+PendingRange = Tuple[int, int, int, int, int]
+
+# Called with the fraction of the points already in a finished leaf
+ProgressFunction = Callable[[float], None]
+
+_NODE_FIELDS = ("order", "start", "mid", "end", "left", "right")
+
+_executors: Dict[int, ProcessPoolExecutor] = {}  # Pools by number of processes
+_executors_lock = threading.Lock()
+if hasattr(os, "register_at_fork"):
+    # a forked child (e.g. a shard server) cannot use its parent's pools
+    os.register_at_fork(after_in_child=_executors.clear)
+
+
+class NodeTable:
+    """
+    A binary space-partitioning tree stored as flat arrays instead of node objects.
+
+    `order` lists the rows of the vectors the tree was built from in tree
+    order. Node i covers the points order[start[i]:end[i]]. Internal nodes
+    split them at position mid[i] into their children, which cover
+    [start, mid) and [mid, end); left / right hold the child node numbers.
+    Leaves (left == right == -1) keep their points as one bucket of at most
+    the build's leaf size. Per-node values of a particular tree (split axis,
+    ball centroid, ...) live in `columns`, one array each. Node 0 is the root.
+    """
+
+    def __init__(
+        self,
+        order: np.ndarray,
+        start: np.ndarray,
+        mid: np.ndarray,
+        end: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        columns: Dict[str, np.ndarray],
+    ):
+        self.order = order
+        self.start = start
+        self.mid = mid
+        self.end = end
+        self.left = left
+        self.right = right
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "NodeTable":
+        columns = {name: state[f"columns.{name}"] for name in state["columns"]}
+        return cls(*(state[name] for name in _NODE_FIELDS), columns)
+
+    def get_state(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = {name: getattr(self, name) for name in _NODE_FIELDS}
+        state["columns"] = list(self.columns)
+        for name, values in self.columns.items():
+            state[f"columns.{name}"] = values
+        return state
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.order, self.start, self.mid, self.end, self.left, self.right]
+        return sum(array.nbytes for array in arrays + list(self.columns.values()))
+
+
+def build_node_table(
+    vectors: np.ndarray,
+    split: SplitFunction,
+    processes: Optional[int] = None,
+    leaf_size: int = 1,
+    progress: Optional[ProgressFunction] = None,
+) -> NodeTable:
+    """
+    Build a tree over the vectors by applying `split` recursively until at
+    most `leaf_size` points are left in a node, reporting to `progress`.
+
+    Large builds split the top levels here and build the independent subtrees in
+    worker processes, which send back their NodeTables (plain arrays, cheap to
+    pickle) to be stitched under the top levels. `split` must be a module-level
+    function so that it can be sent to the workers.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    processes = BUILD_PROCESSES if processes is None else processes
+    if processes <= 1 or len(vectors) < PARALLEL_BUILD_MIN_POINTS:
+        return _build(vectors, split, leaf_size, progress=progress)[0]
+
+    # About two subtrees per process keeps the workers busy despite uneven sizes
+    top, pending = _build(vectors, split, leaf_size, max_pending=2 * processes)
+    futures = [
+        _get_executor(processes).submit(
+            _build_subtree, vectors[top.order[start:end]], split, leaf_size, depth
+        )
+        for start, end, depth, _, _ in pending
+    ]
+
+    parts = [top]
+    offset = len(top)
+    done = len(vectors) - sum(end - start for start, end, _, _, _ in pending)
+    try:
+        for (start, end, _, _, _), future in zip(pending, futures):
+            future.result()
+            done += end - start
+            if progress is not None:
+                progress(done / len(vectors))
+    except BaseException:
+        # e.g. a cancelled build: leave the workers to other builds
+        for future in futures:
+            future.cancel()
+        raise
+    for (start, end, _, parent, side), future in zip(pending, futures):
+        subtree = future.result()
+        # map the subtree's local rows, positions and node numbers to global ones
+        top.order[start:end] = top.order[start:end][subtree.order]
+        for name in ("start", "mid", "end"):
+            getattr(subtree, name)[:] += start
+        for name in ("left", "right"):
+            links = getattr(subtree, name)
+            links[links >= 0] += offset
+        (top.left if side == 0 else top.right)[parent] = offset
+        parts.append(subtree)
+        offset += len(subtree)
+
+    return NodeTable(
+        top.order,
+        *(
+            np.concatenate([getattr(part, name) for part in parts])
+            for name in ("start", "mid", "end", "left", "right")
+        ),
+        {
+            name: np.concatenate([part.columns[name] for part in parts])
+            for name in top.columns
+        },
+    )
+
+
+def _build(
+    vectors: np.ndarray,
+    split: SplitFunction,
+    leaf_size: int,
+    depth: int = 0,
+    max_pending: Optional[int] = None,
+    progress: Optional[ProgressFunction] = None,
+) -> Tuple[NodeTable, List[PendingRange]]:
+    """
+    Build the tree breadth-first. With `max_pending`, stop once that many
+    ranges are waiting to be split and return them unbuilt.
+    """
+    done = 0  # Points in finished leaves
+    order = np.arange(len(vectors), dtype=np.int64)
+    nodes: Dict[str, list] = {
+        name: [] for name in ("start", "mid", "end", "left", "right")
+    }
+    columns: Dict[str, list] = {}
+    queue = deque([(0, len(vectors), depth, -1, 0)] if len(vectors) else [])
+    while queue and (max_pending is None or len(queue) < max_pending):
+        start, end, depth, parent, side = queue.popleft()
+        node = len(nodes["start"])
+        permutation, mid, values = split(vectors[order[start:end]], depth)
+        leaf = end - start <= leaf_size
+        if leaf:
+            mid = end
+            done += end - start
+            if progress is not None:
+                progress(done / len(vectors))
+        else:
+            order[start:end] = order[start:end][permutation]
+            mid += start
+
+        for name, value in (("start", start), ("mid", mid), ("end", end)):
+            nodes[name].append(value)
+        nodes["left"].append(-1)
+        nodes["right"].append(-1)
+        if parent >= 0:
+            nodes["left" if side == 0 else "right"][parent] = node
+        for name, value in values.items():
+            columns.setdefault(name, []).append(value)
+
+        if not leaf:
+            queue.append((start, mid, depth + 1, node, 0))
+            queue.append((mid, end, depth + 1, node, 1))
+
+    table = NodeTable(
+        order,
+        *(np.array(nodes[name], dtype=np.int64) for name in nodes),
+        {name: np.asarray(values) for name, values in columns.items()},
+    )
+    return table, list(queue)
+
+
+def _build_subtree(
+    vectors: np.ndarray, split: SplitFunction, leaf_size: int, depth: int
+) -> NodeTable:
+    """
+    Worker process entry point: build a whole subtree.
+    """
+    return _build(vectors, split, leaf_size, depth)[0]
+
+
+def _get_executor(processes: int) -> ProcessPoolExecutor:
+    """
+    A shared pool of build processes, started on first use
+    """
+    with _executors_lock:
+        if processes not in _executors:
+            _executors[processes] = ProcessPoolExecutor(max_workers=processes)
+        return _executors[processes]
@@ -0,0 +1,376 @@
+import sys
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.core.indexing.chunk_matrix import ChunkMatrix, MatrixItems
+from src.core.indexing.metrics import prepare, scores, to_distance
+
+# Embeddings converted at a time by `from_items`, which reports progress per block
+FROM_ITEMS_BLOCK = 65536
+
+
+class VectorStore:
+    """
+    Contiguous float32 storage for (id, embedding) pairs with cached squared norms.
+    Embeddings are prepared for the metric (see metrics.py) as they are added;
+    vectors passed to the constructor must already be prepared.
+    """
+
+    def __init__(
+        self,
+        ids: List[str] = None,
+        vectors: np.ndarray = None,
+        sq_norms: np.ndarray = None,
+        metric: str = "l2",
+    ):
+        self.metric = metric
+        self._reset(ids, vectors, sq_norms)
+
+    def _reset(self, ids: List[str], vectors: np.ndarray, sq_norms: np.ndarray = None):
+        self.ids: List[str] = list(ids) if ids is not None else []
+        if vectors is None:
+            vectors = np.empty((len(self.ids), 0), dtype=np.float32)
+        # rows beyond len(self.ids) are spare capacity for appends
+        self._vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if sq_norms is None:
+            sq_norms = np.einsum("ij,ij->i", self._vectors, self._vectors)
+        self._sq_norms = sq_norms
+        self.rows: Dict[str, int] = {id: row for row, id in enumerate(self.ids)}
+
+    @classmethod
+    def from_items(
+        cls,
+        data: List[Tuple[str, list]],
+        metric: str = "l2",
+        progress: Optional[Callable[[float], None]] = None,
+    ) -> "VectorStore":
+        """
+        Build a store from a list of (id, embedding) tuples, calling `progress`
+        with the fraction converted so far.
+        """
+        if not data:
+            return cls(metric=metric)
+        ids = [id for id, _ in data]
+        vectors = np.empty((len(data), len(data[0][1])), dtype=np.float32)
+        for start in range(0, len(data), FROM_ITEMS_BLOCK):
+            block = data[start : start + FROM_ITEMS_BLOCK]
+            vectors[start : start + len(block)] = prepare(
+                [embedding for _, embedding in block], metric
+            )
+            if progress is not None:
+                progress((start + len(block)) / len(data))
+        return cls(ids, vectors, metric=metric)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], metric: str = "l2") -> "VectorStore":
+        """
+        Restore a store from `get_state`, keeping (memory-mapped) arrays as they are.
+        """
+        return cls(state["ids"], state["vectors"], state["sq_norms"], metric)
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Ids, vectors and squared norms, for saving.
+        """
+        return {"ids": self.ids, "vectors": self.vectors, "sq_norms": self.sq_norms}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: len(self.ids)]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        return self._sq_norms[: len(self.ids)]
+
+    @property
+    def dim(self) -> int:
+        return self._vectors.shape[1]
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the vector matrix (including spare capacity), norms and ids.
+        """
+        return (
+            self._vectors.nbytes
+            + self._sq_norms.nbytes
+            + sum(sys.getsizeof(id) for id in self.ids)
+        )
+
+    def append(self, data: List[Tuple[str, list]]):
+        """
+        Append (id, embedding) tuples, growing the matrix geometrically so
+        repeated appends cost amortized O(1) copies per vector.
+        """
+        if not data:
+            return
+        vectors = prepare([embedding for _, embedding in data], self.metric)
+        if len(self) == 0:
+            self._reset([id for id, _ in data], vectors)
+            return
+
+        size, new_size = len(self), len(self) + len(vectors)
+        if new_size > len(self._vectors):
+            capacity = max(new_size, 2 * len(self._vectors))
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:size] = self.vectors
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown_norms[:size] = self.sq_norms
+            self._vectors, self._sq_norms = grown, grown_norms
+
+        self._vectors[size:new_size] = vectors
+        self._sq_norms[size:new_size] = np.einsum("ij,ij->i", vectors, vectors)
+        for id, _ in data:
+            self.rows[id] = len(self.ids)
+            self.ids.append(id)
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        Delete vectors by id and compact the matrix. Returns the number removed.
+        """
+        doomed = {self.rows[id] for id in ids if id in self.rows}
+        if not doomed:
+            return 0
+        keep = np.ones(len(self), dtype=bool)
+        keep[list(doomed)] = False
+        self._reset(
+            [id for row, id in enumerate(self.ids) if keep[row]], self.vectors[keep]
+        )
+        return len(doomed)
+
+    def row_mask(self, ids: Set[str]) -> np.ndarray:
+        """
+        Boolean mask over the rows whose id is in `ids`.
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[[self.rows[id] for id in ids if id in self.rows]] = True
+        return mask
+
+    def top_k(
+        self, query_embedding: list, k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the row positions and distances of the k nearest vectors,
+        only considering the rows set in `mask` if given.
+        """
+        if mask is not None:
+            k = min(k, int(np.count_nonzero(mask)))
+        if len(self) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = prepare(query_embedding, self.metric)
+        distances = self._scores(query[None, :])[0]
+        if mask is not None:
+            distances[~mask] = np.inf
+        rows = top_k_smallest(distances, k)
+        return rows, to_distance(distances[rows], self.metric)
+
+    def top_k_batch(
+        self,
+        queries: List[list],
+        k: int,
+        block_size: int = 4096,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched top-k: one matrix-matrix product per block of queries.
+        Returns (rows, distances) arrays of shape (len(queries), min(k, len(self))),
+        only considering the rows set in `mask` if given.
+        """
+        k = min(k, len(self) if mask is None else int(np.count_nonzero(mask)))
+        if len(queries) == 0 or k <= 0:
+            empty = (len(queries), 0)
+            return np.empty(empty, dtype=np.int64), np.empty(empty, dtype=np.float32)
+        queries = prepare(queries, self.metric)
+
+        # bound the (queries x vectors) distance matrix to roughly 16M floats
+        block_size = max(1, min(block_size, (1 << 24) // len(self.vectors)))
+        all_rows = np.empty((len(queries), k), dtype=np.int64)
+        all_distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), block_size):
+            block = queries[start : start + block_size]
+            distances = self._scores(block)
+            if mask is not None:
+                distances[:, ~mask] = np.inf
+            rows = top_k_smallest_rows(distances, k)
+            all_rows[start : start + len(block)] = rows
+            all_distances[start : start + len(block)] = to_distance(
+                np.take_along_axis(distances, rows, axis=1), self.metric
+            )
+        return all_rows, all_distances
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Ranking scores between prepared queries and every row (see metrics.py).
+        """
+        return scores(queries, self.vectors, self.sq_norms, self.metric)
+
+
+class MatrixStore(VectorStore):
+    """
+    A VectorStore over rows of a library's ChunkMatrix, which it shares
+    instead of copying: it only keeps which rows it holds. Rows are the
+    matrix's own row numbers, and rows it does not hold are skipped by every
+    search. For cosine the raw rows are scored against normalized queries
+    with their norms, since the matrix holds them unnormalized.
+    """
+
+    def __init__(
+        self,
+        matrix: ChunkMatrix,
+        ids: List[str],
+        rows: List[int],
+        metric: str = "l2",
+    ):
+        self.metric = metric
+        self.matrix = matrix
+        self.ids = matrix.ids  # row -> id, shared; only appended to
+        self.rows = dict(zip(ids, rows))
+        self._extent = max(rows) + 1 if rows else 0  # rows past it are not held
+        self._held = np.zeros(self._extent, dtype=bool)
+        self._held[rows] = True
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Ids and gathered vectors, in VectorStore's layout, for saving.
+        """
+        return self.copy().get_state()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.matrix.vectors[: self._extent]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        return self.matrix.sq_norms[: self._extent]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.dim
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the row mask and id table; the shared matrix is the
+        library's.
+        """
+        return self._held.nbytes + sys.getsizeof(self.rows)
+
+    def holds_rows_of(self, items: List[Tuple[str, list]]) -> bool:
+        """
+        Whether `items` are rows of the shared matrix, so they can be appended.
+        """
+        if not items:
+            return True
+        return isinstance(items, MatrixItems) and items.matrix is self.matrix
+
+    def append(self, data: List[Tuple[str, list]]):
+        """
+        Hold the rows of (id, embedding) tuples given as MatrixItems of the
+        shared matrix.
+        """
+        if not data:
+            return
+        rows = np.asarray(data.rows, dtype=np.int64)
+        extent = int(rows.max()) + 1
+        if extent > len(self._held):
+            held = np.zeros(max(extent, 2 * len(self._held)), dtype=bool)
+            held[: len(self._held)] = self._held
+            self._held = held
+        self._extent = max(self._extent, extent)
+        self._held[rows] = True
+        self.rows.update(zip((id for id, _ in data), rows.tolist()))
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        Stop holding rows by id. Returns the number removed.
+        """
+        rows = [self.rows.pop(id) for id in ids if id in self.rows]
+        self._held[rows] = False
+        return len(rows)
+
+    def moved_to(self, matrix: ChunkMatrix) -> VectorStore:
+        """
+        The same chunks over the rows their ids have in another matrix of the
+        library, e.g. after a compaction. That requires every held chunk to
+        still be in the library unchanged; otherwise, or if one is missing,
+        a copy of the vectors is returned instead.
+        """
+        if matrix is self.matrix:
+            return self
+        ids = list(self.rows)
+        rows = [matrix.rows.get(id) for id in ids]
+        if None in rows:
+            return self.copy()
+        return MatrixStore(matrix, ids, rows, self.metric)
+
+    def copy(self) -> VectorStore:
+        """
+        A VectorStore with its own copy of the held vectors.
+        """
+        ids = list(self.rows)
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(ids))
+        vectors = prepare(self.matrix.vectors[rows], self.metric)
+        return VectorStore(ids, vectors, metric=self.metric)
+
+    def row_mask(self, ids: Set[str]) -> np.ndarray:
+        mask = np.zeros(self._extent, dtype=bool)
+        mask[[self.rows[id] for id in ids if id in self.rows]] = True
+        return mask
+
+    def top_k(
+        self, query_embedding: list, k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return super().top_k(query_embedding, k, self._only_held(mask))
+
+    def top_k_batch(
+        self,
+        queries: List[list],
+        k: int,
+        block_size: int = 4096,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return super().top_k_batch(queries, k, block_size, self._only_held(mask))
+
+    def _only_held(self, mask: Optional[np.ndarray]) -> np.ndarray:
+        held = self._held[: self._extent]
+        return held if mask is None else mask & held
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.metric != "cosine":
+            return super()._scores(queries)
+        # ||q - v / |v| ||^2 = |q|^2 + 1 - 2 <q, v> / |v|, and |q|^2 for v = 0
+        norms = np.sqrt(self.sq_norms)
+        products = queries @ self.vectors.T
+        products *= -2.0 / np.maximum(norms, np.float32(1e-12))
+        products += (norms > 0)[None, :]
+        products += np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(products, 0.0, out=products)
+
+
+def top_k_smallest(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k smallest values in ascending order, using a partial sort.
+    """
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(values):
+        candidates = np.argpartition(values, k - 1)[:k]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(values[candidates], kind="stable")]
+
+
+def top_k_smallest_rows(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    Row-wise top_k_smallest for a 2-D array of values.
+    """
+    if k < values.shape[1]:
+        candidates = np.argpartition(values, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    order = np.argsort(np.take_along_axis(values, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
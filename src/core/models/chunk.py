@@ -1,9 +1,56 @@
-from pydantic import BaseModel, Field
-from typing import Dict, Any
+from pydantic import BaseModel, Field, PlainSerializer, PlainValidator, WithJsonSchema
+from typing import Annotated, Any, Dict, List
+import numpy as np
+
+
+def _to_embedding(value: Any) -> np.ndarray:
+    """
+    Store an embedding as a read-only float32 array: 4 bytes per dimension
+    instead of a list of boxed Python floats (8 bytes of pointer plus a
+    24 byte float object each). Arrays that already are stored as is.
+    """
+    if (
+        isinstance(value, np.ndarray)
+        and value.dtype == np.float32
+        and not value.flags.writeable
+    ):
+        return value
+    if isinstance(value, (str, bytes, dict)):
+        raise ValueError("embedding must be a list of numbers")
+    embedding = np.array(value, dtype=np.float32)
+    if embedding.ndim != 1:
+        raise ValueError("embedding must be a flat list of numbers")
+    embedding.setflags(write=False)
+    return embedding
+
+
+# A vector embedding; accepted and serialized as a list of floats
+Embedding = Annotated[
+    np.ndarray,
+    PlainValidator(_to_embedding),
+    PlainSerializer(lambda embedding: embedding.tolist(), return_type=List[float]),
+    WithJsonSchema({"type": "array", "items": {"type": "number"}}),
+]
 
 
 class Chunk(BaseModel):
     id: str = Field(..., discrption="Unique identifier of the chunk")
     text: str = Field(..., description="Text content of the chunk")
-    embedding: list[float] = Field(..., description="The Vector Embedding of the chunk")
+    embedding: Embedding = Field(
+        ..., description="The Vector Embedding of the chunk, stored as float32"
+    )
     metadata: Dict[str, Any] = Field({}, description="Additional metadata of the chunk")
+
+    def __eq__(self, other: Any) -> bool:
+        """
+        Field by field, comparing embeddings by value: the default comparison
+        raises on arrays, and so would that of documents and libraries.
+        """
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return (
+            self.id == other.id
+            and self.text == other.text
+            and self.metadata == other.metadata
+            and np.array_equal(self.embedding, other.embedding)
+        )
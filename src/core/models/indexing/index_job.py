@@ -0,0 +1,32 @@
+from enum import Enum
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class IndexJob(BaseModel):
+    id: str = Field(..., description="Unique identifier of the job")
+    library_id: str = Field(..., description="The library being indexed")
+    algorithm: str = Field(..., description="The indexing algorithm")
+    params: Dict[str, Any] = Field({}, description="Parameters of the algorithm")
+    status: JobStatus = Field(JobStatus.QUEUED, description="Current job status")
+    progress: float = Field(0.0, description="Completed fraction of the build (0-1)")
+    error: Optional[str] = Field(None, description="Why the build failed")
+    created_at: float = Field(..., description="Submission time (Unix seconds)")
+    started_at: Optional[float] = Field(None, description="Build start time")
+    finished_at: Optional[float] = Field(None, description="Build end time")
+    duration: Optional[float] = Field(None, description="Build duration in seconds")
+    memory_bytes: Optional[int] = Field(
+        None, description="Approximate size of the built index"
+    )
+
+    @property
+    def done(self) -> bool:
+        return self.status not in (JobStatus.QUEUED, JobStatus.RUNNING)
@@ -1,40 +1,36 @@
-from typing import List, Optional
+from typing import Optional
 from src.core.models.chunk import Chunk
+from src.core.services.library_service import LibraryService
 
 
 class ChunkService:
     def __init__(self):
-        self.chunks: List[Chunk] = []
+        # chunks live in the LibraryService indexes so that lookups and
+        # back-references stay consistent with their documents
+        self.library_service = LibraryService()
 
-    def create_chunk(self, chunk: Chunk) -> Chunk:
+    def create_chunk(
+        self, chunk: Chunk, document_id: Optional[str] = None
+    ) -> Optional[Chunk]:
         """
-        Create a new Chunk
+        Create a new Chunk, optionally inside a document
         """
-        self.chunks.append(chunk)
-        return chunk
+        return self.library_service.add_chunk(chunk, document_id)
 
     def get_chunk(self, chunk_id: str) -> Optional[Chunk]:
         """
         Get a Chunk by ID
         """
-        return next((chk for chk in self.chunks if chk.id == chunk_id), None)
+        return self.library_service.get_chunk(chunk_id)
 
     def update_chunk(self, chunk_id: str, updated_chunk: Chunk) -> Optional[Chunk]:
         """
         Update a chunk by it's ID
         """
-        for i, chk in enumerate(self.chunks):
-            if chk.id == chunk_id:
-                self.chunks[i] = updated_chunk
-                return updated_chunk
-        return None
+        return self.library_service.update_chunk(chunk_id, updated_chunk)
 
-    def delete_chunk(self, chunk_id: str) -> bool:
+    def delete_chunk(self, chunk_id: str) -> Optional[Chunk]:
         """
         Delete a chunk by it's ID
         """
-        for i, chk in enumerate(self.chunks):
-            if chk.id == chunk_id:
-                del self.chunks[i]
-                return True
-        return False
+        return self.library_service.remove_chunk(chunk_id)
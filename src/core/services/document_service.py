@@ -1,23 +1,28 @@
 from typing import List, Optional
+from src.core.models.chunk import Chunk
 from src.core.models.document import Document
+from src.core.services.library_service import LibraryService
 
 
 class DocumentService:
     def __init__(self):
-        self.documents: List[Document] = []
+        # documents live in the LibraryService indexes so that lookups and
+        # back-references stay consistent with their libraries
+        self.library_service = LibraryService()
 
-    def create_document(self, document: Document) -> Document:
+    def create_document(
+        self, document: Document, library_id: Optional[str] = None
+    ) -> Optional[Document]:
         """
-        Create a new Document
+        Create a new Document, optionally inside a library
         """
-        self.documents.append(document)
-        return document
+        return self.library_service.add_document(document, library_id)
 
     def get_document(self, document_id: str) -> Optional[Document]:
         """
         Get a Document by ID
         """
-        return next((doc for doc in self.documents if doc.id == document_id), None)
+        return self.library_service.get_document(document_id)
 
     def update_document(
         self, document_id: str, updated_document: Document
@@ -25,18 +30,26 @@ class DocumentService:
         """
         Update a document by it's ID
         """
-        for i, doc in enumerate(self.documents):
-            if doc.id == document_id:
-                self.documents[i] = updated_document
-                return updated_document
-        return None
+        return self.library_service.update_document(document_id, updated_document)
 
-    def delete_document(self, document_id: str) -> bool:
+    def delete_document(self, document_id: str) -> Optional[Document]:
         """
         Delete a document by it's ID
         """
-        for i, doc in enumerate(self.documents):
-            if doc.id == document_id:
-                del self.documents[i]
-                return True
-        return False
+        return self.library_service.remove_document(document_id)
+
+    def add_chunks(
+        self, document_id: str, chunks: List[Chunk]
+    ) -> Optional[List[Chunk]]:
+        """
+        Append a batch of chunks to a document
+        """
+        return self.library_service.add_chunks(chunks, document_id)
+
+    def list_chunks(
+        self, document_id: str, offset: int = 0, limit: int = 100
+    ) -> Optional[List[Chunk]]:
+        """
+        Page through the chunks of a document
+        """
+        return self.library_service.list_document_chunks(document_id, offset, limit)
@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+from src.core.indexing.base import BaseIndex
+from src.core.models.indexing.index_job import IndexJob, JobStatus
+from src.core.services.library_service import LibraryService
+from src.utils.instrumentation import (
+    BUILD_SECONDS,
+    INDEX_MEMORY_BYTES,
+    get_logger,
+    log_event,
+)
+
+# Number of index builds that may run at the same time
+INDEX_WORKERS = int(os.environ.get("VECTOR_DB_INDEX_WORKERS", "2"))
+# Finished jobs kept around for status queries
+MAX_FINISHED_JOBS = 1000
+
+logger = get_logger("index_jobs")
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a build to abort it once its job has been cancelled.
+    """
+
+
+class IndexJobService:
+    """
+    Runs index builds in a bounded background pool and tracks them as jobs.
+
+    Builds go through `LibraryService.index_library`, so the previous index
+    keeps serving queries until the new one is swapped in. There is at most one
+    pending build per library: submitting the same algorithm and parameters
+    again returns the pending job, anything else cancels it. Builds of the same
+    library run one after another, so the newest job is always swapped in last.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(IndexJobService, cls).__new__(cls, *args, **kwargs)
+            cls._instance.__initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self.__initialized:
+            return
+        self.__initialized = True
+        self.library_service = LibraryService()
+        self.executor = ThreadPoolExecutor(
+            max_workers=INDEX_WORKERS, thread_name_prefix="index-build"
+        )
+        self.jobs: Dict[str, IndexJob] = {}
+        self.futures: Dict[str, Future] = {}
+        self.pending: Dict[str, str] = {}  # library id -> its queued / running job
+        self.cancelled: Set[str] = set()  # Running jobs asked to stop
+        self.build_locks: Dict[str, threading.Lock] = {}  # One build per library
+        self.lock = threading.Lock()
+
+    def submit(
+        self,
+        library_id: str,
+        algorithm: str,
+        index_factory: Callable[..., BaseIndex],
+        params: Dict[str, Any],
+    ) -> IndexJob:
+        """
+        Queue a build of `index_factory(**params)` for a library
+        """
+        with self.lock:
+            pending = self.jobs.get(self.pending.get(library_id))
+            if pending is not None:
+                if pending.algorithm == algorithm and pending.params == params:
+                    return pending
+                self._cancel(pending)
+
+            job = IndexJob(
+                id=uuid.uuid4().hex,
+                library_id=library_id,
+                algorithm=algorithm,
+                params=params,
+                created_at=time.time(),
+            )
+            self.jobs[job.id] = job
+            self.pending[library_id] = job.id
+            self.build_locks.setdefault(library_id, threading.Lock())
+            self.futures[job.id] = self.executor.submit(
+                self._run, job, lambda: index_factory(**params)
+            )
+            self._prune()
+            return job
+
+    def get_job(self, job_id: str) -> Optional[IndexJob]:
+        """
+        Get a Job by ID
+        """
+        return self.jobs.get(job_id)
+
+    def cancel_job(self, job_id: str) -> Optional[IndexJob]:
+        """
+        Cancel a queued or running job. Finished jobs are returned unchanged.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and not job.done:
+                self._cancel(job)
+            return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[IndexJob]:
+        """
+        Block until a job is done (or the timeout expires) and return it
+        """
+        future = self.futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass  # the outcome is recorded on the job
+        return self.jobs.get(job_id)
+
+    def _run(self, job: IndexJob, index_factory: Callable[[], BaseIndex]):
+        with self.build_locks[job.library_id]:
+            with self.lock:
+                if job.id in self.cancelled:
+                    self._finish(job, JobStatus.CANCELLED)
+                    return
+                job.status = JobStatus.RUNNING
+                job.started_at = time.time()
+
+            start = time.perf_counter()
+            index = None
+            try:
+                index = index_factory()
+                index.progress_callback = lambda fraction: self._progress(job, fraction)
+                library = self.library_service.index_library(
+                    job.library_id, index, abort=lambda: self._check_cancelled(job)
+                )
+                if library is None:
+                    raise LookupError(f"Library not found {job.library_id}")
+            except JobCancelled:
+                status = JobStatus.CANCELLED
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                status = JobStatus.FAILED
+            else:
+                job.progress = 1.0
+                job.memory_bytes = index.memory_usage()
+                status = JobStatus.SUCCEEDED
+            finally:
+                if index is not None:
+                    index.progress_callback = None
+                job.duration = time.perf_counter() - start
+
+            if status == JobStatus.SUCCEEDED:
+                BUILD_SECONDS.observe(job.duration, job.algorithm)
+                if job.memory_bytes is not None:
+                    INDEX_MEMORY_BYTES.observe(job.memory_bytes, job.algorithm)
+            log_event(
+                logger,
+                logging.INFO,
+                "Index build finished",
+                job_id=job.id,
+                library_id=job.library_id,
+                algorithm=job.algorithm,
+                status=status.value,
+                seconds=job.duration,
+                memory_bytes=job.memory_bytes,
+                error=job.error,
+            )
+            with self.lock:
+                self._finish(job, status)
+
+    def _progress(self, job: IndexJob, fraction: float):
+        """
+        Progress callback of a running build; aborts it once cancelled.
+        """
+        self._check_cancelled(job)
+        job.progress = min(max(fraction, 0.0), 1.0)
+
+    def _check_cancelled(self, job: IndexJob):
+        """
+        Abort a running build once its job has been cancelled
+        """
+        if job.id in self.cancelled:
+            raise JobCancelled(job.id)
+
+    def _cancel(self, job: IndexJob):
+        """
+        Cancel a job, dropping it from the queue or flagging its build to stop
+        """
+        self.cancelled.add(job.id)
+        if self.futures[job.id].cancel():
+            self._finish(job, JobStatus.CANCELLED)
+        elif self.pending.get(job.library_id) == job.id:
+            del self.pending[job.library_id]
+
+    def _finish(self, job: IndexJob, status: JobStatus):
+        job.status = status
+        job.finished_at = time.time()
+        self.cancelled.discard(job.id)
+        self.futures.pop(job.id, None)
+        if self.pending.get(job.library_id) == job.id:
+            del self.pending[job.library_id]
+
+    def _prune(self):
+        """
+        Forget the oldest finished jobs beyond MAX_FINISHED_JOBS
+        """
+        finished = [id for id, job in self.jobs.items() if job.done]
+        for id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[id]
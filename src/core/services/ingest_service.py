@@ -0,0 +1,146 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from pydantic import ValidationError
+from src.core.models.chunk import Chunk
+from src.core.models.document import Document
+from src.core.services.library_service import DimensionMismatch, LibraryService
+from src.utils.instrumentation import get_logger, log_event
+
+# Chunks appended to a document per batch (one lock, log record and index update)
+INGEST_BATCH_SIZE = 1000
+
+logger = get_logger("ingest")
+
+
+class IngestError(ValueError):
+    """
+    A record of a bulk ingest could not be applied.
+    """
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+class BulkIngest:
+    """
+    One streaming ingest of NDJSON records into a library.
+
+    Each line is either a document, `{"document": {"id": ..., "metadata": ...}}`,
+    which is added to the library (replacing a document with the same id), or a
+    chunk with the id of its document in the library:
+    `{"document_id": ..., "id": ..., "text": ..., "embedding": [...], "metadata": ...}`.
+    Consecutive chunks of a document are appended in batches, so memory stays
+    bounded by the batch size however large the stream is. Records are applied
+    in order; everything before a failing line stays ingested.
+    """
+
+    def __init__(self, library_id: str, batch_size: int = INGEST_BATCH_SIZE):
+        self.library_service = LibraryService()
+        self.library_id = library_id
+        self.batch_size = batch_size
+        self.pending: List[Chunk] = []  # Chunks of pending_document not yet added
+        self.pending_document: Optional[str] = None
+        self.pending_line = 0  # Line of the first pending chunk
+        self.lines = 0
+        self.bytes = 0
+        self.documents = 0
+        self.chunks = 0
+        self.batches = 0
+        self.started = time.monotonic()
+
+    def feed(self, lines: List[bytes]):
+        """
+        Parse and apply the next lines of the stream.
+        """
+        for line in lines:
+            self.lines += 1
+            self.bytes += len(line) + 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                if "document" in record:
+                    self._flush()
+                    self._add_document(Document.model_validate(record["document"]))
+                else:
+                    document_id = record.pop("document_id", None)
+                    if not isinstance(document_id, str):
+                        raise ValueError("chunk records need a document_id")
+                    self._add_chunk(Chunk.model_validate(record), document_id)
+            except IngestError:
+                raise
+            except (ValueError, ValidationError) as e:
+                raise IngestError(self.lines, str(e))
+
+    def finish(self):
+        """
+        Apply the chunks still pending at the end of the stream.
+        """
+        self._flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counts and throughput so far.
+        """
+        seconds = time.monotonic() - self.started
+        return {
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "seconds": seconds,
+            "chunks_per_second": self.chunks / seconds if seconds else 0.0,
+            "megabytes_per_second": self.bytes / seconds / 1e6 if seconds else 0.0,
+        }
+
+    def _add_document(self, document: Document):
+        if not self.library_service.add_document(document, self.library_id):
+            raise IngestError(self.lines, f"Library not found {self.library_id}")
+        self.documents += 1
+        self.chunks += len(document.chunks)
+
+    def _add_chunk(self, chunk: Chunk, document_id: str):
+        if document_id != self.pending_document:
+            self._flush()
+            self.pending_document = document_id
+        if not self.pending:
+            self.pending_line = self.lines
+        self.pending.append(chunk)
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """
+        Append the pending chunks to their document in one batch.
+        """
+        if not self.pending:
+            return
+        try:
+            added = self.library_service.add_chunks(
+                self.pending, self.pending_document, self.library_id
+            )
+        except DimensionMismatch as e:
+            raise IngestError(self.pending_line, str(e))
+        if added is None:
+            raise IngestError(
+                self.pending_line,
+                f"Document {self.pending_document} not found in library "
+                f"{self.library_id}",
+            )
+        self.chunks += len(added)
+        self.batches += 1
+        self.pending = []
+        if logger.isEnabledFor(logging.DEBUG):
+            log_event(
+                logger,
+                logging.DEBUG,
+                "Ingested batch",
+                library_id=self.library_id,
+                **self.stats(),
+            )
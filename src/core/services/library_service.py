@@ -1,9 +1,94 @@
+import logging
+import os
 import threading
-from typing import List, Optional
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from itertools import count, islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from pydantic import BaseModel
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.chunk_matrix import ChunkMatrix, MatrixItems
+from src.core.indexing.metadata import Condition, MetadataIndex
+from src.core.indexing.text import TextIndex
+from src.core.models.chunk import Chunk
+from src.core.models.document import Document
 from src.core.models.library import Library
+from src.core.services.shared_catalog import (
+    ROLE,
+    SHARED_DIR,
+    ChunkEntry,
+    LibraryPublisher,
+    capture_library_image,
+    write_library_image,
+)
+from src.core.services.snapshots import read_snapshot, write_snapshot
+from src.utils.concurrent import RWLock
+from src.utils.instrumentation import STAGE_SECONDS, get_logger, log_event, span
+from src.utils.wal import WriteAheadLog
+
+# Seconds to wait for a lock before giving up with LockTimeout
+LOCK_TIMEOUT = float(os.environ.get("VECTOR_DB_LOCK_TIMEOUT", "30"))
+# Directory for the write-ahead log and snapshots; unset keeps everything in memory
+DATA_DIR = os.environ.get("VECTOR_DB_DATA_DIR")
+# Seconds a log sync waits to batch more writes into one fsync
+WAL_COMMIT_DELAY = float(os.environ.get("VECTOR_DB_WAL_COMMIT_DELAY", "0"))
+# Number of logged changes after which a snapshot is taken in the background
+SNAPSHOT_INTERVAL = int(os.environ.get("VECTOR_DB_SNAPSHOT_INTERVAL", "10000"))
+# Places a document or chunk may drift from its recorded position in its
+# parent's list before the positions are recorded again (see _position)
+POSITION_DRIFT = 64
+
+logger = get_logger("library_service")
+
+# Model type of each logged argument, to rebuild the models on replay
+LOGGED_MODELS = {
+    "library": Library,
+    "updated_library": Library,
+    "document": Document,
+    "updated_document": Document,
+    "chunk": Chunk,
+    "updated_chunk": Chunk,
+    "chunks": Chunk,
+}
+
+# (library, chunks before, chunks after) still to be applied to the library's index
+IndexChange = Tuple[Library, List[Chunk], List[Chunk]]
+
+
+class DimensionMismatch(ValueError):
+    """
+    Raised when a chunk's embedding does not have the dimension of its library.
+    """
+
+
+class IdConflict(ValueError):
+    """
+    Raised when an update would give an entity the id of another existing one.
+    """
 
 
 class LibraryService:
+    """
+    In-memory catalog of libraries, documents and chunks.
+
+    Locking is two-level. `catalog_lock` guards the dicts below and the
+    document / chunk lists of every library; it is only held for short dict
+    updates. Each library also has its own writer-preferring RWLock that
+    serializes writes to that library and protects its index: searches hold
+    it for reading, chunk changes and index swaps hold it for writing. Locks
+    are always taken library first, then catalog.
+
+    With a data directory every change is written to a write-ahead log before
+    it is applied, and acknowledged once the log is synced. Snapshots of the
+    catalog and the indexes bound how much of the log a restart replays.
+    A finished index build is saved to its own file and logged as well.
+
+    In a writer process every library is also published, after each change,
+    for reader processes to search (see shared_catalog.py).
+    """
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -16,102 +101,1130 @@ class LibraryService:
         if self.__initialized:
             return
         self.__initialized = True
-        self.libraries: List[Library] = []
-        self.lock = threading.Lock()  # Exclusive lock for write
-        self.read_lock = threading.Lock()  # Shared locks for reads
-        self.read_count = 0  # Track the number of readers
+        self.libraries: Dict[str, Library] = {}
+        self.documents: Dict[str, Document] = {}
+        self.chunks: Dict[str, Chunk] = {}
+        # back-references: chunk -> document -> library (absent for detached entities)
+        self.document_library: Dict[str, str] = {}
+        self.chunk_document: Dict[str, str] = {}
+        # position of each document / chunk in its parent's list, at or after
+        # the actual one (see _position)
+        self.document_positions: Dict[str, int] = {}
+        self.chunk_positions: Dict[str, int] = {}
+        # per-library inverted index over chunk metadata, for filtered search
+        self.metadata_indexes: Dict[str, MetadataIndex] = {}
+        # per-library BM25 index over chunk text, for text and hybrid search
+        self.text_indexes: Dict[str, TextIndex] = {}
+        # embedding dimension of the chunks of each non-empty library
+        self.dimensions: Dict[str, int] = {}
+        # per-library matrix of chunk embeddings; the chunks of a library hold
+        # views of their rows
+        self.matrices: Dict[str, ChunkMatrix] = {}
+        # changes with every change to a library's index, for reader processes
+        # to tell whether a published index needs loading again
+        self.index_versions: Dict[str, str] = {}
+        self.lock_timeout = LOCK_TIMEOUT
+        self.catalog_lock = RWLock()
+        self.library_locks: Dict[str, RWLock] = {}
+        self._library_locks_guard = threading.Lock()
+        # bumped on every change to a library's chunks or index; search caches
+        # compare it to tell whether a cached result is still current
+        self.library_versions: Dict[str, int] = {}
+        self._versions = count(1)
+        self.data_dir: Optional[str] = None
+        self.wal: Optional[WriteAheadLog] = None  # None while in memory only
+        self.snapshot_lsn = 0  # Last log record covered by the newest snapshot
+        self.snapshot_interval = SNAPSHOT_INTERVAL
+        self._snapshot_lock = threading.Lock()
+        # saved index builds not covered by a snapshot -> their log record
+        self.index_files: Dict[str, int] = {}
+        self.publisher: Optional[LibraryPublisher] = None
+        if DATA_DIR:
+            self.recover(DATA_DIR)
+        if ROLE == "writer":
+            if not SHARED_DIR:
+                raise ValueError("A writer needs VECTOR_DB_SHARED_DIR")
+            self.publish(SHARED_DIR)
 
-    def acquire_read_lock(self):
+    def recover(self, data_dir: str):
         """
-        Acquire the read lock
+        Restore the catalog and indexes from the newest snapshot in data_dir,
+        replay the log written after it, and log every further change there.
         """
-        self.read_lock.acquire()
-        self.read_count += 1
-        if self.read_count == 1:
-            self.lock.acquire()  # block writes if this is first reader
-        self.read_lock.release()
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        wal = WriteAheadLog(os.path.join(data_dir, "wal"), WAL_COMMIT_DELAY)
+        snapshot = read_snapshot(data_dir)
+        snapshot_lsn = 0
+        if snapshot is not None:
+            snapshot_lsn, catalog, indexes = snapshot
+            self._load_catalog(catalog, indexes)
+        for lsn, record in wal.records(after_lsn=snapshot_lsn):
+            self._replay(record)
+            if record["op"] == "_restore_index":
+                self.index_files[record["args"]["file_name"]] = lsn
+        self.wal, self.snapshot_lsn = wal, snapshot_lsn
 
-    def release_read_lock(self):
+    def snapshot(self) -> Optional[int]:
         """
-        Release the read lock
+        Write a snapshot and delete the log segments it covers. Returns the
+        last log record it covers, or None when nothing is persisted.
         """
-        self.read_lock.acquire()
-        self.read_count -= 1
-        if self.read_count == 0:
-            self.lock.release()
-        self.read_lock.release()
+        if self.wal is None:
+            return None
+        with self._snapshot_lock:
+            return self._write_snapshot()
+
+    def publish(self, shared_dir: str):
+        """
+        Publish every library to shared_dir for reader processes, and each
+        library again shortly after it changes.
+        """
+        self.publisher = LibraryPublisher(shared_dir, self._save_image)
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            library_ids = list(self.libraries)
+        self.publisher.publish(library_ids)
+
+    def library_lock(self, library_id: str) -> RWLock:
+        """
+        Get the lock of a library, creating it on first use
+        """
+        with self._library_locks_guard:
+            return self.library_locks.setdefault(library_id, RWLock())
+
+    @contextmanager
+    def read_library(self, library_id: str):
+        """
+        Hold a library's read lock while using it, e.g. to search its index, so
+        incremental index updates and index swaps never run underneath a query.
+        Yields None if the library does not exist.
+        """
+        start = time.perf_counter()
+        with self.library_lock(library_id).read_locked(self.lock_timeout):
+            STAGE_SECONDS.observe(time.perf_counter() - start, "lock_wait")
+            with span("lookup"):
+                library = self.get_library(library_id)
+            yield library
 
-    def acquire_write_lock(self):
+    def filter_chunks(
+        self, library_id: str, conditions: List[Condition]
+    ) -> Tuple[List[Tuple[str, list]], int]:
         """
-        Acquire the write lock
+        (id, embedding) of the library's chunks whose metadata satisfies every
+        condition, and the number of chunks in the library. A chunk inherits
+        the metadata fields of its document that it does not set itself.
+        Call with the library's read lock held (see read_library): the library's
+        chunks and indexes only change under its write lock, so the catalog
+        lock, which every library's writers need, is not taken.
         """
-        self.lock.acquire()
+        metadata_index = self.metadata_indexes.get(library_id)
+        if metadata_index is None:
+            return [], 0
+        ids = metadata_index.match(conditions)
+        matches = [(id, self.chunks[id].embedding) for id in ids]
+        return matches, len(metadata_index)
 
-    def release_write_lock(self):
+    def search_text(
+        self,
+        library_id: str,
+        query: str,
+        k: int,
+        conditions: Optional[List[Condition]] = None,
+    ) -> List[Tuple[str, float]]:
         """
-        Release the write lock
+        (id, BM25 score) of the k chunks of a library whose text best matches
+        the query, restricted to chunks satisfying the conditions if given.
+        Call with the library's read lock held, as for filter_chunks.
         """
-        self.lock.release()
+        text_index = self.text_indexes.get(library_id)
+        if text_index is None:
+            return []
+        allowed = None
+        if conditions is not None:
+            allowed = self.metadata_indexes[library_id].match(conditions)
+        return text_index.search(query, k, allowed)
+
+    def library_version(self, library_id: str) -> int:
+        """
+        Current version of a library. Stable while its read lock is held.
+        """
+        return self.library_versions.get(library_id, 0)
+
+    def library_dimension(self, library_id: str) -> Optional[int]:
+        """
+        Dimension of a library's embeddings, None while it has no chunks.
+        """
+        return self.dimensions.get(library_id)
 
     def create_library(self, library: Library) -> Library:
         """
         Create a new Library
         """
-        self.acquire_write_lock()
-        try:
-            self.libraries.append(library)
-            print(f"Library created: {library.id}")  # Debug log
-            print(
-                f"Current libraries: {[lib.id for lib in self.libraries]}"
-            )  # Debug log
-            return library
-        finally:
-            self.release_write_lock()
+        with self._locked_libraries(library_ids=[library.id]) as lsns:
+            self._check_dimensions(self._library_chunks(library))
+            with self._catalog_write(lsns, "create_library", library=library):
+                previous = self.libraries.get(library.id)
+                if previous is not None:
+                    self._unregister_library(previous)
+                    if previous.index is not None:
+                        previous.index.close()
+                self._register_library(library)
+                log_event(
+                    logger,
+                    logging.INFO,
+                    "Library created",
+                    library_id=library.id,
+                    libraries=len(self.libraries),
+                )
+                return library
 
     def get_library(self, library_id: str) -> Optional[Library]:
         """
         Get a Library by ID
         """
-        self.acquire_read_lock()
-        try:
-            library = next(
-                (lib for lib in self.libraries if lib.id == library_id), None
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            library = self.libraries.get(library_id)
+            log_event(
+                logger,
+                logging.DEBUG,
+                "Library found" if library else "Library not found",
+                library_id=library_id,
             )
-            if library:
-                print(f"Library found: {library.id}")
-            else:
-                print(f"Library not found: {library_id}")
-            print(f"Current libraries: {[lib.id for lib in self.libraries]}")
             return library
-        finally:
-            self.release_read_lock()
 
     def update_library(
         self, library_id: str, updated_library: Library
     ) -> Optional[Library]:
         """
-        Update a library by it's ID
+        Update a library by it's ID. Raises IdConflict if the update renames
+        it to the id of another library.
         """
-        self.acquire_write_lock()
-        try:
-            for i, lib in enumerate(self.libraries):
-                if lib.id == library_id:
-                    self.libraries[i] = updated_library
-                    return updated_library
-            return None
-        finally:
-            self.release_write_lock()
+        with self._locked_libraries(
+            library_ids=[library_id, updated_library.id]
+        ) as lsns:
+            with self.catalog_lock.read_locked(self.lock_timeout):
+                if (
+                    updated_library.id != library_id
+                    and library_id in self.libraries
+                    and updated_library.id in self.libraries
+                ):
+                    raise IdConflict(f"Library {updated_library.id} already exists")
+            self._check_dimensions(self._library_chunks(updated_library))
+            with self._catalog_write(
+                lsns,
+                "update_library",
+                library_id=library_id,
+                updated_library=updated_library,
+            ):
+                library = self.libraries.get(library_id)
+                if library is None:
+                    return None
+                self._unregister_library(library)
+                self._register_library(updated_library)
+            if updated_library.index is None:
+                # keep the existing index, applying only the chunk changes
+                updated_library.index = library.index
+                self._sync_index(
+                    updated_library,
+                    list(self._library_chunks(library)),
+                    list(self._library_chunks(updated_library)),
+                )
+            elif library.index is not None:
+                library.index.close()
+            return updated_library
 
     def delete_library(self, library_id: str) -> bool:
         """
         Delete a library by it's ID
         """
-        self.acquire_write_lock()
+        with self._locked_libraries(library_ids=[library_id]) as lsns:
+            with self._catalog_write(lsns, "delete_library", library_id=library_id):
+                library = self.libraries.get(library_id)
+                if library is None:
+                    return False
+                self._unregister_library(library)
+            if library.index is not None:
+                library.index.close()
+        return True
+
+    def index_library(
+        self,
+        library_id: str,
+        index: BaseIndex,
+        abort: Optional[Callable[[], None]] = None,
+    ) -> Optional[Library]:
+        """
+        Build an index over a library's chunks and swap it in atomically.
+
+        The build runs without holding any lock, so queries keep using the
+        previous index. Chunk changes made while it was building are applied to
+        the new index right before the swap. `abort` is called under the
+        library's write lock right before the swap; raising there abandons the
+        build. Returns None if the library does not exist (anymore). The
+        replaced index is closed, as is `index` when it is not swapped in.
+        """
         try:
-            for i, lib in enumerate(self.libraries):
-                if lib.id == library_id:
-                    del self.libraries[i]
-                    return True
-            return False
+            library = self._swap_index(library_id, index, abort)
+        except BaseException:
+            index.close()
+            raise
+        if library is None:
+            index.close()
+            return None
+        if self.wal is not None:
+            self._persist_index(library_id, index)
+        return library
+
+    def _swap_index(
+        self,
+        library_id: str,
+        index: BaseIndex,
+        abort: Optional[Callable[[], None]],
+    ) -> Optional[Library]:
+        while True:
+            with self.catalog_lock.read_locked(self.lock_timeout):
+                library = self.libraries.get(library_id)
+                if library is None:
+                    return None
+                snapshot = list(self._library_chunks(library))
+                items = self._index_items(library_id, snapshot)
+            index.build_index(items)
+
+            with self.library_lock(library_id).write_locked(self.lock_timeout):
+                with self.catalog_lock.read_locked(self.lock_timeout):
+                    library = self.libraries.get(library_id)
+                    if library is None:
+                        return None
+                    current = list(self._library_chunks(library))
+                try:
+                    self._apply_chunk_changes(library_id, index, snapshot, current)
+                except NotImplementedError:
+                    continue  # the chunks changed during the build; build again
+                # e.g. compacted during the build
+                index.rebind(self.matrices[library_id])
+                if abort is not None:
+                    abort()
+                previous, library.index = library.index, index
+                self.index_versions[library_id] = uuid.uuid4().hex
+                self._bump_version(library_id)
+            # searches hold the read lock, so none is still using it
+            if previous is not None:
+                previous.close()
+            return library
+
+    def _persist_index(self, library_id: str, index: BaseIndex):
+        """
+        Save a newly swapped in index and log where, so a restart restores it.
+        The index is copied and the record logged with the library's writers
+        held off, so the saved index holds exactly the changes logged before
+        its record; the file is written once they may go on. Replay skips a
+        record whose file was not written before a crash.
+        """
+        file_name = f"{uuid.uuid4().hex}.idx"
+        path = os.path.join(self.data_dir, "indexes", file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a snapshot running meanwhile could delete the file before it is logged
+        with self._snapshot_lock:
+            with self.library_lock(library_id).read_locked(self.lock_timeout):
+                with self.catalog_lock.read_locked(self.lock_timeout):
+                    library = self.libraries.get(library_id)
+                if library is None or library.index is not index:
+                    return  # replaced (or gone) already
+                try:
+                    state = index.copy_state()
+                except NotImplementedError:
+                    return
+                lsns: List[int] = []
+                with self._catalog_write(
+                    lsns, "_restore_index", library_id=library_id, file_name=file_name
+                ):
+                    self.index_files[file_name] = lsns[-1]
+            index.save(path, state)
+            self.wal.sync(lsns[-1])
+        self._maybe_snapshot()
+
+    def _restore_index(self, library_id: str, file_name: str):
+        """
+        Replay a logged index build by loading the index it saved.
+        """
+        path = os.path.join(self.data_dir, "indexes", file_name)
+        library = self.libraries.get(library_id)
+        if library is not None and os.path.exists(path):
+            previous, library.index = library.index, BaseIndex.load(path)
+            if previous is not None:
+                previous.close()
+
+    def list_documents(
+        self, library_id: str, offset: int = 0, limit: int = 100
+    ) -> Optional[List[Document]]:
+        """
+        Page through the documents of a library
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            library = self.libraries.get(library_id)
+            if library is None:
+                return None
+            return library.documents[offset : offset + limit]
+
+    def list_chunks(
+        self, library_id: str, offset: int = 0, limit: int = 100
+    ) -> Optional[List[Chunk]]:
+        """
+        Page through the chunks of a library, document by document
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            library = self.libraries.get(library_id)
+            if library is None:
+                return None
+            return list(islice(self._library_chunks(library), offset, offset + limit))
+
+    def add_document(
+        self, document: Document, library_id: Optional[str] = None
+    ) -> Optional[Document]:
+        """
+        Store a document, appending it to a library when library_id is given.
+        Returns None if the library does not exist.
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(
+            library_ids=[library_id], document_ids=[document.id]
+        ) as lsns:
+            self._check_dimensions(document.chunks, library_id=library_id)
+            with self._catalog_write(
+                lsns, "add_document", document=document, library_id=library_id
+            ):
+                library = None
+                if library_id is not None:
+                    library = self.libraries.get(library_id)
+                    if library is None:
+                        return None
+                if document.id in self.documents:
+                    self._remove_document(document.id, changes)
+                if library is not None:
+                    self._attach(library.documents, self.document_positions, document)
+                    changes.append((library, [], document.chunks))
+                self._register_document(document, library_id)
+            self._apply_changes(changes)
+            return document
+
+    def get_document(self, document_id: str) -> Optional[Document]:
+        """
+        Get a Document by ID
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            return self.documents.get(document_id)
+
+    def update_document(
+        self, document_id: str, updated_document: Document
+    ) -> Optional[Document]:
+        """
+        Replace a document in place, keeping its library and position
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(document_ids=[document_id]) as lsns:
+            self._check_dimensions(updated_document.chunks, document_id=document_id)
+            with self._catalog_write(
+                lsns,
+                "update_document",
+                document_id=document_id,
+                updated_document=updated_document,
+            ):
+                document = self.documents.get(document_id)
+                if document is None:
+                    return None
+                library_id = self.document_library.get(document_id)
+                self._unregister_document(document)
+                if library_id is not None:
+                    library = self.libraries[library_id]
+                    position = self._position(
+                        library.documents, self.document_positions, document_id
+                    )
+                    del self.document_positions[document_id]
+                    library.documents[position] = updated_document
+                    self.document_positions[updated_document.id] = position
+                    changes.append((library, document.chunks, updated_document.chunks))
+                self._register_document(updated_document, library_id)
+            self._apply_changes(changes)
+            return updated_document
+
+    def remove_document(self, document_id: str) -> Optional[Document]:
+        """
+        Delete a document and its chunks. Returns the removed document.
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(document_ids=[document_id]) as lsns:
+            with self._catalog_write(lsns, "remove_document", document_id=document_id):
+                document = self._remove_document(document_id, changes)
+            self._apply_changes(changes)
+            return document
+
+    def list_document_chunks(
+        self, document_id: str, offset: int = 0, limit: int = 100
+    ) -> Optional[List[Chunk]]:
+        """
+        Page through the chunks of a document
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            document = self.documents.get(document_id)
+            if document is None:
+                return None
+            return document.chunks[offset : offset + limit]
+
+    def add_chunk(
+        self, chunk: Chunk, document_id: Optional[str] = None
+    ) -> Optional[Chunk]:
+        """
+        Store a chunk, appending it to a document when document_id is given.
+        Returns None if the document does not exist.
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(
+            document_ids=[document_id], chunk_ids=[chunk.id]
+        ) as lsns:
+            self._check_dimensions([chunk], document_id=document_id)
+            with self._catalog_write(
+                lsns, "add_chunk", chunk=chunk, document_id=document_id
+            ):
+                document = None
+                if document_id is not None:
+                    document = self.documents.get(document_id)
+                    if document is None:
+                        return None
+                if chunk.id in self.chunks:
+                    self._remove_chunk(chunk.id, changes)
+                if document is not None:
+                    self._attach(document.chunks, self.chunk_positions, chunk)
+                self._register_chunk(chunk, document_id)
+                self._store_embeddings(document_id, [chunk])
+                library = self._chunk_library(chunk.id)
+                if library is not None:
+                    changes.append((library, [], [chunk]))
+            self._apply_changes(changes)
+            return chunk
+
+    def add_chunks(
+        self,
+        chunks: List[Chunk],
+        document_id: str,
+        library_id: Optional[str] = None,
+    ) -> Optional[List[Chunk]]:
+        """
+        Append a batch of chunks to a document with one lock acquisition, log
+        record and index update. Returns None if the document does not exist
+        or, when library_id is given, is not in that library.
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(
+            document_ids=[document_id], chunk_ids=[chunk.id for chunk in chunks]
+        ) as lsns:
+            self._check_dimensions(chunks, document_id=document_id)
+            with self._catalog_write(
+                lsns,
+                "add_chunks",
+                chunks=chunks,
+                document_id=document_id,
+                library_id=library_id,
+            ):
+                document = self.documents.get(document_id)
+                if document is None:
+                    return None
+                if (
+                    library_id is not None
+                    and self.document_library.get(document_id) != library_id
+                ):
+                    return None
+                for chunk in chunks:
+                    if chunk.id in self.chunks:
+                        self._remove_chunk(chunk.id, changes)
+                    self._attach(document.chunks, self.chunk_positions, chunk)
+                    self._register_chunk(chunk, document_id)
+                self._store_embeddings(document_id, chunks)
+                library = self._document_library(document_id)
+                if library is not None:
+                    changes.append((library, [], chunks))
+            self._apply_changes(changes)
+            return chunks
+
+    def get_chunk(self, chunk_id: str) -> Optional[Chunk]:
+        """
+        Get a Chunk by ID
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            return self.chunks.get(chunk_id)
+
+    def update_chunk(self, chunk_id: str, updated_chunk: Chunk) -> Optional[Chunk]:
+        """
+        Replace a chunk in place, keeping its document and position
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(chunk_ids=[chunk_id]) as lsns:
+            self._check_dimensions([updated_chunk], chunk_id=chunk_id)
+            with self._catalog_write(
+                lsns, "update_chunk", chunk_id=chunk_id, updated_chunk=updated_chunk
+            ):
+                chunk = self.chunks.pop(chunk_id, None)
+                if chunk is None:
+                    return None
+                self._unindex_chunk(chunk_id)
+                document_id = self.chunk_document.pop(chunk_id, None)
+                library = self._document_library(document_id)
+                if document_id is not None:
+                    chunks = self.documents[document_id].chunks
+                    position = self._position(chunks, self.chunk_positions, chunk_id)
+                    del self.chunk_positions[chunk_id]
+                    chunks[position] = updated_chunk
+                    self.chunk_positions[updated_chunk.id] = position
+                self._register_chunk(updated_chunk, document_id)
+                self._store_embeddings(document_id, [updated_chunk])
+                if library is not None:
+                    changes.append((library, [chunk], [updated_chunk]))
+            self._apply_changes(changes)
+            return updated_chunk
+
+    def remove_chunk(self, chunk_id: str) -> Optional[Chunk]:
+        """
+        Delete a chunk. Returns the removed chunk.
+        """
+        changes: List[IndexChange] = []
+        with self._locked_libraries(chunk_ids=[chunk_id]) as lsns:
+            with self._catalog_write(lsns, "remove_chunk", chunk_id=chunk_id):
+                chunk = self._remove_chunk(chunk_id, changes)
+            self._apply_changes(changes)
+            return chunk
+
+    @contextmanager
+    def _locked_libraries(
+        self,
+        library_ids: Iterable[Optional[str]] = (),
+        document_ids: Iterable[Optional[str]] = (),
+        chunk_ids: Iterable[Optional[str]] = (),
+    ):
+        """
+        Write-lock every library an operation touches, in id order so that two
+        writers can never deadlock. The libraries are resolved again once the
+        locks are held, and locking is retried if a concurrent write moved the
+        documents or chunks in the meantime. Yields a list that collects the
+        log records of the changes, which are synced before returning.
+        """
+        library_ids, document_ids, chunk_ids = (
+            list(library_ids),
+            list(document_ids),
+            list(chunk_ids),
+        )
+        lsns: List[int] = []  # Log records of the changes made under the locks
+        while True:
+            resolved = self._resolve_libraries(library_ids, document_ids, chunk_ids)
+            with ExitStack() as stack:
+                for library_id in resolved:
+                    stack.enter_context(
+                        self.library_lock(library_id).write_locked(self.lock_timeout)
+                    )
+                if resolved == self._resolve_libraries(
+                    library_ids, document_ids, chunk_ids
+                ):
+                    try:
+                        yield lsns
+                    finally:
+                        for library_id in resolved:
+                            self._bump_version(library_id)
+                    break
+
+        # wait for the log once the locks are released, so that writers of the
+        # same library share fsyncs (group commit)
+        if lsns:
+            self.wal.sync(lsns[-1])
+            self._maybe_snapshot()
+
+    def _bump_version(self, library_id: str):
+        """
+        Give a library a new version; called with its write lock held
+        """
+        if library_id in self.libraries:
+            self.library_versions[library_id] = next(self._versions)
+        else:
+            self.library_versions.pop(library_id, None)
+        if self.publisher is not None:
+            self.publisher.mark(library_id)
+
+    def _check_dimensions(
+        self,
+        chunks: Iterable[Chunk],
+        library_id: Optional[str] = None,
+        document_id: Optional[str] = None,
+        chunk_id: Optional[str] = None,
+    ):
+        """
+        Raise DimensionMismatch unless the chunks' embeddings all have the
+        dimension of the library holding the given library, document or chunk
+        (or of each other, if there is none or it is empty). Called with the
+        library write-locked, before the change is logged.
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            if chunk_id is not None:
+                document_id = self.chunk_document.get(chunk_id)
+            if document_id is not None:
+                library_id = self.document_library.get(document_id)
+            dimension = self.dimensions.get(library_id)
+        for chunk in chunks:
+            if dimension is None:
+                dimension = len(chunk.embedding)
+            elif len(chunk.embedding) != dimension:
+                raise DimensionMismatch(
+                    f"Chunk {chunk.id} has {len(chunk.embedding)} dimensions, "
+                    f"expected {dimension}"
+                )
+
+    @contextmanager
+    def _catalog_write(self, lsns: List[int], operation: str, **args):
+        """
+        Hold the catalog write lock for a change and log the change first. A
+        snapshot, taken under the catalog read lock, thus covers exactly the
+        changes logged before it.
+        """
+        with self.catalog_lock.write_locked(self.lock_timeout):
+            if self.wal is not None:
+                args = {name: _dump(value) for name, value in args.items()}
+                lsns.append(self.wal.append({"op": operation, "args": args}))
+            yield
+
+    def _replay(self, record: Dict[str, Any]):
+        """
+        Apply a logged change again during recovery
+        """
+        args = {}
+        for name, value in record["args"].items():
+            model = LOGGED_MODELS.get(name)
+            if model is None:
+                args[name] = value
+            elif isinstance(value, list):
+                args[name] = [model.model_validate(item) for item in value]
+            else:
+                args[name] = model.model_validate(value)
+        getattr(self, record["op"])(**args)
+
+    def _maybe_snapshot(self):
+        """
+        Start a background snapshot once enough changes were logged since the last
+        """
+        if self.wal.last_lsn - self.snapshot_lsn < self.snapshot_interval:
+            return
+        if self._snapshot_lock.acquire(blocking=False):
+            threading.Thread(target=self._snapshot_in_background, daemon=True).start()
+
+    def _snapshot_in_background(self):
+        try:
+            self._write_snapshot()
+        except Exception:
+            logger.exception("Snapshot failed")
         finally:
-            self.release_write_lock()
+            self._snapshot_lock.release()
+
+    def _write_snapshot(self) -> int:
+        """
+        Snapshot the catalog as of a log rotation, then save every index.
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            lsn = self.wal.rotate()
+            catalog = self._dump_catalog()
+        library_ids = [library["id"] for library in catalog["libraries"]]
+        write_snapshot(self.data_dir, lsn, catalog, library_ids, self._save_index)
+        self.wal.truncate_before(lsn)
+        self.snapshot_lsn = lsn
+        self._remove_index_files(lsn)
+        return lsn
+
+    def _remove_index_files(self, lsn: int):
+        """
+        Delete the saved index builds a snapshot covers, and any never logged.
+        """
+        directory = os.path.join(self.data_dir, "indexes")
+        if not os.path.isdir(directory):
+            return
+        for file_name in os.listdir(directory):
+            if self.index_files.get(file_name, 0) <= lsn:
+                os.remove(os.path.join(directory, file_name))
+                self.index_files.pop(file_name, None)
+
+    def _save_index(self, library_id: str, path: str) -> bool:
+        """
+        Save a library's index for a snapshot. It may already hold changes
+        logged after the snapshot; replaying those again is harmless since
+        index updates only set or delete vectors by id.
+        """
+        with self.library_lock(library_id).read_locked(self.lock_timeout):
+            with self.catalog_lock.read_locked(self.lock_timeout):
+                library = self.libraries.get(library_id)
+            if library is None or library.index is None:
+                return False
+            index = library.index
+            try:
+                state = index.copy_state()
+            except NotImplementedError:
+                return False
+        # the copy must not hold changes that could still be lost; syncing and
+        # writing without the lock keeps the library's searches going
+        self.wal.sync()
+        index.save(path, state)
+        return True
+
+    def _save_image(self, library_id: str, path: str) -> Optional[int]:
+        """
+        Write a library image for reader processes. Returns the library's
+        version, or None if it does not exist (anymore).
+        """
+        with self.library_lock(library_id).read_locked(self.lock_timeout):
+            with self.catalog_lock.read_locked(self.lock_timeout):
+                library = self.libraries.get(library_id)
+                if library is None:
+                    return None
+                chunks: List[ChunkEntry] = [
+                    (chunk.id, chunk.embedding)
+                    for chunk in self._library_chunks(library)
+                ]
+                index_version = None
+                if library.index is not None:
+                    # indexes restored at startup have no version yet
+                    index_version = self.index_versions.setdefault(
+                        library_id, uuid.uuid4().hex
+                    )
+                version = self.library_version(library_id)
+                image = capture_library_image(
+                    library_id,
+                    version,
+                    chunks,
+                    self.metadata_indexes[library_id],
+                    self.text_indexes[library_id],
+                    library.index,
+                    index_version,
+                )
+        # written unlocked, so writers of the library do not wait for the disk
+        write_library_image(path, image)
+        return version
+
+    def _dump_catalog(self) -> Dict[str, Any]:
+        """
+        Every library, plus the documents and chunks not attached to a parent
+        """
+        return {
+            "libraries": [
+                library.model_dump(mode="json") for library in self.libraries.values()
+            ],
+            "documents": [
+                document.model_dump(mode="json")
+                for id, document in self.documents.items()
+                if id not in self.document_library
+            ],
+            "chunks": [
+                chunk.model_dump(mode="json")
+                for id, chunk in self.chunks.items()
+                if id not in self.chunk_document
+            ],
+        }
+
+    def _load_catalog(self, catalog: Dict[str, Any], indexes: Dict[str, BaseIndex]):
+        for data in catalog["libraries"]:
+            library = Library.model_validate(data)
+            library.index = indexes.get(library.id)
+            self._register_library(library)
+        for data in catalog["documents"]:
+            self._register_document(Document.model_validate(data), None)
+        for data in catalog["chunks"]:
+            self._register_chunk(Chunk.model_validate(data), None)
+
+    def _resolve_libraries(
+        self,
+        library_ids: List[Optional[str]],
+        document_ids: List[Optional[str]],
+        chunk_ids: List[Optional[str]],
+    ) -> List[str]:
+        """
+        Sorted ids of the libraries holding the given libraries, documents and chunks
+        """
+        with self.catalog_lock.read_locked(self.lock_timeout):
+            document_ids = document_ids + [
+                self.chunk_document.get(chunk_id) for chunk_id in chunk_ids
+            ]
+            library_ids = library_ids + [
+                self.document_library.get(document_id) for document_id in document_ids
+            ]
+        return sorted({id for id in library_ids if id is not None})
+
+    def _register_library(self, library: Library):
+        """
+        Index a library and everything nested in it
+        """
+        self.libraries[library.id] = library
+        self.metadata_indexes[library.id] = MetadataIndex()
+        self.text_indexes[library.id] = TextIndex()
+        self.matrices[library.id] = matrix = ChunkMatrix()
+        chunks = list(self._library_chunks(library))
+        if chunks:
+            matrix.reserve(len(chunks), len(chunks[0].embedding))
+        for position, document in enumerate(library.documents):
+            self.document_positions[document.id] = position
+            self._register_document(document, library.id)
+
+    def _unregister_library(self, library: Library):
+        self.libraries.pop(library.id, None)
+        self.metadata_indexes.pop(library.id, None)
+        self.text_indexes.pop(library.id, None)
+        self.matrices.pop(library.id, None)
+        self.dimensions.pop(library.id, None)
+        self.index_versions.pop(library.id, None)
+        for document in library.documents:
+            self.document_positions.pop(document.id, None)
+            self._unregister_document(document)
+
+    def _register_document(self, document: Document, library_id: Optional[str]):
+        self.documents[document.id] = document
+        if library_id is not None:
+            self.document_library[document.id] = library_id
+        for position, chunk in enumerate(document.chunks):
+            self.chunk_positions[chunk.id] = position
+            self._register_chunk(chunk, document.id)
+        self._store_embeddings(document.id, document.chunks)
+
+    def _unregister_document(self, document: Document):
+        self.documents.pop(document.id, None)
+        for chunk in document.chunks:
+            self._unindex_chunk(chunk.id)
+            self.chunks.pop(chunk.id, None)
+            self.chunk_document.pop(chunk.id, None)
+            self.chunk_positions.pop(chunk.id, None)
+        self.document_library.pop(document.id, None)
+
+    def _register_chunk(self, chunk: Chunk, document_id: Optional[str]):
+        self.chunks[chunk.id] = chunk
+        if document_id is not None:
+            self.chunk_document[chunk.id] = document_id
+            library_id = self.document_library.get(document_id)
+            metadata_index = self.metadata_indexes.get(library_id)
+            if metadata_index is not None:
+                document = self.documents[document_id]
+                metadata_index.add(chunk.id, {**document.metadata, **chunk.metadata})
+                self.text_indexes[library_id].add(chunk.id, chunk.text)
+                self.dimensions.setdefault(library_id, len(chunk.embedding))
+
+    def _store_embeddings(self, document_id: Optional[str], chunks: List[Chunk]):
+        """
+        Write the embeddings of a document's registered chunks to its library's
+        matrix, if it is in one, and point the chunks at their rows
+        """
+        library_id = self.document_library.get(document_id)
+        matrix = self.matrices.get(library_id)
+        if matrix is None or not chunks:
+            return
+        if not len(matrix) and matrix.size and matrix.dim != len(chunks[0].embedding):
+            # emptied, and refilled with another dimension (see _check_dimensions)
+            matrix = self.matrices[library_id] = ChunkMatrix()
+        start = matrix.size
+        embeddings = [chunk.embedding for chunk in chunks]
+        if matrix.append(document_id, [chunk.id for chunk in chunks], embeddings):
+            self._bind_embeddings(library_id, matrix)
+        else:
+            for row, chunk in enumerate(chunks, start):
+                chunk.embedding = matrix.view(row)
+
+    def _bind_embeddings(self, library_id: str, matrix: ChunkMatrix):
+        """
+        Point every chunk of a library's matrix at its row, after the rows moved
+        """
+        for id, row in matrix.rows.items():
+            # skipping an id another library's chunk has taken over since
+            if self.document_library.get(self.chunk_document.get(id)) == library_id:
+                self.chunks[id].embedding = matrix.view(row)
+
+    def _unindex_chunk(self, chunk_id: str):
+        """
+        Drop a chunk from its library's metadata and text indexes and matrix,
+        while it is still attached
+        """
+        library_id = self.document_library.get(self.chunk_document.get(chunk_id))
+        metadata_index = self.metadata_indexes.get(library_id)
+        if metadata_index is not None:
+            metadata_index.remove(chunk_id)
+            self.text_indexes[library_id].remove(chunk_id)
+            self.matrices[library_id].release(chunk_id)
+            if not len(metadata_index):
+                self.dimensions.pop(library_id, None)
+
+    def _remove_document(
+        self, document_id: str, changes: List[IndexChange]
+    ) -> Optional[Document]:
+        document = self.documents.get(document_id)
+        if document is None:
+            return None
+        library = self._document_library(document_id)
+        if library is not None:
+            self._detach(library.documents, self.document_positions, document_id)
+            changes.append((library, document.chunks, []))
+        self._unregister_document(document)
+        return document
+
+    def _remove_chunk(
+        self, chunk_id: str, changes: List[IndexChange]
+    ) -> Optional[Chunk]:
+        chunk = self.chunks.pop(chunk_id, None)
+        if chunk is None:
+            return None
+        library = self._chunk_library(chunk_id)
+        self._unindex_chunk(chunk_id)
+        document_id = self.chunk_document.pop(chunk_id, None)
+        if document_id is not None:
+            document = self.documents[document_id]
+            self._detach(document.chunks, self.chunk_positions, chunk_id)
+        if library is not None:
+            changes.append((library, [chunk], []))
+        return chunk
+
+    def _document_library(self, document_id: Optional[str]) -> Optional[Library]:
+        library_id = self.document_library.get(document_id)
+        return self.libraries.get(library_id) if library_id is not None else None
+
+    def _chunk_library(self, chunk_id: str) -> Optional[Library]:
+        return self._document_library(self.chunk_document.get(chunk_id))
+
+    def _library_chunks(self, library: Library) -> Iterable[Chunk]:
+        return (chunk for document in library.documents for chunk in document.chunks)
+
+    def _attach(self, items: list, positions: Dict[str, int], item):
+        """
+        Append an item to its parent's list and remember its position
+        """
+        positions[item.id] = len(items)
+        items.append(item)
+
+    def _detach(self, items: list, positions: Dict[str, int], item_id: str):
+        """
+        Remove an item from its parent's list, keeping the order of the rest
+        """
+        position = self._position(items, positions, item_id)
+        del positions[item_id]
+        del items[position]
+
+    def _position(self, items: list, positions: Dict[str, int], item_id: str) -> int:
+        """
+        Current position of an item in its parent's list. Removals shift the
+        items after them left without updating their recorded positions, so an
+        item is found at or before its recorded position. Once it drifted more
+        than POSITION_DRIFT places, the positions from it on are recorded again.
+        """
+        recorded = positions[item_id]
+        position = min(recorded, len(items) - 1)
+        while items[position].id != item_id:
+            position -= 1
+        if recorded - position > POSITION_DRIFT:
+            positions.update(
+                (item.id, index)
+                for index, item in enumerate(items[position:], position)
+            )
+        return position
+
+    def _apply_changes(self, changes: List[IndexChange]):
+        """
+        Apply collected chunk changes to the affected indexes. Runs after the
+        catalog lock is released, while the libraries are still write-locked.
+        """
+        for library, old_chunks, new_chunks in changes:
+            self._sync_index(library, old_chunks, new_chunks)
+
+    def _sync_index(
+        self, library: Library, old_chunks: List[Chunk], new_chunks: List[Chunk]
+    ):
+        """
+        Apply chunk changes to a library's index incrementally. Indexes without
+        incremental support, or that fail to apply a change, are dropped and the
+        library has to be re-indexed. Then compact the library's matrix if due.
+        """
+        if library.index is not None:
+            try:
+                if self._apply_chunk_changes(
+                    library.id, library.index, old_chunks, new_chunks
+                ):
+                    self.index_versions[library.id] = uuid.uuid4().hex
+            except NotImplementedError:
+                library.index.close()
+                library.index = None
+            except Exception:
+                # the change is already committed, and an index missing part of
+                # it would answer wrongly, so it is dropped until the next build
+                logger.exception("Index update failed, dropping the index")
+                library.index.close()
+                library.index = None
+        self._compact_matrix(library)
+
+    def _compact_matrix(self, library: Library):
+        """
+        Copy a library's live rows to a new matrix once enough of its rows are
+        dead, and move its chunks and index there. Called with the library
+        write-locked and its index up to date, so the index can follow the
+        matrix by chunk id (also when the matrix was replaced otherwise).
+        Background builds keep reading the old matrix, which stays as it is.
+        """
+        matrix = self.matrices.get(library.id)
+        if matrix is None:
+            return
+        if matrix.needs_compaction():
+            matrix = self.matrices[library.id] = matrix.compacted()
+            self._bind_embeddings(library.id, matrix)
+        if library.index is not None:
+            library.index.rebind(matrix)
+
+    def _apply_chunk_changes(
+        self,
+        library_id: str,
+        index: BaseIndex,
+        old_chunks: List[Chunk],
+        new_chunks: List[Chunk],
+    ) -> bool:
+        """
+        Turn the difference between two chunk lists into index remove/add
+        calls. Returns whether the index changed.
+        """
+        old = {chunk.id: chunk for chunk in old_chunks}
+        new = {chunk.id: chunk for chunk in new_chunks}
+
+        def changed(chunk: Chunk, other: Optional[Chunk]) -> bool:
+            # chunks are replaced rather than mutated, so identity is a fast path
+            return other is None or (
+                other is not chunk
+                and not np.array_equal(other.embedding, chunk.embedding)
+            )
+
+        removed = [id for id, chunk in old.items() if changed(chunk, new.get(id))]
+        added = self._index_items(
+            library_id,
+            [chunk for id, chunk in new.items() if changed(chunk, old.get(id))],
+        )
+        if removed:
+            index.remove(removed)
+        if added:
+            index.add(added)
+        return bool(removed or added)
+
+    def _index_items(
+        self, library_id: str, chunks: List[Chunk]
+    ) -> List[Tuple[str, np.ndarray]]:
+        """
+        (id, embedding) of chunks to index, as MatrixItems when they all are
+        rows of the library's matrix
+        """
+        items = [(chunk.id, chunk.embedding) for chunk in chunks]
+        matrix = self.matrices.get(library_id)
+        if matrix is None:
+            return items
+        rows = [matrix.rows.get(chunk.id) for chunk in chunks]
+        if None in rows:
+            return items
+        return MatrixItems(matrix, items, rows)
+
+
+def _dump(value: Any) -> Any:
+    """
+    JSON-serializable form of a logged argument
+    """
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, list):
+        return [_dump(item) for item in value]
+    return value
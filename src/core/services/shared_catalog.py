@@ -0,0 +1,401 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import count
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from src.core.indexing.base import BaseIndex
+from src.core.indexing.metadata import Condition, MetadataIndex
+from src.core.indexing.persistence import (
+    read_index_file,
+    strip_prefix,
+    with_prefix,
+    write_index_file,
+)
+from src.core.indexing.text import TextIndex
+from src.utils.instrumentation import get_logger, log_event, span
+
+# "writer" publishes every library to VECTOR_DB_SHARED_DIR; "reader" serves
+# searches from there and forwards everything else to the writer. Unset, a
+# process serves everything on its own.
+ROLE = os.environ.get("VECTOR_DB_ROLE")
+# Directory the writer publishes to, ideally on a tmpfs such as /dev/shm
+SHARED_DIR = os.environ.get("VECTOR_DB_SHARED_DIR")
+# Seconds the writer waits after a change so a burst of writes is published once
+PUBLISH_DELAY = float(os.environ.get("VECTOR_DB_PUBLISH_DELAY", "0.2"))
+# Seconds between a reader's checks for newly published libraries
+REFRESH_INTERVAL = float(os.environ.get("VECTOR_DB_REFRESH_INTERVAL", "0.1"))
+
+MANIFEST = "manifest.json"
+_IMAGE_TYPE = "LibraryImage"
+_IMAGE_SUFFIX = ".lib"
+
+logger = get_logger("shared_catalog")
+
+# (id, embedding) of a chunk
+ChunkEntry = Tuple[str, np.ndarray]
+
+
+def capture_library_image(
+    library_id: str,
+    version: int,
+    chunks: List[ChunkEntry],
+    metadata_index: MetadataIndex,
+    text_index: TextIndex,
+    index: Optional[BaseIndex],
+    index_version: Optional[str],
+) -> Dict[str, Any]:
+    """
+    What a reader needs to search a library: its index, if any, the id and
+    embedding of every chunk, and the postings of its metadata and text
+    indexes. Called with the library locked; the result shares nothing that
+    changes with the library, so `write_library_image` can run unlocked.
+    `index_version` changes whenever the index does.
+    """
+    image: Dict[str, Any] = {
+        "library_id": library_id,
+        "version": version,
+        "index_type": None,
+        "index_version": index_version,
+        "chunk_ids": [id for id, _ in chunks],
+        # chunks are replaced rather than mutated, so their arrays are kept
+        "embeddings": [embedding for _, embedding in chunks],
+        **with_prefix("metadata", metadata_index.get_state()),
+        **with_prefix("text", text_index.get_state()),
+    }
+    if index is not None:
+        image["index_type"] = type(index).__name__
+        image.update(with_prefix("index", index.copy_state()))
+    return image
+
+
+def write_library_image(path: str, image: Dict[str, Any]):
+    """
+    Write an image taken by `capture_library_image`.
+    """
+    state = dict(image)
+    embeddings = state.pop("embeddings")
+    if embeddings:
+        state["vectors"] = np.stack(embeddings)
+    write_index_file(path, _IMAGE_TYPE, state)
+
+
+class PublishedLibrary:
+    """
+    A library as published by the writer. The index, the chunk vectors and
+    the postings are read-only views of the memory-mapped image, so the pages
+    are shared by every process that loads it. The index of the `previous`
+    image is kept if it did not change since.
+    """
+
+    def __init__(
+        self, path: str, version: int, previous: Optional["PublishedLibrary"] = None
+    ):
+        image_type, state = read_index_file(path)
+        if image_type != _IMAGE_TYPE:
+            raise ValueError(f"{path} is not a library image")
+        self.id: str = state["library_id"]
+        # local to this process, so a writer restart never reuses a cache key
+        self.version = version
+        self.index: Optional[BaseIndex] = None
+        self.index_version: Optional[str] = state["index_version"]
+        self.vectors: Optional[np.ndarray] = state.get("vectors")
+        # Chunk id -> row of `vectors`
+        self.rows: Dict[str, int] = {
+            id: row for row, id in enumerate(state["chunk_ids"])
+        }
+        self.metadata_index = MetadataIndex.from_state(strip_prefix("metadata", state))
+        self.text_index = TextIndex.from_state(strip_prefix("text", state))
+        if state["index_type"] is None:
+            return
+        if (
+            previous is not None
+            and previous.index is not None
+            and self.index_version is not None
+            and previous.index_version == self.index_version
+        ):
+            # e.g. a sharded index keeps its shard servers
+            self.index = previous.index
+        else:
+            self.index = BaseIndex.from_state(
+                state["index_type"], strip_prefix("index", state)
+            )
+
+
+class LibraryPublisher:
+    """
+    Publishes libraries to a shared directory for reader processes.
+
+    Every publish writes a library to a new image file, then atomically
+    replaces the manifest naming the current image of each library, and
+    deletes the images it superseded; readers still using one keep it mapped.
+    Changed libraries are published by a background thread `delay` seconds
+    after they are marked.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        save_library: Callable[[str, str], Optional[int]],
+        delay: float = PUBLISH_DELAY,
+    ):
+        """
+        `save_library(library_id, path)` writes a library image and returns
+        the library's version, or None if the library does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.save_library = save_library
+        self.delay = delay
+        self.images: Dict[str, Dict[str, Any]] = {}  # Library id -> manifest entry
+        self.pending: set = set()
+        self.condition = threading.Condition()
+        self._publish_lock = threading.Lock()
+        # image names are unique across writer restarts, so readers never
+        # mistake a new image for one they already loaded
+        self._prefix = uuid.uuid4().hex[:12]
+        self._numbers = count()
+        self._generations = count(1)
+
+        # images left behind by a previous writer are stale
+        for name in os.listdir(directory):
+            if name.endswith(_IMAGE_SUFFIX) or name == MANIFEST:
+                os.remove(os.path.join(directory, name))
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def mark(self, library_id: str):
+        """
+        Publish a library again, after the delay.
+        """
+        with self.condition:
+            self.pending.add(library_id)
+            self.condition.notify()
+
+    def publish(self, library_ids: Iterable[str]):
+        """
+        Publish libraries right away. Failed ones are marked to be retried.
+        """
+        with self._publish_lock:
+            stale = []
+            for library_id in sorted(set(library_ids)):
+                # library ids may contain any character, so images are numbered
+                name = f"{self._prefix}-{next(self._numbers):08d}{_IMAGE_SUFFIX}"
+                try:
+                    version = self.save_library(
+                        library_id, os.path.join(self.directory, name)
+                    )
+                except Exception:
+                    logger.exception("Publishing failed")
+                    self.mark(library_id)
+                    continue
+                previous = self.images.pop(library_id, None)
+                if previous is not None:
+                    stale.append(previous["file"])
+                if version is not None:
+                    self.images[library_id] = {"file": name, "version": version}
+            self._write_manifest()
+            for name in stale:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:  # e.g. still mapped on Windows
+                    pass
+            log_event(
+                logger,
+                logging.DEBUG,
+                "Libraries published",
+                libraries=len(self.images),
+            )
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(
+                {
+                    "generation": f"{self._prefix}-{next(self._generations)}",
+                    "libraries": self.images,
+                },
+                f,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(self.delay)  # let a burst of changes accumulate
+            with self.condition:
+                library_ids, self.pending = self.pending, set()
+            self.publish(library_ids)
+
+
+class SharedCatalog:
+    """
+    Read-only view of the libraries a writer process publishes, used by
+    reader processes in place of LibraryService to serve searches.
+
+    A background thread polls the manifest and swaps in new images whole, so
+    a search never sees a library change underneath it. Images are
+    memory-mapped: the vectors, flat index arrays and postings exist once in
+    memory no matter how many readers map them. Indexes restored into Python
+    objects (the HNSW graph) are built per process, when they changed.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(SharedCatalog, cls).__new__(cls)
+            cls._instance.__initialized = False
+        return cls._instance
+
+    def __init__(self, directory: Optional[str] = None, poll: bool = True):
+        if self.__initialized:
+            return
+        self.__initialized = True
+        self.directory = directory or SHARED_DIR
+        if not self.directory:
+            raise ValueError("A reader needs VECTOR_DB_SHARED_DIR")
+        self.refresh_interval = REFRESH_INTERVAL
+        self.libraries: Dict[str, PublishedLibrary] = {}
+        self.files: Dict[str, str] = {}  # Library id -> loaded image
+        self._generation: Optional[str] = None  # Of the manifest loaded last
+        self._refresh_lock = threading.Lock()
+        self._versions = count(1)
+        # libraries yielded by read_library, per thread
+        self._reading = threading.local()
+        if poll:
+            threading.Thread(target=self._poll, daemon=True).start()
+
+    @contextmanager
+    def read_library(self, library_id: str) -> Iterator[Optional[PublishedLibrary]]:
+        """
+        The newest published version of a library, or None. Version lookups
+        and filters in the with block see this same version.
+        """
+        with span("lookup"):
+            library = self.libraries.get(library_id)
+        pinned = self._pinned()
+        pinned[library_id] = library
+        try:
+            yield library
+        finally:
+            pinned.pop(library_id, None)
+
+    def library_version(self, library_id: str) -> int:
+        """
+        Version of a library. Stable inside `read_library`.
+        """
+        library = self._library(library_id)
+        return library.version if library is not None else 0
+
+    def library_dimension(self, library_id: str) -> Optional[int]:
+        """
+        Dimension of a library's embeddings, None while it has no chunks.
+        Stable inside `read_library`.
+        """
+        library = self._library(library_id)
+        if library is None or library.vectors is None:
+            return None
+        return library.vectors.shape[1]
+
+    def filter_chunks(
+        self, library_id: str, conditions: List[Condition]
+    ) -> Tuple[List[Tuple[str, np.ndarray]], int]:
+        """
+        (id, embedding) of the library's chunks whose metadata satisfies every
+        condition, and the number of chunks in the library.
+        """
+        library = self._library(library_id)
+        if library is None or library.vectors is None:
+            return [], 0
+        ids = library.metadata_index.match(conditions)
+        matches = [(id, library.vectors[library.rows[id]]) for id in ids]
+        return matches, len(library.metadata_index)
+
+    def search_text(
+        self,
+        library_id: str,
+        query: str,
+        k: int,
+        conditions: Optional[List[Condition]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        (id, BM25 score) of the k chunks of a library whose text best matches
+        the query, restricted to chunks satisfying the conditions if given.
+        """
+        library = self._library(library_id)
+        if library is None:
+            return []
+        allowed = None
+        if conditions is not None:
+            allowed = library.metadata_index.match(conditions)
+        return library.text_index.search(query, k, allowed)
+
+    def refresh(self) -> bool:
+        """
+        Load the libraries published since the last call. Returns whether the
+        manifest changed.
+        """
+        path = os.path.join(self.directory, MANIFEST)
+        with self._refresh_lock:
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                return False  # nothing published yet
+            generation = manifest["generation"]
+            if generation == self._generation:
+                return False
+
+            libraries, files = {}, {}
+            for library_id, entry in manifest["libraries"].items():
+                if self.files.get(library_id) == entry["file"]:
+                    libraries[library_id] = self.libraries[library_id]
+                    files[library_id] = entry["file"]
+                    continue
+                try:
+                    libraries[library_id] = PublishedLibrary(
+                        os.path.join(self.directory, entry["file"]),
+                        next(self._versions),
+                        self.libraries.get(library_id),
+                    )
+                    files[library_id] = entry["file"]
+                except FileNotFoundError:
+                    # superseded while we read the manifest; retry with the next
+                    generation = None
+                    if library_id in self.libraries:
+                        libraries[library_id] = self.libraries[library_id]
+                        files[library_id] = self.files[library_id]
+            self.libraries, self.files = libraries, files
+            self._generation = generation
+            log_event(
+                logger,
+                logging.DEBUG,
+                "Catalog refreshed",
+                libraries=len(libraries),
+            )
+            return True
+
+    def _library(self, library_id: str) -> Optional[PublishedLibrary]:
+        pinned = self._pinned()
+        if library_id in pinned:
+            return pinned[library_id]
+        return self.libraries.get(library_id)
+
+    def _pinned(self) -> Dict[str, Optional[PublishedLibrary]]:
+        if not hasattr(self._reading, "libraries"):
+            self._reading.libraries = {}
+        return self._reading.libraries
+
+    def _poll(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Catalog refresh failed")
+            time.sleep(self.refresh_interval)
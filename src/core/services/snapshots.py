@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.core.indexing.base import BaseIndex
+
+_SNAPSHOT_PREFIX = "snapshot-"
+
+
+def snapshot_path(directory: str, lsn: int) -> str:
+    return os.path.join(directory, f"{_SNAPSHOT_PREFIX}{lsn:020d}")
+
+
+def write_snapshot(
+    directory: str,
+    lsn: int,
+    catalog: Dict[str, Any],
+    library_ids: List[str],
+    save_index: Callable[[str, str], bool],
+) -> str:
+    """
+    Write a snapshot of the catalog as of `lsn`, then delete older snapshots.
+    `save_index(library_id, path)` is called per library to save its index and
+    returns whether it did.
+
+    The snapshot is assembled in a temporary directory and renamed into place,
+    so a crash never leaves a partial snapshot behind.
+    """
+    path = snapshot_path(directory, lsn)
+    if os.path.exists(path):
+        return path  # nothing was logged since; keep the complete snapshot we have
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_path, "indexes"))
+
+    # library ids may contain any character, so index files are numbered
+    index_files = {}
+    for number, library_id in enumerate(library_ids):
+        file_name = os.path.join("indexes", f"{number}.idx")
+        if save_index(library_id, os.path.join(tmp_path, file_name)):
+            index_files[library_id] = file_name
+
+    with open(os.path.join(tmp_path, "catalog.json"), "w") as f:
+        json.dump({"lsn": lsn, "indexes": index_files, **catalog}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(directory)
+
+    for name in os.listdir(directory):
+        older = os.path.join(directory, name)
+        if name.startswith(_SNAPSHOT_PREFIX) and older != path:
+            shutil.rmtree(older, ignore_errors=True)
+    return path
+
+
+def read_snapshot(
+    directory: str,
+) -> Optional[Tuple[int, Dict[str, Any], Dict[str, BaseIndex]]]:
+    """
+    Load the newest snapshot: (lsn, catalog, library id -> index), or None.
+    Indexes are memory-mapped from the snapshot's files.
+    """
+    names = sorted(
+        name
+        for name in os.listdir(directory)
+        if name.startswith(_SNAPSHOT_PREFIX) and not name.endswith(".tmp")
+    )
+    if not names:
+        return None
+    path = os.path.join(directory, names[-1])
+    with open(os.path.join(path, "catalog.json")) as f:
+        catalog = json.load(f)
+    indexes = {
+        library_id: BaseIndex.load(os.path.join(path, file_name))
+        for library_id, file_name in catalog.pop("indexes").items()
+    }
+    return catalog.pop("lsn"), catalog, indexes
+
+
+def _fsync_directory(directory: str):
+    """
+    Make a rename in the directory durable.
+    """
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
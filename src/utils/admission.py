@@ -0,0 +1,124 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from src.utils.instrumentation import STAGE_SECONDS
+
+# Threads running searches; more only add GIL contention for pure-Python indexes
+SEARCH_WORKERS = int(os.environ.get("VECTOR_DB_SEARCH_WORKERS", os.cpu_count() or 1))
+# Searches that may wait for a worker; beyond that new ones are rejected (429)
+SEARCH_QUEUE_SIZE = int(os.environ.get("VECTOR_DB_SEARCH_QUEUE_SIZE", "64"))
+# Seconds a search may take, queueing included, unless the request sets less
+SEARCH_TIMEOUT = float(os.environ.get("VECTOR_DB_SEARCH_TIMEOUT", "10"))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is rejected because the admission queue is full.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request's deadline passed before its work finished.
+    """
+
+
+class AdmissionPool:
+    """
+    Bounded thread pool that async handlers hand their blocking work to.
+
+    At most `workers` calls run at once and `queue_size` more wait; further
+    calls are rejected right away with Overloaded instead of queueing without
+    bound, so the latency of admitted requests stays predictable under
+    overload. Every call has a deadline: a caller stops waiting once it
+    passes, and a call still queued by then is skipped. A call counts against
+    the limit until it finishes, even if its caller gave up.
+    """
+
+    def __init__(
+        self,
+        workers: int = SEARCH_WORKERS,
+        queue_size: int = SEARCH_QUEUE_SIZE,
+        timeout: float = SEARCH_TIMEOUT,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout  # Default deadline in seconds
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="admission")
+        self.lock = threading.Lock()
+        self.admitted = 0  # Calls queued or running
+        self.rejected = 0
+        self.expired = 0
+
+    async def run(
+        self,
+        func: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Run func(*args, **kwargs) on the pool and return its result. Raises
+        Overloaded if the queue is full and DeadlineExceeded once `timeout`
+        seconds (at most the pool's default) have passed.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            if self.admitted >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise Overloaded(
+                    f"Too many requests in flight ({self.admitted}), retry later"
+                )
+            self.admitted += 1
+        try:
+            future = self.executor.submit(
+                self._call, deadline, time.perf_counter(), func, args, kwargs
+            )
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), max(deadline - time.monotonic(), 0)
+            )
+        except asyncio.TimeoutError:
+            # cancelling the wrapper also drops the call if it is still queued
+            with self.lock:
+                self.expired += 1
+            raise DeadlineExceeded(f"Request did not finish within {timeout}s")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Configured limits and counters of admitted, rejected and expired calls.
+        """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
+
+    def _call(
+        self,
+        deadline: float,
+        submitted: float,
+        func: Callable[..., Any],
+        args: tuple,
+        kwargs: Dict[str, Any],
+    ) -> Any:
+        STAGE_SECONDS.observe(time.perf_counter() - submitted, "queue_wait")
+        if time.monotonic() >= deadline:
+            raise DeadlineExceeded("Deadline passed while queued")
+        return func(*args, **kwargs)
+
+    def _release(self, future: Optional[Future]):
+        with self.lock:
+            self.admitted -= 1
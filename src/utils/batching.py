@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
+from src.utils.admission import DeadlineExceeded
+from src.utils.instrumentation import (
+    SEARCH_BATCH_FILL,
+    SEARCH_BATCH_SIZE,
+    get_logger,
+    log_event,
+)
+
+# Seconds a search waits for others to share its index call; 0 disables batching
+BATCH_WINDOW = float(os.environ.get("VECTOR_DB_BATCH_WINDOW", "0.002"))
+# Searches per batch; a full batch is run without waiting for the window to end
+BATCH_MAX_SIZE = int(os.environ.get("VECTOR_DB_BATCH_MAX_SIZE", "64"))
+
+logger = get_logger("batching")
+
+# Runs a batch of queries and returns one result per query, in order
+BatchRunner = Callable[[List[Any], Optional[float]], Awaitable[List[Any]]]
+
+# Errors a single malformed query can cause; others (overload, deadlines,
+# a missing library) fail the batch as a whole
+QUERY_ERRORS: Tuple[Type[Exception], ...] = (ValueError, TypeError)
+
+
+class _Batch:
+    def __init__(self):
+        self.queries: List[Any] = []
+        self.timeouts: List[Optional[float]] = []
+        self.abandoned: Set[int] = set()  # Positions whose caller gave up
+        self.full = asyncio.Event()
+        self.result: "asyncio.Future[List[Any]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single searches into batches on the event loop.
+
+    The first search for a key opens a batch and waits up to `window`
+    seconds for more with the same key (the same library, k and search
+    parameters), or until `max_size` have joined. The batch then goes to the
+    runner as one call, e.g. one matrix product against the library's
+    vectors, and every search gets its own result back. A batch failing with
+    one of `query_errors` is run again one search at a time, for the callers
+    still waiting, so a malformed query only fails its own search; any other
+    error fails every search of the batch. Callers waiting on a batch hold no
+    thread.
+    """
+
+    def __init__(
+        self,
+        window: float = BATCH_WINDOW,
+        max_size: int = BATCH_MAX_SIZE,
+        query_errors: Tuple[Type[Exception], ...] = QUERY_ERRORS,
+    ):
+        self.window = window
+        self.max_size = max_size
+        self.query_errors = query_errors
+        self.open: Dict[Hashable, _Batch] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_size > 1
+
+    async def submit(
+        self,
+        key: Hashable,
+        query: Any,
+        run: BatchRunner,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Add a query to the open batch of its key, or open one that `run`
+        executes, and return the query's result. Raises DeadlineExceeded
+        after `timeout` seconds; `run` gets the longest timeout of its batch.
+        """
+        if not self.enabled:
+            return (await run([query], timeout))[0]
+        batch = self.open.get(key)
+        if batch is None:
+            batch = self.open[key] = _Batch()
+            asyncio.get_running_loop().create_task(self._flush(key, batch, run))
+        position = len(batch.queries)
+        batch.queries.append(query)
+        batch.timeouts.append(timeout)
+        if len(batch.queries) >= self.max_size:
+            self._close(key, batch)
+        try:
+            # a caller giving up must not cancel the batch of the others
+            results = await asyncio.wait_for(asyncio.shield(batch.result), timeout)
+        except asyncio.TimeoutError:
+            batch.abandoned.add(position)
+            raise DeadlineExceeded(f"Request did not finish within {timeout}s")
+        if isinstance(results[position], Exception):
+            raise results[position]
+        return results[position]
+
+    async def _flush(self, key: Hashable, batch: _Batch, run: BatchRunner):
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        self._close(key, batch)
+
+        size = len(batch.queries)
+        SEARCH_BATCH_SIZE.observe(size)
+        SEARCH_BATCH_FILL.observe(size / self.max_size)
+        log_event(logger, logging.DEBUG, "Search batch", size=size)
+        timeout = None if None in batch.timeouts else max(batch.timeouts)
+        try:
+            batch.result.set_result(await run(batch.queries, timeout))
+        except Exception as e:
+            if size == 1 or not isinstance(e, self.query_errors):
+                batch.result.set_exception(e)
+            else:
+                log_event(logger, logging.DEBUG, "Search batch failed", error=str(e))
+                # each search still waited for gets its own result or exception
+                waiting = [
+                    position
+                    for position in range(size)
+                    if position not in batch.abandoned
+                ]
+                found = await asyncio.gather(
+                    *(
+                        self._run_one(batch.queries[position], run, timeout)
+                        for position in waiting
+                    ),
+                    return_exceptions=True,
+                )
+                results: List[Any] = [e] * size
+                for position, result in zip(waiting, found):
+                    results[position] = result
+                batch.result.set_result(results)
+        # retrieve the exception, in case every caller already gave up
+        batch.result.exception()
+
+    async def _run_one(
+        self, query: Any, run: BatchRunner, timeout: Optional[float]
+    ) -> Any:
+        """
+        Run a single query of a failed batch.
+        """
+        return (await run([query], timeout))[0]
+
+    def _close(self, key: Hashable, batch: _Batch):
+        """
+        Stop the batch from taking more queries.
+        """
+        if self.open.get(key) is batch:
+            del self.open[key]
+        batch.full.set()
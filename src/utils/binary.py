@@ -0,0 +1,111 @@
+import json
+import struct
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+# Content type of the binary endpoints. All numbers are little-endian.
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+_VECTOR = np.dtype("<f4")
+_UINT = np.dtype("<u4")
+
+
+def decode_vectors(body: bytes, dim: int) -> np.ndarray:
+    """
+    View a body of packed float32 vectors as an (n, dim) array without copying
+    (read-only, as it shares the body's memory). Raises ValueError if the body
+    is empty or not a whole number of vectors.
+    """
+    if dim < 1:
+        raise ValueError("dim must be positive")
+    if not body or len(body) % (dim * _VECTOR.itemsize):
+        raise ValueError(
+            f"Body of {len(body)} bytes is not a whole number of {dim}-dim float32 "
+            "vectors"
+        )
+    return np.frombuffer(body, dtype=_VECTOR).reshape(-1, dim)
+
+
+def decode_chunks(body: bytes) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    Split a binary chunk upload into its chunk records and their embeddings:
+
+        uint32       length of the header in bytes
+        header       UTF-8 JSON list of chunk records without embeddings,
+                     e.g. [{"id": ..., "text": ..., "metadata": {...}}, ...]
+        float32[]    one embedding per record, row after row
+
+    The dimension follows from the size of the embeddings. Raises ValueError
+    for malformed bodies.
+    """
+    if len(body) < _UINT.itemsize:
+        raise ValueError("Body too short for a header length")
+    (header_size,) = struct.unpack_from("<I", body)
+    start = _UINT.itemsize + header_size
+    if start > len(body):
+        raise ValueError("Header length exceeds the body")
+    records = json.loads(body[_UINT.itemsize : start])
+    if not isinstance(records, list) or not records:
+        raise ValueError("Header must be a non-empty JSON list of chunk records")
+    if not all(isinstance(record, dict) for record in records):
+        raise ValueError("Chunk records must be JSON objects")
+    size = len(body) - start
+    if size % (len(records) * _VECTOR.itemsize):
+        raise ValueError(
+            f"{size} bytes of embeddings do not split into {len(records)} vectors"
+        )
+    dim = size // (len(records) * _VECTOR.itemsize)
+    return records, decode_vectors(memoryview(body)[start:], dim)
+
+
+def encode_neighbors(results: List[List[Tuple[str, float]]]) -> bytes:
+    """
+    Pack the (id, distance) results of several queries as
+
+        uint32       number of queries n
+        uint32[n]    number of results of each query
+        float32[m]   distances of all m results, query after query
+        uint32[m]    length of each id in bytes
+        bytes        the UTF-8 ids, concatenated
+    """
+    counts = np.array([len(neighbors) for neighbors in results], dtype=_UINT)
+    distances = np.array(
+        [distance for neighbors in results for _, distance in neighbors],
+        dtype=_VECTOR,
+    )
+    ids = [id.encode() for neighbors in results for id, _ in neighbors]
+    lengths = np.array([len(id) for id in ids], dtype=_UINT)
+    return b"".join(
+        [
+            struct.pack("<I", len(results)),
+            counts.tobytes(),
+            distances.tobytes(),
+            lengths.tobytes(),
+            *ids,
+        ]
+    )
+
+
+def decode_neighbors(payload: bytes) -> List[List[Tuple[str, float]]]:
+    """
+    Unpack `encode_neighbors` output, e.g. in a client.
+    """
+    (n,) = struct.unpack_from("<I", payload)
+    offset = _UINT.itemsize
+    counts = np.frombuffer(payload, dtype=_UINT, count=n, offset=offset)
+    offset += counts.nbytes
+    m = int(counts.sum())
+    distances = np.frombuffer(payload, dtype=_VECTOR, count=m, offset=offset)
+    offset += distances.nbytes
+    lengths = np.frombuffer(payload, dtype=_UINT, count=m, offset=offset)
+    offset += lengths.nbytes
+
+    neighbors = []
+    for length, distance in zip(lengths.tolist(), distances.tolist()):
+        neighbors.append((payload[offset : offset + length].decode(), distance))
+        offset += length
+    results, start = [], 0
+    for count in counts.tolist():
+        results.append(neighbors[start : start + count])
+        start += count
+    return results
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+# Memory cap of the search result cache in bytes; 0 disables it
+QUERY_CACHE_BYTES = int(os.environ.get("VECTOR_DB_QUERY_CACHE_BYTES", str(64 << 20)))
+# Seconds a cached search result stays valid; 0 keeps it until evicted
+QUERY_CACHE_TTL = float(os.environ.get("VECTOR_DB_QUERY_CACHE_TTL", "300"))
+# Query embeddings are rounded to this many decimals before hashing
+QUERY_CACHE_DECIMALS = int(os.environ.get("VECTOR_DB_QUERY_CACHE_DECIMALS", "6"))
+
+# Search results of one query: (id, distance) tuples sorted by distance
+Neighbors = Tuple[Tuple[str, float], ...]
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache of search results with a time-to-live and a memory cap.
+
+    Keys include the version of the library they were computed against (see
+    `query_key`), so a re-index or chunk change makes older entries unreachable;
+    they are evicted as the least recently used ones. Sizes are estimates of
+    the Python objects held per entry.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes  # 0 disables the cache
+        self.ttl = ttl  # Seconds an entry stays valid, 0 for no expiry
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, Tuple[float, int, Neighbors]]" = (
+            OrderedDict()
+        )  # key -> (expiry time, size, results), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Neighbors]:
+        """
+        Cached results for a key, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, results: List[Tuple[str, float]]):
+        """
+        Cache the results for a key, evicting least recently used entries to
+        stay under the memory cap.
+        """
+        if not self.max_bytes:
+            return
+        value = tuple(results)
+        size = _estimate_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters and current usage.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _drop(self, key: Hashable):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+
+def query_key(
+    library_id: str,
+    version: int,
+    query: list,
+    k: int,
+    decimals: int,
+    **options,
+) -> Tuple[str, int, bytes, int, str]:
+    """
+    Cache key of a search: library, library version, a hash of the query
+    rounded to `decimals` (so float noise in otherwise identical embeddings
+    still hits), k, and every other option that changes the results (e.g. the
+    metadata filter and search parameters).
+    """
+    # adding 0.0 turns -0.0 into 0.0, which would hash differently
+    rounded = np.round(np.asarray(query, dtype=np.float32), decimals) + 0.0
+    digest = hashlib.blake2b(rounded.tobytes(), digest_size=16).digest()
+    options = json.dumps(options, sort_keys=True, default=str)
+    return library_id, version, digest, k, options
+
+
+def _estimate_size(key: Hashable, value: Neighbors) -> int:
+    """
+    Approximate bytes held by a cache entry.
+    """
+    size = sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+    size += sys.getsizeof(value)
+    for id, distance in value:
+        size += sys.getsizeof((id, distance)) + sys.getsizeof(id) + 24
+    return size
@@ -0,0 +1,97 @@
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+class LockTimeout(TimeoutError):
+    """
+    Raised when a lock could not be acquired within the requested timeout.
+    """
+
+
+class RWLock:
+    """
+    Reader-writer lock that prefers writers.
+
+    Any number of readers may hold the lock together, a writer holds it alone.
+    As soon as a writer is waiting, new readers queue behind it, so a steady
+    stream of readers cannot starve writers. Not reentrant.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0  # Number of threads holding the read lock
+        self._writer = False  # Whether a thread holds the write lock
+        self._waiting_writers = 0  # Writers queued for the lock
+
+    def acquire_read(self, timeout: Optional[float] = None) -> bool:
+        """
+        Acquire the lock for reading. Returns False if the timeout expired.
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: not self._writer and not self._waiting_writers, timeout
+            ):
+                return False
+            self._readers += 1
+            return True
+
+    def release_read(self):
+        """
+        Release the read lock
+        """
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self, timeout: Optional[float] = None) -> bool:
+        """
+        Acquire the lock for writing. Returns False if the timeout expired.
+        """
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                acquired = self._cond.wait_for(
+                    lambda: not self._writer and self._readers == 0, timeout
+                )
+                if acquired:
+                    self._writer = True
+                return acquired
+            finally:
+                self._waiting_writers -= 1
+                if not self._waiting_writers:
+                    # readers held back by this writer may go ahead now
+                    self._cond.notify_all()
+
+    def release_write(self):
+        """
+        Release the write lock
+        """
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self, timeout: Optional[float] = None):
+        """
+        Hold the read lock for the duration of a with block.
+        """
+        if not self.acquire_read(timeout):
+            raise LockTimeout(f"Timed out after {timeout}s waiting for read lock")
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self, timeout: Optional[float] = None):
+        """
+        Hold the write lock for the duration of a with block.
+        """
+        if not self.acquire_write(timeout):
+            raise LockTimeout(f"Timed out after {timeout}s waiting for write lock")
+        try:
+            yield self
+        finally:
+            self.release_write()
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Level of the vector_db loggers: DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.environ.get("VECTOR_DB_LOG_LEVEL", "WARNING").upper()
+# "json" logs one JSON object per line, "text" a plain line
+LOG_FORMAT = os.environ.get("VECTOR_DB_LOG_FORMAT", "json")
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+BUILD_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+MEMORY_BUCKETS = tuple(float(4**power) for power in range(8, 19))  # 64 KiB - 64 GiB
+BATCH_BUCKETS = (1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0, 256.0)
+FILL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger of a module, below the "vector_db" logger configured by
+    `configure_logging`.
+    """
+    return logging.getLogger(f"vector_db.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, message: str, **fields):
+    """
+    Log a message with structured fields. Returns right away when the level is
+    disabled, so callers only pay for building the arguments.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object with its structured fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formats a record as a plain line, fields as key=value pairs.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        line = super().format(record)
+        return " ".join([line] + [f"{key}={value}" for key, value in fields.items()])
+
+
+def configure_logging(level: str = LOG_LEVEL, format: str = LOG_FORMAT):
+    """
+    Send the vector_db logs to stderr. Calling it again replaces the handler.
+    """
+    logger = logging.getLogger("vector_db")
+    logger.setLevel(level)
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stderr)
+    if format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            TextFormatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+        )
+    logger.handlers = [handler]
+
+
+class Histogram:
+    """
+    Thread-safe Prometheus histogram with one series per combination of
+    label values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float],
+        labels: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        # label values -> per-bucket counts (the last one is +Inf), sum
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = (
+                    [0] * (len(self.buckets) + 1),
+                    [0.0],
+                )
+            series[0][bucket] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        """
+        Lines of the Prometheus text exposition format.
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [
+                (values, list(counts), total[0])
+                for values, (counts, total) in self.series.items()
+            ]
+        for values, counts, total in sorted(series):
+            labels = [
+                f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)
+            ]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The histograms exposed at /metrics.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Histogram] = {}
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float],
+        labels: Sequence[str] = (),
+    ) -> Histogram:
+        """
+        Register a histogram, or get the one already registered under the name.
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help, buckets, labels)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "vector_db_stage_seconds",
+    "Time spent in each stage of serving a request",
+    LATENCY_BUCKETS,
+    ("stage",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "vector_db_request_seconds",
+    "HTTP request latency",
+    LATENCY_BUCKETS,
+    ("method", "endpoint", "status"),
+)
+BUILD_SECONDS = REGISTRY.histogram(
+    "vector_db_index_build_seconds",
+    "Duration of successful index builds",
+    BUILD_BUCKETS,
+    ("algorithm",),
+)
+INDEX_MEMORY_BYTES = REGISTRY.histogram(
+    "vector_db_index_memory_bytes",
+    "Approximate size of built indexes",
+    MEMORY_BUCKETS,
+    ("algorithm",),
+)
+
+SEARCH_BATCH_SIZE = REGISTRY.histogram(
+    "vector_db_search_batch_size",
+    "Single searches coalesced into one index call",
+    BATCH_BUCKETS,
+)
+SEARCH_BATCH_FILL = REGISTRY.histogram(
+    "vector_db_search_batch_fill",
+    "Size of coalesced search batches relative to the maximum batch size",
+    FILL_BUCKETS,
+)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a with block into the stage latency histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
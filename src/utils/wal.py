@@ -0,0 +1,163 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Every record is framed as: payload length (uint32) | crc32 of the payload
+# (uint32) | log sequence number (uint64) | JSON payload
+_FRAME = struct.Struct("<IIQ")
+_SEGMENT_PREFIX = "wal-"
+_SEGMENT_SUFFIX = ".log"
+
+
+class WriteAheadLog:
+    """
+    Append-only log of JSON records with group commit.
+
+    Records get consecutive log sequence numbers (LSNs) and are written to
+    segment files named after the first LSN they hold. `append` only buffers a
+    record; `sync` makes it durable. Concurrent `sync` calls are batched: one
+    thread fsyncs for every record written so far while the others wait for
+    it, so throughput scales with the number of writers instead of being
+    capped at one fsync per record. A torn record at the end of the log (from
+    a crash mid-write) is cut off when the log is opened.
+    """
+
+    def __init__(self, directory: str, commit_delay: float = 0.0):
+        self.directory = directory
+        self.commit_delay = commit_delay  # Seconds a sync waits to gather more records
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._syncing = False
+
+        segments = self._segments()
+        if segments:
+            first_lsn, path = segments[-1]
+            self.last_lsn = first_lsn - 1
+            valid_size = 0
+            for lsn, _, end in self._read_segment(path):
+                self.last_lsn, valid_size = lsn, end
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+            self._path = path
+        else:
+            self.last_lsn = 0
+            self._path = self._segment_path(1)
+        self.synced_lsn = self.last_lsn
+        self._file = open(self._path, "ab")
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """
+        Buffer a record and return its LSN. Call `sync` to make it durable.
+        """
+        payload = json.dumps(record, separators=(",", ":")).encode()
+        with self._cond:
+            lsn = self.last_lsn + 1
+            self._file.write(_FRAME.pack(len(payload), zlib.crc32(payload), lsn))
+            self._file.write(payload)
+            self.last_lsn = lsn
+            return lsn
+
+    def sync(self, lsn: Optional[int] = None):
+        """
+        Wait until every record up to `lsn` (default: all appended) is on disk.
+        """
+        with self._cond:
+            lsn = self.last_lsn if lsn is None else lsn
+            while self.synced_lsn < lsn:
+                if self._syncing:
+                    # another thread is syncing; it may cover this record too
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                self._cond.release()
+                try:
+                    if self.commit_delay:
+                        time.sleep(self.commit_delay)
+                    with self._cond:
+                        target = self.last_lsn
+                        self._file.flush()
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self.synced_lsn = max(self.synced_lsn, target)
+
+    def rotate(self) -> int:
+        """
+        Sync the current segment and start a new one. Returns the last LSN of
+        the closed segment; later records go to the new segment.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self._syncing)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.synced_lsn = self.last_lsn
+            self._file.close()
+            self._path = self._segment_path(self.last_lsn + 1)
+            self._file = open(self._path, "ab")
+            return self.last_lsn
+
+    def records(self, after_lsn: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Yield (lsn, record) for every record after `after_lsn`, in order.
+        """
+        with self._cond:
+            self._file.flush()
+        segments = self._segments()
+        for i, (first_lsn, path) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= after_lsn + 1:
+                continue  # every record of this segment is older
+            for lsn, payload, _ in self._read_segment(path):
+                if lsn > after_lsn:
+                    yield lsn, json.loads(payload)
+
+    def truncate_before(self, lsn: int):
+        """
+        Delete the segments that only hold records up to `lsn`.
+        """
+        segments = self._segments()
+        for (_, path), (next_first_lsn, _) in zip(segments, segments[1:]):
+            if next_first_lsn - 1 <= lsn and path != self._path:
+                os.remove(path)
+
+    def close(self):
+        with self._cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        """
+        (first LSN, path) of every segment, oldest first.
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                first_lsn = int(name[len(_SEGMENT_PREFIX) : -len(_SEGMENT_SUFFIX)])
+                segments.append((first_lsn, os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _segment_path(self, first_lsn: int) -> str:
+        name = f"{_SEGMENT_PREFIX}{first_lsn:020d}{_SEGMENT_SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def _read_segment(self, path: str) -> Iterator[Tuple[int, bytes, int]]:
+        """
+        Yield (lsn, payload, end offset) per record, stopping at a torn record.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            length, crc, lsn = _FRAME.unpack_from(data, offset)
+            start, end = offset + _FRAME.size, offset + _FRAME.size + length
+            payload = data[start:end]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            yield lsn, payload, end
+            offset = end